@@ -0,0 +1,178 @@
+"""
+Semantic answer cache for repeated questions.
+
+Near-identical questions ("important topics in Unit 3 IoT?") retrieve the same
+chunks and would produce the same answer. An entry is reused when:
+
+- it was made for the same namespace: index fingerprint, prompt template
+  version, LLM settings and task (chat / mcq / summary),
+- the question retrieved exactly the same chunk ids, and
+- the cosine similarity of the question embeddings is above ``threshold``.
+
+Entries expire after ``ttl_s`` and the least recently used are evicted beyond
+``max_entries``. When a lookup arrives with a new index fingerprint, entries for
+older fingerprints are dropped, so rebuilding the index invalidates the cache.
+A shared cache serves callers with different preferences, so ``lookup`` also
+takes a per-call threshold and a (shorter) maximum age.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.92
+DEFAULT_TTL_S = 6 * 3600
+DEFAULT_MAX_ENTRIES = 2048
+
+
+def template_version(*templates) -> str:
+    """Short hash of prompt templates; editing a prompt changes it and misses old answers."""
+    h = hashlib.sha256()
+    for template in templates:
+        h.update(repr(template).encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+class CachedAnswer(NamedTuple):
+    answer: str
+    similarity: float
+
+
+class _Entry(NamedTuple):
+    bucket: Tuple
+    vector: np.ndarray
+    answer: str
+    created: float
+
+
+def _unit(vector: Sequence[float]) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else v
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        ttl_s: float = DEFAULT_TTL_S,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()  # LRU order, oldest first
+        self._buckets: Dict[Tuple, List[int]] = {}
+        self._fingerprint: Optional[str] = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _drop_locked(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        ids = self._buckets[entry.bucket]
+        ids.remove(entry_id)
+        if not ids:
+            del self._buckets[entry.bucket]
+
+    def _check_fingerprint_locked(self, fingerprint: str):
+        if fingerprint != self._fingerprint:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._buckets.clear()
+            self._fingerprint = fingerprint
+
+    def invalidate(self):
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._buckets.clear()
+
+    def lookup(
+        self,
+        fingerprint: str,
+        namespace: Hashable,
+        question_vector: Sequence[float],
+        chunk_ids: Sequence[str],
+        threshold: Optional[float] = None,
+        ttl_s: Optional[float] = None,
+    ) -> Optional[CachedAnswer]:
+        """
+        Best cached answer for a similar question over the same chunks, or None.
+        ``threshold`` and ``ttl_s`` override the cache's own for this lookup only; entries
+        older than the caller's ``ttl_s`` are skipped, and only dropped past the cache's.
+        """
+        bucket = (namespace, tuple(chunk_ids))
+        query = _unit(question_vector)
+        now = time.time()
+        max_age = self.ttl_s if ttl_s is None else min(ttl_s, self.ttl_s)
+        with self._lock:
+            self._check_fingerprint_locked(fingerprint)
+            best_id, best_sim = None, self.threshold if threshold is None else threshold
+            for entry_id in list(self._buckets.get(bucket, ())):
+                entry = self._entries[entry_id]
+                age = now - entry.created
+                if age > self.ttl_s:
+                    self._drop_locked(entry_id)
+                    self.expirations += 1
+                    continue
+                if age > max_age:
+                    continue
+                sim = float(np.dot(entry.vector, query)) if entry.vector.shape == query.shape else -1.0
+                if sim >= best_sim:
+                    best_id, best_sim = entry_id, sim
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+            return CachedAnswer(entry.answer, best_sim)
+
+    def store(
+        self,
+        fingerprint: str,
+        namespace: Hashable,
+        question_vector: Sequence[float],
+        chunk_ids: Sequence[str],
+        answer: str,
+    ):
+        bucket = (namespace, tuple(chunk_ids))
+        with self._lock:
+            self._check_fingerprint_locked(fingerprint)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(bucket, _unit(question_vector), answer, time.time())
+            self._buckets.setdefault(bucket, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop_locked(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 3),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
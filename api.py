@@ -0,0 +1,365 @@
+"""
+Headless HTTP API over the same ingestion, retrieval and prompt code as app.py.
+
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+Endpoints: POST /ingest (multipart files, optional ``remove`` names), POST /ask,
+POST /mcq, POST /summary (JSON; ``"stream": true`` returns plain-text tokens as
+they are generated), GET /health, GET /indexes, GET /stats, GET /metrics
+(Prometheus text format), GET /debug/traces (the latest per-stage request
+timelines) and the background-job routes below. Every request is traced (see ``telemetry.py``) and logged as one
+JSON line on stderr.
+
+One server hosts many course indexes: ``/ingest`` takes an ``index`` form field
+and the question endpoints an ``"index"`` JSON field naming the one to use
+(default: ``RAG_INDEX_DIR``). Indexes are loaded on first use and the least
+recently used are unloaded past ``RAG_INDEX_MAX_MB`` (see ``index_manager.py``).
+
+``/ingest`` with ``background=true`` queues the build (see ``jobs.py``) and
+answers 202 with a job id at once; GET /jobs (optionally ``?index=``) and
+GET /jobs/{id} report progress, POST /jobs/{id}/cancel stops a build.
+
+Concurrent questions are micro-batched into one embedding call and one FAISS
+search (see ``query_batcher.py``). Configuration comes from environment variables:
+
+    RAG_INDEX_DIR       persisted index to serve and update when no name is given (./rag_index)
+    RAG_INDEX_ROOT      directory holding the named course indexes (./rag_indexes)
+    RAG_INDEX_MAX_MB    loaded-index budget across all names
+    RAG_JOBS_DIR        background job table and spooled uploads (./rag_jobs)
+    RAG_JOB_WORKERS     background builds run at once
+    RAG_EMB_MODEL       sentence-transformers model (all-MiniLM-L6-v2)
+    RAG_EMB_THREADS     torch intra-op threads for the encoder, set once at startup
+    RAG_EMBEDDINGS      "sentence-transformers" or "hash" (``HashingEmbeddings``, no model download)
+    RAG_LLM             "gemini" or "fake" (canned streamed answer, no network)
+    RAG_LLM_MODEL       Gemini model name
+    RAG_TOP_K, RAG_CHUNK_SIZE, RAG_CHUNK_OVERLAP, RAG_INGEST_WORKERS
+    RAG_CONTEXT_TOKENS  prompt context budget (see ``context_builder.py``)
+    RAG_BATCH_WAIT_MS, RAG_BATCH_MAX
+    RAG_IVF_NPROBE, RAG_HNSW_EF_SEARCH   ANN search effort; a request's ``nprobe`` / ``ef_search`` override them
+
+``RAG_EMBEDDINGS=hash RAG_LLM=fake`` runs the whole service offline for load tests.
+"""
+
+import os
+import time
+from typing import List, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel, FakeListChatModel
+from langchain_google_genai import ChatGoogleGenerativeAI
+from pydantic import BaseModel
+
+from answer_cache import AnswerCache
+from context_builder import DEFAULT_CONTEXT_TOKENS
+from embedding_cache import DEFAULT_CACHE_DIR
+from embedding_engine import DEFAULT_HASHING_DIM, configure_threads
+from index_manager import DEFAULT_INDEX_NAME, DEFAULT_INDEX_ROOT, DEFAULT_MAX_INDEX_MB, IndexManager
+from index_store import IndexManifest
+from jobs import DEFAULT_JOBS_DIR, JobQueue
+from knowledge_base import HASHING_PREFIX, chunk_documents, index_settings, make_embeddings, update_knowledge_base
+from query_batcher import DEFAULT_MAX_BATCH, DEFAULT_MAX_WAIT_MS, BatchedRetriever, QueryBatcher
+from rag_engine import CacheContext, GenerationRun, RagEngine, format_sources
+from resources import REGISTRY
+import snapshots
+import telemetry
+from vector_index import DEFAULT_EF_SEARCH, DEFAULT_NPROBE
+
+INDEX_DIR = os.getenv("RAG_INDEX_DIR", "./rag_index")
+INDEX_ROOT = os.getenv("RAG_INDEX_ROOT", DEFAULT_INDEX_ROOT)
+MAX_INDEX_MB = int(os.getenv("RAG_INDEX_MAX_MB", str(DEFAULT_MAX_INDEX_MB)))
+JOBS_DIR = os.getenv("RAG_JOBS_DIR", DEFAULT_JOBS_DIR)
+JOB_WORKERS = int(os.getenv("RAG_JOB_WORKERS", "1"))
+EMB_MODEL = os.getenv("RAG_EMB_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDINGS_BACKEND = os.getenv("RAG_EMBEDDINGS", "sentence-transformers")
+LLM_BACKEND = os.getenv("RAG_LLM", "gemini")
+LLM_MODEL = os.getenv("RAG_LLM_MODEL", "gemini-1.5-pro-latest")
+TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", str(DEFAULT_NPROBE)))
+HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", str(DEFAULT_EF_SEARCH)))
+CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "800"))
+CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "120"))
+CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", str(DEFAULT_CONTEXT_TOKENS)))
+INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_EMBEDDING_DIM = DEFAULT_HASHING_DIM
+FAKE_ANSWER = "Offline answer from the fake LLM backend, built from the retrieved context."
+FAKE_TOKEN_DELAY_S = 0.002
+
+
+def make_llm() -> BaseChatModel:
+    if LLM_BACKEND == "fake":
+        return FakeListChatModel(responses=[FAKE_ANSWER], sleep=FAKE_TOKEN_DELAY_S)
+    return ChatGoogleGenerativeAI(model=LLM_MODEL, temperature=0.2)
+
+
+def api_embedding_spec() -> dict:
+    """``make_embeddings`` arguments for this server's backend; queued jobs carry them in their spec."""
+    if EMBEDDINGS_BACKEND == "hash":
+        return {"emb_model_name": f"{HASHING_PREFIX}{HASH_EMBEDDING_DIM}"}
+    return {"emb_model_name": EMB_MODEL, "cache_dir": DEFAULT_CACHE_DIR}
+
+
+def api_embeddings() -> Embeddings:
+    return make_embeddings(**api_embedding_spec())
+
+
+def api_settings() -> dict:
+    return index_settings(api_embedding_spec()["emb_model_name"], CHUNK_SIZE, CHUNK_OVERLAP)
+
+
+app = FastAPI(title="AI College Assistant API")
+telemetry.setup_logging()
+configure_threads()
+engine = REGISTRY.get_or_create(
+    "rag_engine", (LLM_BACKEND, LLM_MODEL), lambda: RagEngine(make_llm(), llm_key=(LLM_BACKEND, LLM_MODEL)),
+    pinned=True,
+)
+batcher = QueryBatcher(
+    float(os.getenv("RAG_BATCH_WAIT_MS", DEFAULT_MAX_WAIT_MS)), int(os.getenv("RAG_BATCH_MAX", DEFAULT_MAX_BATCH))
+)
+indexes = IndexManager(INDEX_ROOT, MAX_INDEX_MB * 1024 * 1024)
+indexes.register(DEFAULT_INDEX_NAME, INDEX_DIR)
+jobs = JobQueue(JOBS_DIR, JOB_WORKERS)
+
+
+def index_dir(name: Optional[str]) -> str:
+    try:
+        return indexes.path(name or DEFAULT_INDEX_NAME)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+def current_manifest(name: Optional[str] = None) -> IndexManifest:
+    """An index's manifest, re-read only when a writer (maybe another worker) published a new generation."""
+    index_dir(name)  # 400 on a bad name
+    return indexes.status(name or DEFAULT_INDEX_NAME).manifest
+
+
+class AskRequest(BaseModel):
+    question: str
+    k: Optional[int] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    stream: bool = False
+    index: Optional[str] = None
+
+
+class TopicRequest(BaseModel):
+    topic: str
+    k: Optional[int] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    stream: bool = False
+    index: Optional[str] = None
+
+
+class AnswerResponse(BaseModel):
+    answer: str
+    sources: str
+    chunk_ids: List[Optional[str]]
+    cached: bool
+    first_token_ms: Optional[float]
+    total_ms: Optional[float]
+    context_tokens: Optional[int]
+    tokens_saved: int
+    index: str
+    trace_id: str
+
+
+def _ingest(name: str, files: dict, remove: List[str]) -> dict:
+    persist_dir = index_dir(name)
+    # One writer per index, across API workers too; builds of different courses run side by side.
+    trace = telemetry.trace("ingest", index=name, files=len(files), removed=len(remove))
+    with snapshots.writer(persist_dir), trace as tr:
+        started = time.perf_counter()
+        result = update_knowledge_base(
+            # A private copy: readers keep fingerprinting the cached manifest while this one is edited.
+            files, api_embeddings(), persist_dir, IndexManifest.load(persist_dir), api_settings(),
+            lambda docs: chunk_documents(docs, CHUNK_SIZE, CHUNK_OVERLAP), INGEST_WORKERS, remove=remove,
+        )
+        tr.set(pages=result.stats.pages, chunks=result.stats.chunks, errors=len(result.stats.errors))
+        return {
+            "index": name,
+            "indexed": [t["file"] for t in result.stats.file_timings if t["file"] not in dict(result.stats.errors)],
+            "skipped": result.skipped,
+            "removed": remove,
+            "errors": [{"file": name, "error": err} for name, err in result.stats.errors],
+            "chunks": result.stats.chunks,
+            "total_vectors": result.vs.index.ntotal if result.vs is not None else 0,
+            "rebuilt": result.rebuilt,
+            "bytes_written": result.stats.bytes_written,
+            "seconds": round(time.perf_counter() - started, 3),
+            "trace_id": tr.id,
+        }
+
+
+@app.post("/ingest")
+async def ingest(
+    files: List[UploadFile] = File(default=[]),
+    remove: List[str] = Form(default=[]),
+    index: str = Form(default=DEFAULT_INDEX_NAME),
+    background: bool = Form(default=False),
+):
+    persist_dir = index_dir(index)
+    if not files and not remove:
+        raise HTTPException(400, "Upload at least one file or name one to remove")
+    unsupported = [f.filename for f in files if not f.filename.lower().endswith((".pdf", ".txt"))]
+    if unsupported:
+        raise HTTPException(415, f"Only PDF and TXT files are supported: {', '.join(unsupported)}")
+    data = {f.filename: await f.read() for f in files}
+    os.makedirs(persist_dir, exist_ok=True)
+    if background:
+        job_id = jobs.submit(
+            persist_dir, data, remove, api_settings(), embeddings=api_embedding_spec(), workers=INGEST_WORKERS
+        )
+        return JSONResponse({"job_id": job_id, "index": index, "state": "queued"}, status_code=202)
+    return await run_in_threadpool(_ingest, index, data, remove)
+
+
+@app.get("/jobs")
+async def list_jobs(index: Optional[str] = None, limit: int = 20):
+    return jobs.list(index_dir(index) if index else None, limit)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"No job {job_id}")
+    return job
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    if jobs.get(job_id) is None:
+        raise HTTPException(404, f"No job {job_id}")
+    return {"job_id": job_id, "cancelled": jobs.cancel(job_id), "state": jobs.get(job_id)["state"]}
+
+
+def _vectorstore_or_409(name: str):
+    manifest = current_manifest(name)
+    if not indexes.exists(name):
+        raise HTTPException(409, f"No index {name!r} yet: POST /ingest some documents to it first")
+    if not manifest.compatible(api_settings()):
+        raise HTTPException(409, "The index was built with other embedding/chunk settings; re-ingest to rebuild it")
+    return indexes.get(name, api_embeddings()).vs, manifest
+
+
+async def _finish_after(tokens, tr: telemetry.Trace):
+    """Stream ``tokens``, finishing the request trace once the last one is sent (or the client leaves)."""
+    try:
+        async for part in tokens:
+            yield part
+    finally:
+        tr.finish()
+
+
+async def _answer(
+    task: str,
+    query: str,
+    k: Optional[int],
+    stream: bool,
+    index: Optional[str],
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+):
+    if not query.strip():
+        raise HTTPException(400, "Empty query")
+    name = index or DEFAULT_INDEX_NAME
+    # A cold index loads (migration, mmap, BM25, model weights) off the event loop.
+    vs, manifest = await run_in_threadpool(_vectorstore_or_409, name)
+    cache = REGISTRY.get_or_create("answer_cache", os.path.abspath(index_dir(name)), AnswerCache)
+    cache_ctx = CacheContext(cache, manifest.fingerprint(), vs.embedding_function)
+    retriever = BatchedRetriever(
+        vectorstore=vs,
+        batcher=batcher,
+        k=k or TOP_K,
+        nprobe=nprobe or IVF_NPROBE,
+        ef_search=ef_search or HNSW_EF_SEARCH,
+    )
+    tr = telemetry.Trace(task, index=name, k=k or TOP_K, query_chars=len(query), stream=stream)
+    try:
+        with telemetry.use(tr):
+            docs: List[Document] = await engine.aretrieve(retriever, query)
+    except TimeoutError as e:
+        tr.finish("error")
+        raise HTTPException(504, str(e))
+    if stream:
+        headers = {
+            "X-Sources": format_sources(docs) if docs else "(no sources)", "X-Index": name, "X-Trace-Id": tr.id
+        }
+        tokens = engine.astream(task, query, docs, GenerationRun(tr), cache_ctx, CONTEXT_TOKENS)
+        return StreamingResponse(_finish_after(tokens, tr), media_type="text/plain", headers=headers)
+
+    run = GenerationRun(tr)
+    tokens = engine.astream(task, query, docs, run, cache_ctx, CONTEXT_TOKENS)
+    parts = [part async for part in _finish_after(tokens, tr)]
+    return AnswerResponse(
+        answer="".join(parts),
+        sources=format_sources(docs) if docs else "(no sources)",
+        chunk_ids=[d.id for d in docs],
+        cached=run.cached,
+        first_token_ms=round(run.first_token_s * 1000, 1) if run.first_token_s is not None else None,
+        total_ms=round(run.total_s * 1000, 1) if run.total_s is not None else None,
+        context_tokens=run.context_tokens,
+        tokens_saved=run.tokens_saved,
+        index=name,
+        trace_id=tr.id,
+    )
+
+
+@app.post("/ask")
+async def ask(req: AskRequest):
+    return await _answer("chat", req.question, req.k, req.stream, req.index, req.nprobe, req.ef_search)
+
+
+@app.post("/mcq")
+async def mcq(req: TopicRequest):
+    return await _answer("mcq", req.topic, req.k, req.stream, req.index, req.nprobe, req.ef_search)
+
+
+@app.post("/summary")
+async def summary(req: TopicRequest):
+    return await _answer("summary", req.topic, req.k, req.stream, req.index, req.nprobe, req.ef_search)
+
+
+@app.get("/health")
+async def health(index: str = DEFAULT_INDEX_NAME):
+    manifest = current_manifest(index)
+    return {
+        "status": "ok", "index": indexes.exists(index), "documents": len(manifest),
+        "chunks": manifest.chunk_count,
+    }
+
+
+@app.get("/indexes")
+async def list_indexes():
+    return [
+        {"name": name, "documents": len(manifest), "chunks": manifest.chunk_count}
+        for name, manifest in ((name, current_manifest(name)) for name in indexes.names())
+    ]
+
+
+@app.get("/stats")
+async def stats(index: str = DEFAULT_INDEX_NAME):
+    cache = REGISTRY.get("answer_cache", os.path.abspath(index_dir(index)))
+    return {
+        "engine": engine.stats(),
+        "batcher": batcher.stats(),
+        "answer_cache": cache.stats() if cache is not None else None,
+        "indexes": indexes.stats(),
+        "registry": {"hits": REGISTRY.hits, "misses": REGISTRY.misses},
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(telemetry.render_metrics(), media_type=telemetry.PROMETHEUS_CONTENT_TYPE)
+
+
+@app.get("/debug/traces")
+async def debug_traces(n: int = 10):
+    return [tr.to_dict() for tr in telemetry.recent(n)]
@@ -1,24 +1,40 @@
+import contextlib
 import os
-import io
-import time
-from typing import List, Tuple, Optional, Dict
+from typing import Iterator, List, Tuple, Optional
 import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
 
 # LangChain core
 from langchain.docstore.document import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
 # LLM provider (Now Google via langchain-google-genai)
 from langchain_google_genai import ChatGoogleGenerativeAI
 
-# PDF parsing
-from pypdf import PdfReader
+# Local helpers
+from answer_cache import DEFAULT_THRESHOLD, AnswerCache
+from context_builder import DEFAULT_CONTEXT_TOKENS
+from embedding_cache import CachedEmbeddings, DEFAULT_CACHE_DIR, STORAGE_DTYPES
+from embedding_engine import DEFAULT_ENCODE_BATCH, configure_threads
+from index_manager import DEFAULT_INDEX_NAME, DEFAULT_INDEX_ROOT, DEFAULT_MAX_INDEX_MB, IndexManager
+from index_store import IndexManifest, file_hash
+from jobs import DEFAULT_JOBS_DIR, JobQueue
+from knowledge_base import (
+    chunk_documents, index_settings, make_embeddings, update_knowledge_base,
+)
+from query_batcher import DEFAULT_MAX_BATCH, DEFAULT_MAX_WAIT_MS, BatchedRetriever, QueryBatcher
+from rag_engine import CacheContext, GenerationRun, RagEngine, format_sources
+from resources import REGISTRY
+from shared_index import Lease, SharedIndexPool
+import snapshots
+from sparse_index import RETRIEVAL_MODES, BM25Index, HybridRetriever
+import telemetry
+from vector_index import (
+    DEFAULT_EF_SEARCH, DEFAULT_NPROBE, INDEX_TYPES, all_vectors, index_kind, recall_latency_report,
+)
+from pipeline import DEFAULT_BATCH_SIZE, PipelineStats
 
 # -----------------------------
 # App Config
@@ -26,6 +42,32 @@ from pypdf import PdfReader
 load_dotenv()
 st.set_page_config(page_title="AI College Assistant (RAG)", page_icon="📚", layout="wide")
 
+# Named course indexes under ./rag_indexes (plus the original ./rag_index as "default"), shared by every session.
+# Their memory budget is server configuration, read once like the API's: RAG_INDEX_MAX_MB.
+index_manager = REGISTRY.get_or_create(
+    "index_manager", DEFAULT_INDEX_ROOT,
+    lambda: IndexManager(DEFAULT_INDEX_ROOT, int(os.getenv("RAG_INDEX_MAX_MB", DEFAULT_MAX_INDEX_MB)) * 1024 * 1024),
+    pinned=True,
+)
+index_manager.register(DEFAULT_INDEX_NAME, "./rag_index")
+# In-memory indexes keyed by content: sessions uploading the same files share one copy.
+shared_indexes = REGISTRY.get_or_create("shared_indexes", "default", SharedIndexPool, pinned=True)
+# Background builds for course indexes; jobs outlive the session (and the process) that queued them.
+job_queue = REGISTRY.get_or_create("job_queue", DEFAULT_JOBS_DIR, JobQueue, pinned=True)
+# One scheduler for every session, so concurrent questions against a shared index are batched together.
+# Its window is server configuration, set like the API's: RAG_BATCH_WAIT_MS, RAG_BATCH_MAX.
+batcher = REGISTRY.get_or_create(
+    "query_batcher", "default",
+    lambda: QueryBatcher(
+        float(os.getenv("RAG_BATCH_WAIT_MS", DEFAULT_MAX_WAIT_MS)), int(os.getenv("RAG_BATCH_MAX", DEFAULT_MAX_BATCH))
+    ),
+    pinned=True,
+)
+# torch's encoder thread pool is process-wide: sized once from RAG_EMB_THREADS, not per session.
+configure_threads()
+# Shared answer caches keep entries this long; each session's TTL slider can only ask for younger ones.
+ANSWER_TTL_MAX_H = 48
+
 # Sidebar: Model/Index settings
 with st.sidebar:
     st.title("⚙️ Settings")
@@ -39,98 +81,137 @@ with st.sidebar:
     CHUNK_SIZE = st.slider("Chunk size", 300, 2000, 800, 50)
     CHUNK_OVERLAP = st.slider("Chunk overlap", 0, 400, 120, 10)
     TOP_K = st.slider("Top-K retrieved chunks", 1, 10, 4)
+    CONTEXT_TOKENS = st.slider(
+        "Context token budget", 300, 6000, DEFAULT_CONTEXT_TOKENS, 100,
+        help="Overlapping chunks are merged and the best passages packed into this many prompt tokens",
+    )
+    RETRIEVAL_MODE = st.selectbox(
+        "Retrieval", RETRIEVAL_MODES, 0,
+        help="hybrid fuses BM25 keyword matches (course codes, cipher names) with vector search",
+    )
+    CPU_COUNT = os.cpu_count() or 1
+    INGEST_WORKERS = st.slider("PDF extraction workers", 1, CPU_COUNT, min(4, CPU_COUNT))
+    INSERT_BATCH_SIZE = st.select_slider(
+        "Index insert batch (chunks)", [64, 128, 256, 512, 1024], DEFAULT_BATCH_SIZE,
+        help="Chunks embedded per call; the encoder length-sorts within each call to cut padding.",
+    )
+    ENCODE_BATCH = st.select_slider("Encoder batch size", [8, 16, 32, 64, 128, 256], DEFAULT_ENCODE_BATCH)
+    EMB_NORMALIZE = st.checkbox("Normalize embeddings", value=False)
     TEMPERATURE = st.slider("LLM temperature", 0.0, 1.0, 0.2, 0.1)
     MODEL_NAME = st.selectbox("LLM model", ["gpt-4o-mini", "gpt-4o", "gpt-4o-mini-2024-08-06", "gpt-3.5-turbo"], 0)
+    ANSWER_CACHE_ON = st.checkbox("Reuse answers to similar questions", value=True)
+    ANSWER_SIM = st.slider(
+        "Answer cache similarity", 0.80, 1.00, DEFAULT_THRESHOLD, 0.01, disabled=not ANSWER_CACHE_ON,
+        help="Cosine similarity two questions need (with identical retrieved chunks) to share an answer",
+    )
+    ANSWER_TTL_H = st.slider("Answer cache TTL (hours)", 1, ANSWER_TTL_MAX_H, 6, disabled=not ANSWER_CACHE_ON)
 
     st.divider()
-    st.caption("Optional: persist index between runs")
-    persist_toggle = st.checkbox("Persist FAISS index (./rag_index)", value=False)
+    st.caption("Vector index: approximate types trade a little recall for much faster search")
+    INDEX_TYPE = st.selectbox("Index type", INDEX_TYPES, 0)
+    IVF_NLIST = st.number_input("IVF lists (0 = auto)", 0, 65536, 0, 64, disabled=not INDEX_TYPE.startswith("ivf"))
+    IVF_NPROBE = st.slider("IVF nprobe", 1, 256, DEFAULT_NPROBE, disabled=not INDEX_TYPE.startswith("ivf"))
+    PQ_M = st.select_slider("PQ sub-quantizers", [8, 16, 32, 48, 64], 16, disabled=INDEX_TYPE != "ivf_pq")
+    HNSW_M = st.select_slider("HNSW links per node", [8, 16, 32, 48, 64], 32, disabled=INDEX_TYPE != "hnsw")
+    HNSW_EF = st.slider("HNSW efSearch", 8, 512, DEFAULT_EF_SEARCH, disabled=INDEX_TYPE != "hnsw")
+
+    st.divider()
+    st.caption("Optional: persist indexes between runs, one per course")
+    persist_toggle = st.checkbox("Persist FAISS index", value=False)
+    COURSE = DEFAULT_INDEX_NAME
+    index_dir = None
     if persist_toggle:
-        index_dir = "./rag_index"
+        COURSE = st.selectbox("Course index", index_manager.names() or [DEFAULT_INDEX_NAME])
+        new_course = st.text_input("…or start a new one", placeholder="e.g. cs301-fall24").strip()
+        try:
+            index_dir = index_manager.path(new_course or COURSE)
+            COURSE = new_course or COURSE
+        except ValueError as e:
+            st.error(str(e))
+            index_dir = index_manager.path(COURSE)
         os.makedirs(index_dir, exist_ok=True)
-    else:
-        index_dir = None
+    BACKGROUND_BUILD = st.checkbox(
+        "Build course indexes in the background", value=True, disabled=not persist_toggle,
+        help="Queue the build as a job: it keeps running if you reload or close the page, and can be cancelled",
+    )
+    st.caption(
+        f"Loaded course indexes budget: {index_manager.max_bytes // (1024 * 1024)} MB (RAG_INDEX_MAX_MB). "
+        "Least recently queried course indexes are unloaded past it; they reload on their next question."
+    )
+
+    st.caption("Embedding cache: rebuilds only embed new or changed chunks")
+    cache_toggle = st.checkbox(f"Cache embeddings ({DEFAULT_CACHE_DIR})", value=True)
+    CACHE_MAX_MB = st.slider("Embedding cache size limit (MB)", 64, 4096, 512, 64)
+    CACHE_DTYPE = st.selectbox("Cached vector storage", STORAGE_DTYPES, 0, help="float16/int8 shrink the cache 2x/4x")
+    cache_dir = DEFAULT_CACHE_DIR if cache_toggle else None
+
+    st.divider()
+    SHOW_TIMELINE = st.checkbox("Show last request timeline (debug)", value=False)
+    with st.expander("Shared resources (all sessions)"):
+        st.caption(f"{len(REGISTRY.entries())} cached · {REGISTRY.hits} reuses / {REGISTRY.misses} loads")
+        index_stats = index_manager.stats()
+        st.caption(
+            f"Course indexes: {len(index_stats['loaded'])}/{index_stats['indexes']} loaded, "
+            f"{index_stats['loaded_mb']:.0f}/{index_stats['max_mb']:.0f} MB, {index_stats['evictions']} unloaded"
+        )
+        pool_stats = shared_indexes.stats()
+        st.caption(
+            f"Shared in-memory indexes: {pool_stats['indexes']} for {pool_stats['sessions']} sessions "
+            f"({pool_stats['vectors']} vectors) · {pool_stats['builds']} built, {pool_stats['attaches']} reused"
+        )
+        for entry in REGISTRY.entries():
+            st.caption(f"{entry['kind']}: {entry['key']} ({entry['age_s']}s{', pinned' if entry['pinned'] else ''})")
+        evict_col1, evict_col2 = st.columns(2)
+        if evict_col1.button("Free indexes"):
+            for name in index_manager.names():
+                index_manager.evict(name)
+            REGISTRY.evict("faiss_index")
+            REGISTRY.evict("sparse_index")
+        if evict_col2.button("Free everything"):
+            # Caches only: the engine, job queue and metrics server are pinned and keep running.
+            for name in index_manager.names():
+                index_manager.evict(name)
+            for kind in ("faiss_index", "sparse_index", "answer_cache"):
+                REGISTRY.evict(kind)
+            batcher.reset_stats()
 
 # -----------------------------
 # Helpers
 # -----------------------------
 
-def read_pdf(file: io.BytesIO, filename: str) -> List[Document]:
-    """Extract text per page from PDF and return as LangChain Documents with metadata."""
-    reader = PdfReader(file)
-    docs = []
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text() or ""
-        if text.strip():
-            docs.append(Document(page_content=text, metadata={"source": filename, "page": i + 1}))
-    return docs
-
-def read_text(file: io.BytesIO, filename: str, encoding: str = "utf-8") -> List[Document]:
-    content = file.read().decode(encoding, errors="ignore")
-    if content.strip():
-        return [Document(page_content=content, metadata={"source": filename, "page": 1})]
-    return []
-
-def chunk_documents(docs: List[Document], chunk_size: int, chunk_overlap: int) -> List[Document]:
-    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    return splitter.split_documents(docs)
-
-def build_or_load_vectorstore(chunks: List[Document], emb_model_name: str, persist_dir: Optional[str]) -> FAISS:
-    embeddings = HuggingFaceEmbeddings(model_name=emb_model_name)
-
-    if persist_dir and os.path.isdir(persist_dir) and any(
-        fname.endswith(".faiss") or fname.endswith(".pkl") for fname in os.listdir(persist_dir)
-    ):
-        vs = FAISS.load_local(persist_dir, embeddings, allow_dangerous_deserialization=True)
-    else:
-        vs = FAISS.from_documents(chunks, embeddings)
-        if persist_dir:
-            vs.save_local(persist_dir)
-    return vs
-
-def save_vectorstore(vs: FAISS, persist_dir: str):
-    vs.save_local(persist_dir)
-
-def format_sources(docs: List[Document]) -> str:
-    seen = []
-    for d in docs:
-        tag = f"{d.metadata.get('source','?')} p.{d.metadata.get('page','?')}"
-        if tag not in seen:
-            seen.append(tag)
-    return "; ".join(seen)
+def get_answer_cache(persist_dir: Optional[str]) -> AnswerCache:
+    """
+    One cache per index: shared by every session for ./rag_index, per session for in-memory
+    indexes. The sidebar's similarity and TTL are applied per lookup (see ``answer_cache_context``).
+    """
+    if persist_dir:
+        return REGISTRY.get_or_create(
+            "answer_cache", os.path.abspath(persist_dir), lambda: AnswerCache(ttl_s=ANSWER_TTL_MAX_H * 3600)
+        )
+    if "answer_cache" not in st.session_state:
+        st.session_state.answer_cache = AnswerCache(ttl_s=ANSWER_TTL_MAX_H * 3600)
+    return st.session_state.answer_cache
+
+def get_retriever(vs: FAISS, k: int, sparse: Optional[BM25Index] = None):
+    """
+    Batched retriever searching with this session's ANN knobs (per query, the shared index
+    is not modified); fused with BM25 in hybrid mode.
+    """
+    knobs = {"nprobe": IVF_NPROBE, "ef_search": HNSW_EF}
+    if RETRIEVAL_MODE == "hybrid" and sparse is not None:
+        return HybridRetriever(vectorstore=vs, sparse=sparse, k=k, batcher=batcher, **knobs)
+    return BatchedRetriever(vectorstore=vs, batcher=batcher, k=k, **knobs)
 
 # -----------------------------
-# System Prompts
+# Telemetry: JSON trace logs on stderr, /metrics for Prometheus if RAG_METRICS_PORT is set
 # -----------------------------
 
-ANSWER_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", """
-You are an AI college assistant. Answer the user's question using ONLY the provided context.
-- If the answer is not in the context, say you don't have that info.
-- Quote important definitions briefly.
-- Return a concise, structured answer.
-- After the answer, add a 'Sources' line listing file names and pages from the context.
-"""),
-    ("user", "Question: {question}\n\nContext:\n{context}\n\nReturn your answer."),
-])
-
-MCQ_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", """
-Create exam-style MCQs from the provided context. Each MCQ must have:
-- A clear question
-- 4 options (A–D)
-- Correct answer key
-- 1-line explanation
-
-Return 5 MCQs in a clean numbered list.
-"""),
-    ("user", "Generate MCQs on: {topic}\n\nContext:\n{context}"),
-])
-
-SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", "Summarize the context into 5 crisp bullet points for quick revision."),
-    ("user", "Summarize topic: {topic}\n\nContext:\n{context}"),
-])
+telemetry.setup_logging()
+METRICS_PORT = int(os.getenv("RAG_METRICS_PORT", "0"))
+if METRICS_PORT:
+    REGISTRY.get_or_create(
+        "metrics_server", METRICS_PORT, lambda: telemetry.start_metrics_server(METRICS_PORT), pinned=True
+    )
 
 # -----------------------------
 # LLM Init
@@ -141,8 +222,60 @@ if not GOOGLE_API_KEY:
     st.warning("OpenAI API key not set. Set GOOGLE_API_KEY env var to enable answers.")
     
 # Use the Gemini model you have access to, e.g., "gemini-1.5-pro-latest" or "gemini-2.5-pro"
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro-latest", temperature=TEMPERATURE)
+# Shared across reruns and sessions, one per model: each session's temperature is applied per call.
+LLM_MODEL = "gemini-1.5-pro-latest"
+llm = REGISTRY.get_or_create("llm", LLM_MODEL, lambda: ChatGoogleGenerativeAI(model=LLM_MODEL))
 output_parser = StrOutputParser()
+# Retrieval + generation run on the engine's event loop, shared by every session.
+engine = REGISTRY.get_or_create("rag_engine", LLM_MODEL, lambda: RagEngine(llm, llm_key=LLM_MODEL), pinned=True)
+
+def active_index() -> Tuple[Optional[FAISS], Optional[BM25Index]]:
+    """
+    The index questions are routed to: the selected course's shared index (loaded on
+    first use, with the embedding model it was built with) or this session's in-memory one.
+    """
+    if not index_dir:
+        return st.session_state.vectorstore, st.session_state.sparse_index
+    if not index_manager.exists(COURSE):
+        return None, None
+    settings = current_manifest.settings
+    embeddings = make_embeddings(
+        settings.get("emb_model", EMB_MODEL), cache_dir, CACHE_MAX_MB, CACHE_DTYPE, ENCODE_BATCH,
+        settings.get("normalize", False),
+    )
+    loaded = index_manager.get(COURSE, embeddings)
+    return loaded.vs, loaded.sparse
+
+def attach_shared_index(lease: Optional[Lease]):
+    """Point this session at a shared in-memory index (or none), releasing the one it held."""
+    old = st.session_state.get("index_lease")
+    if old is not None and old is not lease:
+        old.release()
+    st.session_state.index_lease = lease
+    st.session_state.vectorstore = lease.index.vs if lease is not None else None
+    st.session_state.sparse_index = lease.index.sparse if lease is not None else None
+
+def answer_cache_context(vs: FAISS) -> Optional[CacheContext]:
+    """Answer cache for the active index, or None when caching is switched off."""
+    if not ANSWER_CACHE_ON:
+        return None
+    return CacheContext(
+        get_answer_cache(index_dir), current_manifest.fingerprint(), vs.embedding_function,
+        threshold=ANSWER_SIM, ttl_s=ANSWER_TTL_H * 3600,
+    )
+
+def stream_answer(task: str, query: str, docs: List[Document], run: GenerationRun, vs: FAISS) -> Iterator[str]:
+    """Stream ``task``'s answer with this session's context budget and temperature."""
+    return engine.stream(task, query, docs, run, answer_cache_context(vs), CONTEXT_TOKENS, TEMPERATURE)
+
+def retrieve(query: str, vs: FAISS, sparse: Optional[BM25Index]) -> Optional[List[Document]]:
+    retriever = get_retriever(vs, TOP_K, sparse)
+    try:
+        with st.spinner("Retrieving context…"):
+            return engine.retrieve(retriever, query)
+    except TimeoutError as e:
+        st.error(str(e))
+        return None
 
 # -----------------------------
 # UI Layout
@@ -151,6 +284,19 @@ output_parser = StrOutputParser()
 st.title("📚 AI College Assistant — RAG")
 st.caption("Upload syllabus/notes/past papers. Ask questions. Generate MCQs & summaries. ✨")
 
+# Session state holders
+if "vectorstore" not in st.session_state:
+    st.session_state.vectorstore = None
+if "ingested_docs" not in st.session_state:
+    st.session_state.ingested_docs = []  # for display
+if "manifest" not in st.session_state:
+    st.session_state.manifest = IndexManifest()  # files in the in-memory index
+if "sparse_index" not in st.session_state:
+    st.session_state.sparse_index = None  # BM25 postings for the same chunks
+
+# Course status comes from memory; disk is only read again after a build publishes a new generation.
+current_manifest = index_manager.status(COURSE).manifest if index_dir else st.session_state.manifest
+
 col_u, col_idx = st.columns([3, 2], gap="large")
 
 with col_u:
@@ -159,72 +305,221 @@ with col_u:
         type=["pdf", "txt"],
         accept_multiple_files=True,
     )
+    remove_sel = st.multiselect(
+        "Remove documents from the index",
+        sorted(current_manifest.files),
+        help="Vectors for these files are deleted on the next build.",
+    )
     build_btn = st.button("Build / Update Knowledge Base", type="primary")
 
 with col_idx:
     st.markdown("### 📦 Index Status")
-    if persist_toggle and index_dir and os.path.isdir(index_dir):
-        existing = [f for f in os.listdir(index_dir) if f.endswith(".faiss") or f.endswith(".pkl")]
-        if existing:
-            st.success("Found existing FAISS index. You can chat immediately or rebuild.")
+    if persist_toggle and index_dir:
+        if index_manager.exists(COURSE):
+            st.success(f"Found the '{COURSE}' index. You can chat immediately or rebuild.")
         else:
-            st.info("No persisted index yet. Upload docs and build.")
+            st.info(f"No '{COURSE}' index yet. Upload docs and build.")
     else:
         st.info("In-memory index will be created for this session.")
 
-# Session state holders
-if "vectorstore" not in st.session_state:
-    st.session_state.vectorstore = None
-if "ingested_docs" not in st.session_state:
-    st.session_state.ingested_docs = []  # for display
+    if index_dir:
+        loaded_index = index_manager.peek(COURSE)
+        active_vs = loaded_index.vs if loaded_index is not None else None
+    else:
+        active_vs = st.session_state.vectorstore
+    if active_vs is not None and active_vs.index.ntotal:
+        with st.expander(f"Index type: {index_kind(active_vs.index)} — compare recall vs latency"):
+            if st.button("Run recall/latency report"):
+                with st.spinner("Building candidate indexes over the current vectors…"):
+                    report = recall_latency_report(
+                        all_vectors(active_vs.index),
+                        [
+                            {"kind": "ivf_flat", "nlist": IVF_NLIST, "nprobe": IVF_NPROBE},
+                            {"kind": "ivf_pq", "nlist": IVF_NLIST, "pq_m": PQ_M, "nprobe": IVF_NPROBE},
+                            {"kind": "hnsw", "hnsw_m": HNSW_M, "ef_search": HNSW_EF},
+                        ],
+                        k=TOP_K,
+                    )
+                st.dataframe(pd.DataFrame(report), hide_index=True)
+    if len(current_manifest):
+        st.caption(f"{len(current_manifest)} documents, {current_manifest.chunk_count} chunks indexed")
+    if st.session_state.sparse_index is not None:
+        st.caption(f"BM25: {st.session_state.sparse_index.vocabulary_size} distinct terms")
 
 # -----------------------------
 # Build Index
 # -----------------------------
 
 if build_btn:
-    all_docs: List[Document] = []
-
-    if uploads:
-        for up in uploads:
-            fname = up.name
-            try:
-                if fname.lower().endswith(".pdf"):
-                    docs = read_pdf(up, fname)
-                else:
-                    # txt
-                    up.seek(0)
-                    docs = read_text(up, fname)
-                all_docs.extend(docs)
-            except Exception as e:
-                st.error(f"Failed to read {fname}: {e}")
-
-        if not all_docs:
-            st.warning("No readable text found in the uploaded files.")
+    settings = index_settings(EMB_MODEL, CHUNK_SIZE, CHUNK_OVERLAP, EMB_NORMALIZE)
+    embeddings = make_embeddings(
+        EMB_MODEL, cache_dir, CACHE_MAX_MB, CACHE_DTYPE, ENCODE_BATCH, EMB_NORMALIZE
+    )
+    index_config = {"kind": INDEX_TYPE, "nlist": IVF_NLIST, "pq_m": PQ_M, "hnsw_m": HNSW_M}
+    files = {up.name: up.getvalue() for up in uploads or []}
+    fresh = not current_manifest.compatible(settings)
+    if fresh:
+        st.warning("Embedding model or chunk settings changed — rebuilding the index from these uploads only.")
+
+    shared_lease = None
+    if not index_dir and (files or remove_sel):
+        uploaded = {name: file_hash(data) for name, data in files.items()}
+        shared_lease = shared_indexes.attach(
+            shared_indexes.predict_key(current_manifest, uploaded, remove_sel, settings, index_config)
+        )
+
+    if shared_lease is not None:
+        attach_shared_index(shared_lease)
+        st.session_state.manifest = current_manifest = shared_lease.index.manifest
+        st.success(
+            f"Knowledge base ready ✅  (identical documents were already indexed by another session; "
+            f"total vectors: {shared_lease.index.vs.index.ntotal})"
+        )
+    elif index_dir and BACKGROUND_BUILD and (files or remove_sel):
+        job_id = job_queue.submit(
+            index_dir, files, remove_sel, settings,
+            embeddings=dict(
+                emb_model_name=EMB_MODEL, cache_dir=cache_dir, cache_max_mb=CACHE_MAX_MB, cache_dtype=CACHE_DTYPE,
+                encode_batch=ENCODE_BATCH, normalize=EMB_NORMALIZE,
+            ),
+            index_config=index_config, workers=INGEST_WORKERS, batch_size=INSERT_BATCH_SIZE,
+        )
+        st.info(f"Build queued as job {job_id}. It keeps running if you reload or leave this page.")
+    elif files or remove_sel:
+        if index_dir:
+            # Read under the writer lock below, so no other build can publish in between.
+            existing, existing_sparse, base_manifest = None, None, None
+        elif fresh:
+            attach_shared_index(None)
+            existing, existing_sparse, base_manifest = None, None, current_manifest
         else:
-            with st.spinner("Chunking and embedding documents…"):
-                chunks = chunk_documents(all_docs, CHUNK_SIZE, CHUNK_OVERLAP)
-                vs = build_or_load_vectorstore(chunks, EMB_MODEL, index_dir)
-                st.session_state.vectorstore = vs
-                st.session_state.ingested_docs = [d.metadata for d in chunks[:50]]  # preview
-
-            st.success(f"Knowledge base ready ✅  (chunks: {len(chunks)})")
+            # Shared indexes are read-only: extend a private copy (or the original, if no one else uses it).
+            existing, existing_sparse, base_manifest = shared_indexes.checkout(st.session_state.get("index_lease"))
+            st.session_state.index_lease = None
+        preview: List[dict] = []
+
+        def chunk_fn(docs: List[Document]) -> List[Document]:
+            chunks = chunk_documents(docs, CHUNK_SIZE, CHUNK_OVERLAP)
+            if len(preview) < 50:
+                preview.extend(d.metadata for d in chunks[: 50 - len(preview)])
+            return chunks
+
+        progress = st.progress(0.0, text="Extracting, chunking and embedding new documents…")
+
+        def on_batch(stats: PipelineStats):
+            done = stats.files_done / stats.files_total if stats.files_total else 1.0
+            progress.progress(
+                min(done, 1.0),
+                text=f"{stats.files_done}/{stats.files_total} files · {stats.chunks} chunks embedded "
+                f"({stats.chunks_per_sec:.0f}/s)",
+            )
+
+        write_lock = snapshots.writer(index_dir) if index_dir else contextlib.nullcontext()
+        with write_lock, telemetry.trace("ingest", files=len(files), removed=len(remove_sel)) as tr:
+            st.session_state.last_trace = tr
+            if index_dir:
+                # A private copy: other sessions keep reading the shared one while this build edits it.
+                base_manifest = IndexManifest.load(index_dir)
+            result = update_knowledge_base(
+                files, embeddings, index_dir, base_manifest, settings, chunk_fn, INGEST_WORKERS, existing,
+                existing_sparse, remove_sel, INSERT_BATCH_SIZE, on_batch, index_config,
+            )
+            tr.set(pages=result.stats.pages, chunks=result.stats.chunks, errors=len(result.stats.errors))
+        progress.empty()
+        vs, stats = result.vs, result.stats
+        if index_dir:
+            # Persisted course indexes are served to every session by index_manager.
+            st.session_state.vectorstore = st.session_state.sparse_index = None
+        else:
+            attach_shared_index(
+                shared_indexes.publish(vs, result.sparse, result.manifest, index_config) if vs is not None else None
+            )
+        st.session_state.manifest = result.manifest
+        current_manifest = result.manifest
+        if preview:
+            st.session_state.ingested_docs = preview
+        if result.skipped:
+            st.caption(f"Skipped {len(result.skipped)} unchanged file(s): {', '.join(result.skipped)}")
+
+        for fname, err in stats.errors:
+            st.error(f"Failed to read {fname}: {err}")
+        if stats.file_timings:
+            with st.expander("Extraction timings"):
+                st.dataframe(pd.DataFrame(stats.file_timings), hide_index=True)
+        if stats.files_total and not stats.chunks and not stats.errors:
+            st.warning("No readable text found in the uploaded files.")
 
-            if persist_toggle and index_dir:
-                save_vectorstore(vs, index_dir)
-                st.caption("Index persisted to ./rag_index")
+        if vs is not None:
+            st.success(
+                f"Knowledge base ready ✅  (new chunks: {stats.chunks}, removed files: {len(remove_sel)}, "
+                f"total vectors: {vs.index.ntotal})"
+            )
+            if isinstance(embeddings, CachedEmbeddings):
+                st.caption(
+                    f"Embedding cache: {embeddings.hits} hits / {embeddings.misses} embedded "
+                    f"({embeddings.hit_rate:.0%} hit rate, {embeddings.cache.total_bytes / 1e6:.1f} MB on disk)"
+                )
+            engine_stats = embeddings.base if isinstance(embeddings, CachedEmbeddings) else embeddings
+            if engine_stats.texts_embedded:
+                st.caption(
+                    f"Encoder throughput: {engine_stats.chunks_per_sec:.1f} chunks/sec "
+                    f"({engine_stats.texts_embedded} chunks in {engine_stats.seconds:.1f}s, "
+                    f"batch {engine_stats.batch_size}, {engine_stats.num_threads} threads)"
+                )
+
+            if index_dir and stats.bytes_written:
+                # update_knowledge_base already published the new generation.
+                st.caption(f"Index persisted to {index_dir} ({stats.bytes_written / 1e6:.1f} MB written)")
     else:
         # No new uploads; try to load persisted index
         if persist_toggle and index_dir:
             try:
-                vs = build_or_load_vectorstore([], EMB_MODEL, index_dir)
-                st.session_state.vectorstore = vs
-                st.success("Loaded existing index ✅")
+                if fresh or not index_manager.exists(COURSE):
+                    raise FileNotFoundError(f"no compatible '{COURSE}' index found in {index_dir}")
+                index_manager.get(COURSE, embeddings)
+                st.success(f"Loaded the '{COURSE}' index ✅")
             except Exception as e:
                 st.error(f"Could not load persisted index: {e}")
         else:
             st.warning("Upload files or enable persistence to load an existing index.")
 
+# -----------------------------
+# Background builds of the selected course index
+# -----------------------------
+
+course_jobs = job_queue.list(index_dir, limit=5) if index_dir else []
+if course_jobs:
+    st.markdown(f"#### ⏳ Builds of '{COURSE}'")
+    for job in course_jobs:
+        progress = job["progress"] or {}
+        label = f"Job {job['id']} · {len(job['files'])} file(s), {len(job['spec']['remove'])} removed"
+        if job["state"] in ("queued", "running"):
+            total = progress.get("files_total") or 1
+            job_col, cancel_col = st.columns([5, 1])
+            job_col.progress(
+                min(progress.get("files_done", 0) / total, 1.0),
+                text=f"{label} · {progress.get('stage', 'queued')} · {progress.get('files_done', 0)}/"
+                f"{progress.get('files_total', len(job['files']))} files · {progress.get('chunks', 0)} chunks "
+                f"({progress.get('chunks_per_sec', 0):.0f}/s)",
+            )
+            if cancel_col.button("Cancel", key=f"cancel_job_{job['id']}", disabled=job["cancel"]):
+                job_queue.cancel(job["id"])
+        elif job["state"] == "done":
+            result = job["result"]
+            st.caption(
+                f"✅ {label} · {result['chunks']} new chunks, {result['total_vectors']} vectors "
+                f"in {result['seconds']:.1f}s, {result.get('bytes_written', 0) / 1e6:.1f} MB written"
+            )
+            for err in result["errors"]:
+                st.error(f"Failed to read {err['file']}: {err['error']}")
+            if progress.get("files"):
+                with st.expander(f"Extraction timings (job {job['id']})"):
+                    st.dataframe(pd.DataFrame(progress["files"]), hide_index=True)
+        else:
+            icon = "🚫" if job["state"] == "cancelled" else "❌"
+            st.caption(f"{icon} {label} · {job['state']} {job['error'] or ''}")
+    st.button("Refresh build status")
+
 st.divider()
 
 # -----------------------------
@@ -242,36 +537,57 @@ with chat_tab:
 
     user_q = st.text_input("Ask a question (e.g., 'Important topics in Unit 3 IoT?')")
     ask_btn = st.button("Ask")
+    live_turns = 0
 
     if ask_btn:
-        if not st.session_state.vectorstore:
+        active_vs, active_sparse = active_index()
+        if active_vs is None:
             st.error("Build the knowledge base first.")
         elif not user_q.strip():
             st.warning("Type a question first.")
         else:
-            retriever = st.session_state.vectorstore.as_retriever(search_kwargs={"k": TOP_K})
-
-            with st.spinner("Retrieving context & thinking…"):
-                rel_docs: List[Document] = retriever.get_relevant_documents(user_q)
-                context_text = "\n\n".join([d.page_content for d in rel_docs])
-                prompt_msgs = ANSWER_PROMPT.format_messages(question=user_q, context=context_text)
-
-                try:
-                    response = llm.invoke(prompt_msgs)
-                    answer = response.content 
-                except Exception as e:
-                    answer = f"LLM error: {e}"
-
-                sources = format_sources(rel_docs) if rel_docs else "(no sources)"
-
-            st.session_state.chat_history.append({"q": user_q, "a": answer, "sources": sources})
+            with telemetry.trace("chat", k=TOP_K, mode=RETRIEVAL_MODE, query_chars=len(user_q)) as tr:
+                st.session_state.last_trace = tr
+                rel_docs = retrieve(user_q, active_vs, active_sparse)
+                if rel_docs is not None:
+                    sources = format_sources(rel_docs) if rel_docs else "(no sources)"
+
+                    # Streamed live above the older turns; stored in history once complete.
+                    with st.container(border=True):
+                        st.markdown(f"**You:** {user_q}")
+                        st.caption(f"Sources: {sources}")
+                        st.markdown("**Assistant:**")
+                        run = GenerationRun()
+                        answer = st.write_stream(stream_answer("chat", user_q, rel_docs, run, active_vs))
+                        st.caption(run.caption())
+                    st.session_state.chat_history.append(
+                        {"q": user_q, "a": answer, "sources": sources, "timing": run.caption()}
+                    )
+                    live_turns = 1
 
     # Render history
-    for turn in st.session_state.chat_history[::-1]:  # latest first
+    for turn in st.session_state.chat_history[::-1][live_turns:]:  # latest first
         with st.container(border=True):
             st.markdown(f"**You:** {turn['q']}")
             st.markdown(f"**Assistant:**\n\n{turn['a']}")
-            st.caption(f"Sources: {turn['sources']}")
+            st.caption(f"Sources: {turn['sources']}" + (f" · {turn['timing']}" if turn.get("timing") else ""))
+
+    if ANSWER_CACHE_ON:
+        cache_stats = get_answer_cache(index_dir).stats()
+        st.caption(
+            f"Answer cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} entries"
+        )
+
+    with st.expander("Query batching latency"):
+        st.caption(
+            f"{batcher.queries} queries in {batcher.batches} batches (mean {batcher.mean_batch:.1f} per batch) · "
+            f"window {batcher.max_wait_ms:g} ms, max {batcher.max_batch}"
+        )
+        latency = batcher.latency_report()
+        st.dataframe(pd.DataFrame([{"metric": m, **v} for m, v in latency.items()]), hide_index=True)
+        if st.button("Reset latency stats"):
+            batcher.reset_stats()
 
 # -------- MCQ Tab --------
 with mcq_tab:
@@ -281,29 +597,23 @@ with mcq_tab:
     mcq_btn = st.button("Generate 5 MCQs")
 
     if mcq_btn:
-        if not st.session_state.vectorstore:
+        active_vs, active_sparse = active_index()
+        if active_vs is None:
             st.error("Build the knowledge base first.")
         elif not topic.strip():
             st.warning("Enter a topic.")
         else:
-            retriever = st.session_state.vectorstore.as_retriever(search_kwargs={"k": TOP_K})
-
-            with st.spinner("Retrieving context & creating MCQs…"):
-                rel_docs = retriever.get_relevant_documents(topic)
-                context_text = "\n\n".join([d.page_content for d in rel_docs])
-                msgs = MCQ_PROMPT.format_messages(topic=topic, context=context_text)
-
-                try:
-                    response = llm.invoke(msgs)
-                    mcqs = response.content
-                except Exception as e:
-                    mcqs = f"LLM error: {e}"
-
-                sources = format_sources(rel_docs) if rel_docs else "(no sources)"
-
-            with st.container(border=True):
-                st.markdown(mcqs)
-                st.caption(f"Sources: {sources}")
+            with telemetry.trace("mcq", k=TOP_K, mode=RETRIEVAL_MODE, query_chars=len(topic)) as tr:
+                st.session_state.last_trace = tr
+                rel_docs = retrieve(topic, active_vs, active_sparse)
+                if rel_docs is not None:
+                    sources = format_sources(rel_docs) if rel_docs else "(no sources)"
+
+                    with st.container(border=True):
+                        st.caption(f"Sources: {sources}")
+                        run = GenerationRun()
+                        st.write_stream(stream_answer("mcq", topic, rel_docs, run, active_vs))
+                        st.caption(run.caption())
 
 # -------- Summaries Tab --------
 with sum_tab:
@@ -313,29 +623,43 @@ with sum_tab:
     sum_btn = st.button("Make 5-point TL;DR")
 
     if sum_btn:
-        if not st.session_state.vectorstore:
+        active_vs, active_sparse = active_index()
+        if active_vs is None:
             st.error("Build the knowledge base first.")
         elif not sum_topic.strip():
             st.warning("Enter a topic.")
         else:
-            retriever = st.session_state.vectorstore.as_retriever(search_kwargs={"k": TOP_K})
-
-            with st.spinner("Retrieving context & summarizing…"):
-                rel_docs = retriever.get_relevant_documents(sum_topic)
-                context_text = "\n\n".join([d.page_content for d in rel_docs])
-                msgs = SUMMARY_PROMPT.format_messages(topic=sum_topic, context=context_text)
-
-                try:
-                    response = llm.invoke(msgs)
-                    tl_dr = response.content
-                except Exception as e:
-                    tl_dr = f"LLM error: {e}"
+            with telemetry.trace("summary", k=TOP_K, mode=RETRIEVAL_MODE, query_chars=len(sum_topic)) as tr:
+                st.session_state.last_trace = tr
+                rel_docs = retrieve(sum_topic, active_vs, active_sparse)
+                if rel_docs is not None:
+                    sources = format_sources(rel_docs) if rel_docs else "(no sources)"
+
+                    with st.container(border=True):
+                        st.caption(f"Sources: {sources}")
+                        run = GenerationRun()
+                        st.write_stream(stream_answer("summary", sum_topic, rel_docs, run, active_vs))
+                        st.caption(run.caption())
 
-                sources = format_sources(rel_docs) if rel_docs else "(no sources)"
+# -----------------------------
+# Debug: last request timeline
+# -----------------------------
 
-            with st.container(border=True):
-                st.markdown(tl_dr)
-                st.caption(f"Sources: {sources}")
+if SHOW_TIMELINE:
+    st.divider()
+    st.subheader("🔎 Last request timeline")
+    last_trace = st.session_state.get("last_trace")
+    if last_trace is None:
+        st.caption("Ask a question or build the knowledge base to record a trace.")
+    else:
+        total_ms = f"{last_trace.seconds * 1000:.0f} ms" if last_trace.seconds is not None else "running"
+        st.caption(f"{last_trace.name} · trace {last_trace.id} · {total_ms} · {last_trace.attrs}")
+        timeline = pd.DataFrame(last_trace.timeline())
+        if not timeline.empty:
+            st.dataframe(timeline, hide_index=True)
+            st.bar_chart(timeline.groupby("stage", sort=False)["duration_ms"].sum())
+    with st.expander("Prometheus metrics (this server process)"):
+        st.code(telemetry.render_metrics(), language="text")
 
 # -----------------------------
 # Footer Tips
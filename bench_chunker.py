@@ -0,0 +1,116 @@
+"""
+Chunking benchmark: ``chunker.Chunker`` against LangChain's splitter.
+
+Chunks real pages (``--corpus``, PDF/TXT) or reproducible synthetic ones with
+both ``Chunker`` and ``RecursiveCharacterTextSplitter``, checks that they yield
+the same chunks, and reports both speeds for every size/overlap pair:
+
+    python bench_chunker.py --chunk-size 300 800 1500 --chunk-overlap 0 120
+    python bench_chunker.py --corpus ./notes
+
+Exits non-zero on any mismatch. ``start_index`` may differ where a passage is
+repeated: the splitter re-finds each chunk's text, ``Chunker`` keeps its real offset.
+"""
+
+import argparse
+import random
+import sys
+import textwrap
+import time
+from typing import List, Optional
+
+from langchain.docstore.document import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from bench_ingest import synthetic_page
+from bench_retrieval import load_corpus
+from chunker import Chunker
+from ingest import IngestionEngine
+
+
+def synthetic_pages(n: int, seed: int = 0) -> List[str]:
+    """Wrapped paragraphs with blank lines, stray spacing and the odd unbreakable run: every separator level."""
+    rng = random.Random(seed)
+    pages = []
+    for i in range(n):
+        paragraphs = []
+        for j in range(rng.randint(2, 6)):
+            text = synthetic_page(rng, rng.randint(20, 160), f"topic {i}.{j}")
+            if rng.random() < 0.1:
+                text += " " + "x" * rng.randint(200, 2000)
+            paragraphs.append("\n".join(textwrap.wrap(text, rng.choice((60, 90, 140)))))
+        pages.append(rng.choice(("\n\n", "\n\n\n", " \n\n")).join(paragraphs))
+    return pages
+
+
+def compare(pages: List[str], chunk_size: int, chunk_overlap: int, repeat: int = 3) -> dict:
+    """Chunk ``pages`` with both splitters; report speed, and where texts or offsets differ."""
+    docs = [Document(page_content=p, metadata={"page": i}) for i, p in enumerate(pages)]
+    splitters = {
+        "langchain": RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+        ),
+        "chunker": Chunker(chunk_size, chunk_overlap, add_start_index=True),
+    }
+    results, timings = {}, {}
+    for name, splitter in splitters.items():
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results[name] = splitter.split_documents(docs)
+            best = min(best, time.perf_counter() - started)
+        timings[name] = best
+
+    ref, ours = results["langchain"], results["chunker"]
+    text_mismatch = len(ref) != len(ours) or any(a.page_content != b.page_content for a, b in zip(ref, ours))
+    # The splitter re-finds each chunk in the page, so a repeated passage can get an earlier copy's offset.
+    offsets_differ = sum(a.metadata["start_index"] != b.metadata["start_index"] for a, b in zip(ref, ours))
+    chars = sum(len(p) for p in pages)
+    return {
+        "pages": len(pages),
+        "chars": chars,
+        "chunks": len(ours),
+        "identical": not text_mismatch,
+        "offsets_differ": offsets_differ,
+        "langchain_s": round(timings["langchain"], 4),
+        "chunker_s": round(timings["chunker"], 4),
+        "speedup": round(timings["langchain"] / timings["chunker"], 2) if timings["chunker"] else None,
+        "chunker_mb_per_s": round(chars / 1e6 / timings["chunker"], 2) if timings["chunker"] else None,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check Chunker against RecursiveCharacterTextSplitter.")
+    parser.add_argument("--corpus", help="directory of PDF/TXT files (default: synthetic pages)")
+    parser.add_argument("--pages", type=int, default=400, help="synthetic pages when no corpus is given")
+    parser.add_argument("--chunk-size", nargs="+", type=int, default=[800])
+    parser.add_argument("--chunk-overlap", nargs="+", type=int, default=[120])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.corpus:
+        with IngestionEngine() as engine:
+            results = engine.iter_documents(load_corpus(args.corpus).items())
+            pages = [d.page_content for r in results for d in r.docs]
+    else:
+        pages = synthetic_pages(args.pages)
+
+    ok = True
+    for size in args.chunk_size:
+        for overlap in args.chunk_overlap:
+            if overlap > size:
+                continue
+            row = compare(pages, size, overlap, args.repeat)
+            ok = ok and row["identical"]
+            print(
+                f"size={size} overlap={overlap}: {row['chunks']} chunks, "
+                f"{'identical' if row['identical'] else 'MISMATCH'} "
+                f"({row['offsets_differ']} start_index differ), "
+                f"langchain {row['langchain_s'] * 1000:.1f} ms, chunker {row['chunker_s'] * 1000:.1f} ms "
+                f"(x{row['speedup']}, {row['chunker_mb_per_s']} MB/s)"
+            )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+Ingestion throughput benchmark with a synthetic PDF/TXT corpus generator.
+
+Generates a reproducible corpus (or reads a real one with ``--corpus``), then
+times each ingestion stage on its own and the whole streaming pipeline:
+
+    extract   IngestionEngine page extraction (read_pdf / read_text)   pages/s
+    chunk     chunk_documents                                          chunks/s
+    embed     embed_documents in insert-sized batches                  embeddings/s
+    index     FAISS add + save_index of the precomputed vectors        vectors/s
+    pipeline  update_knowledge_base into a fresh directory             pages/s, chunks/s
+
+Each stage also records the process's peak RSS so far (worker processes are
+reported separately) and the run ends with the on-disk index size, as JSON:
+
+    python bench_ingest.py --files 20 --pages 30 --out ingest.json
+    python bench_ingest.py --corpus ./notes --emb-model sentence-transformers/all-MiniLM-L6-v2
+
+``--keep-corpus DIR`` writes the generated files plus a ``labels.jsonl`` (one
+question per page, naming its unique topic) that ``bench_retrieval.py`` reads.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from bench_retrieval import HASHING_MODEL, bench_embeddings, load_corpus
+from index_store import IndexManifest
+from ingest import IngestionEngine
+from knowledge_base import chunk_documents, index_settings, update_knowledge_base
+from persistence import index_bytes, save_index
+from pipeline import DEFAULT_BATCH_SIZE
+from vector_index import empty_vectorstore, make_index
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+WORDS = (
+    "algorithm analysis array binary cache channel cipher class compiler data database deadlock "
+    "encryption entropy function graph hash heap interrupt kernel key latency matrix memory "
+    "network node packet page pipeline pointer process protocol queue recursion register "
+    "scheduling signal socket stack thread transaction tree vector virtual window"
+).split()
+FILLER = "the a of and to in is for with on by as that this from are be an each which".split()
+LINE_CHARS = 90
+PDF_LEADING = 12
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS if rng.random() < 0.5 else FILLER) for _ in range(rng.randint(8, 18))]
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_page(rng: random.Random, words: int, topic: str) -> str:
+    """About ``words`` words of lecture-note-like text, with ``topic`` stated once in the middle."""
+    sentences: List[str] = []
+    count = 0
+    while count < words:
+        sentences.append(_sentence(rng))
+        count += len(sentences[-1].split())
+    sentences.insert(len(sentences) // 2, f"The key idea of {topic} is covered here.")
+    return " ".join(sentences)
+
+
+def _wrap(text: str, width: int = LINE_CHARS) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def synthetic_pdf(pages: List[str]) -> bytes:
+    """Minimal valid PDF (Helvetica text, one content stream per page) that pypdf can extract."""
+    n = len(pages)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(n))}] /Count {n} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        )
+        lines = "\n".join(f"({_pdf_escape(line)}) Tj T*" for line in _wrap(text))
+        stream = f"BT /F1 10 Tf {PDF_LEADING} TL 50 760 Td\n{lines}\nET"
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{num} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{off:010d} 00000 n \n" for off in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return bytes(out)
+
+
+def synthetic_corpus(
+    files: int, pages: int, words_per_page: int = 400, txt_ratio: float = 0.2, seed: int = 0
+) -> Tuple[Dict[str, bytes], List[dict]]:
+    """``{file name: bytes}`` plus one label per page (question -> source, page). TXT files are one page."""
+    rng = random.Random(seed)
+    corpus: Dict[str, bytes] = {}
+    labels: List[dict] = []
+    for f in range(files):
+        is_txt = rng.random() < txt_ratio
+        name = f"unit{f:03d}.{'txt' if is_txt else 'pdf'}"
+        texts = []
+        for p in range(1 if is_txt else pages):
+            topic = f"{rng.choice(WORDS)} {rng.choice(WORDS)} topic {f}-{p}"
+            texts.append(synthetic_page(rng, words_per_page, topic))
+            labels.append({"question": f"What is the key idea of {topic}?", "source": name, "page": p + 1})
+        corpus[name] = "\n\n".join(texts).encode("utf-8") if is_txt else synthetic_pdf(texts)
+    return corpus, labels
+
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    """Peak resident set size of this process and of its (finished) worker processes."""
+    if resource is None:
+        return {"self": None, "children": None}
+    per_mb = 1024 * 1024 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KiB elsewhere
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / per_mb, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / per_mb, 1),
+    }
+
+
+def _rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 1) if seconds else 0.0
+
+
+def run_benchmark(
+    files: Dict[str, bytes],
+    embeddings: Embeddings,
+    emb_model: str,
+    chunk_size: int = 800,
+    chunk_overlap: int = 120,
+    workers: int = 2,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    work_dir: Optional[str] = None,
+    log=print,
+) -> dict:
+    stages = {}
+
+    started = time.perf_counter()
+    with IngestionEngine(max_workers=workers) as engine:
+        results = list(engine.iter_documents(files.items()))
+    seconds = time.perf_counter() - started
+    docs = [d for r in results for d in r.docs]
+    errors = [{"file": r.filename, "error": r.error} for r in results if r.error]
+    stages["extract"] = {
+        "seconds": round(seconds, 3), "pages": len(docs), "pages_per_sec": _rate(len(docs), seconds),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    started = time.perf_counter()
+    chunks = chunk_documents(docs, chunk_size, chunk_overlap)
+    seconds = time.perf_counter() - started
+    stages["chunk"] = {
+        "seconds": round(seconds, 3), "chunks": len(chunks), "chunks_per_sec": _rate(len(chunks), seconds),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if not chunks:
+        raise ValueError("The corpus produced no chunks to embed")
+
+    texts = [c.page_content for c in chunks]
+    started = time.perf_counter()
+    vectors = [embeddings.embed_documents(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+    seconds = time.perf_counter() - started
+    matrix = np.asarray([v for batch in vectors for v in batch], dtype=np.float32)
+    stages["embed"] = {
+        "seconds": round(seconds, 3), "embeddings": len(texts), "embeddings_per_sec": _rate(len(texts), seconds),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    scratch = tempfile.mkdtemp(prefix="bench-ingest-", dir=work_dir)
+    try:
+        stage_dir = os.path.join(scratch, "stages")
+        os.makedirs(stage_dir)
+        started = time.perf_counter()
+        vs = empty_vectorstore(embeddings, make_index("flat", matrix))
+        vs.add_embeddings(zip(texts, matrix.tolist()), metadatas=[c.metadata for c in chunks])
+        save_index(vs, stage_dir)
+        seconds = time.perf_counter() - started
+        stages["index"] = {
+            "seconds": round(seconds, 3), "vectors_per_sec": _rate(len(matrix), seconds), "peak_rss_mb": peak_rss_mb(),
+        }
+        del vs
+
+        pipeline_dir = os.path.join(scratch, "pipeline")
+        os.makedirs(pipeline_dir)
+        started = time.perf_counter()
+        result = update_knowledge_base(
+            files, embeddings, pipeline_dir, IndexManifest(), index_settings(emb_model, chunk_size, chunk_overlap),
+            lambda d: chunk_documents(d, chunk_size, chunk_overlap), workers, batch_size=batch_size,
+        )
+        seconds = time.perf_counter() - started
+        stages["pipeline"] = {
+            "seconds": round(seconds, 3),
+            "pages": result.stats.pages,
+            "chunks": result.stats.chunks,
+            "pages_per_sec": _rate(result.stats.pages, seconds),
+            "chunks_per_sec": _rate(result.stats.chunks, seconds),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        disk_bytes = index_bytes(pipeline_dir)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    for name, stage in stages.items():
+        rate = next((f"{v} {k.replace('_per_sec', '')}/s" for k, v in stage.items() if k.endswith("_per_sec")), "")
+        log(f"{name:<9} {stage['seconds']:>8.3f}s  {rate}")
+    log(f"index size {disk_bytes / 1e6:.2f} MB, peak RSS {peak_rss_mb()['self']} MB")
+    return {
+        "benchmark": "ingest",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": len(files),
+        "input_bytes": sum(len(b) for b in files.values()),
+        "emb_model": emb_model,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "workers": workers,
+        "batch_size": batch_size,
+        "stages": stages,
+        "errors": errors,
+        "index_bytes": disk_bytes,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure ingestion throughput stage by stage.")
+    parser.add_argument("--corpus", help="benchmark this directory of PDF/TXT files instead of a synthetic corpus")
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=20, help="pages per synthetic PDF")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--txt-ratio", type=float, default=0.2, help="share of synthetic files that are TXT")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-corpus", help="also write the synthetic corpus and labels.jsonl here")
+    parser.add_argument("--emb-model", default=HASHING_MODEL)
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--chunk-overlap", type=int, default=120)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.corpus:
+        files = load_corpus(args.corpus)
+    else:
+        files, labels = synthetic_corpus(args.files, args.pages, args.words_per_page, args.txt_ratio, args.seed)
+        if args.keep_corpus:
+            os.makedirs(args.keep_corpus, exist_ok=True)
+            for name, data in files.items():
+                with open(os.path.join(args.keep_corpus, name), "wb") as f:
+                    f.write(data)
+            with open(os.path.join(args.keep_corpus, "labels.jsonl"), "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(label) + "\n" for label in labels)
+
+    report = run_benchmark(
+        files, bench_embeddings(args.emb_model), args.emb_model, args.chunk_size, args.chunk_overlap,
+        args.workers, args.batch_size, log=lambda msg: print(msg, file=sys.stderr),
+    )
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
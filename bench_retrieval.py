@@ -0,0 +1,240 @@
+"""
+Retrieval quality and latency benchmark.
+
+Builds an index over a corpus for every combination of embedding model, chunk
+size and chunk overlap, asks a labelled question set against it, and writes a
+JSON report with recall@k and MRR@k for each Top-K, index build time, on-disk
+index size and per-query retrieval latency percentiles.
+
+    python bench_retrieval.py --corpus ./notes --labels questions.jsonl \\
+        --emb-model hashing --chunk-size 500 800 1200 --chunk-overlap 0 120 \\
+        --top-k 1 4 8 --retrieval vector hybrid --out report.json
+
+``labels`` is JSON lines, one question each, naming the page(s) that answer it:
+
+    {"question": "What is the Hill cipher key?", "source": "crypto.pdf", "page": 3}
+    {"question": "...", "relevant": [["unit2.pdf", 4], ["unit2.pdf", 5]]}
+
+A question counts as found at k when any of its pages is among the top-k
+chunks; MRR uses the rank of the first such chunk. The ``hashing`` model
+(``HashingEmbeddings``) runs fully offline and deterministically, so reports
+from different machines and commits compare like for like.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from embedding_engine import DEFAULT_HASHING_DIM, HashingEmbeddings
+from index_store import IndexManifest
+from knowledge_base import chunk_documents, index_settings, make_embeddings, update_knowledge_base
+from persistence import index_bytes, load_index
+from sparse_index import RETRIEVAL_MODES, BM25Index, HybridRetriever
+from vector_index import percentile
+
+HASHING_MODEL = "hashing"
+CORPUS_EXTENSIONS = (".pdf", ".txt")
+
+Page = Tuple[str, int]
+
+
+def bench_embeddings(model: str) -> Embeddings:
+    """``hashing`` for the offline stand-in, otherwise a sentence-transformers model name."""
+    if model == HASHING_MODEL:
+        return HashingEmbeddings(DEFAULT_HASHING_DIM)
+    return make_embeddings(model)
+
+
+def load_corpus(path: str) -> Dict[str, bytes]:
+    files = {}
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(CORPUS_EXTENSIONS):
+            with open(os.path.join(path, name), "rb") as f:
+                files[name] = f.read()
+    if not files:
+        raise ValueError(f"No PDF or TXT files in {path}")
+    return files
+
+
+def load_labels(path: str) -> List[Tuple[str, Set[Page]]]:
+    labels = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if "relevant" in item:
+                pages = {(source, int(page)) for source, page in item["relevant"]}
+            elif "source" in item:
+                pages = {(item["source"], int(item.get("page", 1)))}
+            else:
+                raise ValueError(f"{path}:{line_no}: needs 'source'/'page' or 'relevant'")
+            labels.append((item["question"], pages))
+    return labels
+
+
+def first_relevant_rank(docs: Sequence[Document], pages: Set[Page]) -> Optional[int]:
+    for rank, doc in enumerate(docs, 1):
+        if (doc.metadata.get("source"), doc.metadata.get("page")) in pages:
+            return rank
+    return None
+
+
+def score(ranks: List[Optional[int]], top_ks: Sequence[int]) -> Dict[str, dict]:
+    """recall@k (share of questions answered within k) and MRR@k for every k."""
+    metrics = {}
+    n = len(ranks) or 1
+    for k in top_ks:
+        found = [r for r in ranks if r is not None and r <= k]
+        metrics[str(k)] = {
+            "recall@k": round(len(found) / n, 4),
+            "mrr@k": round(sum(1.0 / r for r in found) / n, 4),
+        }
+    return metrics
+
+
+def latency_summary(latencies_ms: List[float]) -> dict:
+    return {
+        "p50": round(percentile(latencies_ms, 50), 3),
+        "p95": round(percentile(latencies_ms, 95), 3),
+        "p99": round(percentile(latencies_ms, 99), 3),
+        "mean": round(sum(latencies_ms) / len(latencies_ms), 3) if latencies_ms else 0.0,
+    }
+
+
+def build_index(
+    files: Dict[str, bytes], embeddings: Embeddings, settings: dict, persist_dir: str, workers: int
+) -> Tuple[float, int]:
+    """Build into ``persist_dir``; returns (seconds, chunk count)."""
+    started = time.perf_counter()
+    result = update_knowledge_base(
+        files, embeddings, persist_dir, IndexManifest(), settings,
+        lambda docs: chunk_documents(docs, settings["chunk_size"], settings["chunk_overlap"]), workers,
+    )
+    return time.perf_counter() - started, result.stats.chunks
+
+
+def evaluate(
+    vs: FAISS,
+    labels: List[Tuple[str, Set[Page]]],
+    top_ks: Sequence[int],
+    retrieval: str,
+    sparse=None,
+    warmup: int = 3,
+) -> dict:
+    k = max(top_ks)
+    if retrieval == "hybrid":
+        search = HybridRetriever(vectorstore=vs, sparse=sparse, k=k).invoke
+    else:
+        search = vs.as_retriever(search_kwargs={"k": k}).invoke
+    for question, _ in labels[:warmup]:
+        search(question)
+    ranks, latencies = [], []
+    for question, pages in labels:
+        t0 = time.perf_counter()
+        docs = search(question)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        ranks.append(first_relevant_rank(docs, pages))
+    return {"metrics": score(ranks, top_ks), "latency_ms": latency_summary(latencies)}
+
+
+def run_benchmark(
+    files: Dict[str, bytes],
+    labels: List[Tuple[str, Set[Page]]],
+    emb_models: Sequence[str],
+    chunk_sizes: Sequence[int],
+    chunk_overlaps: Sequence[int],
+    top_ks: Sequence[int],
+    retrievals: Sequence[str] = ("vector",),
+    workers: int = 2,
+    work_dir: Optional[str] = None,
+    log=print,
+) -> dict:
+    """One row per (model, chunk size, overlap, retrieval mode); metrics keyed by Top-K."""
+    rows = []
+    scratch = tempfile.mkdtemp(prefix="bench-retrieval-", dir=work_dir)
+    try:
+        for model in emb_models:
+            embeddings = bench_embeddings(model)
+            for size, overlap in itertools.product(chunk_sizes, chunk_overlaps):
+                if overlap >= size:
+                    continue
+                persist_dir = os.path.join(scratch, f"{len(rows)}")
+                os.makedirs(persist_dir)
+                settings = index_settings(model, size, overlap)
+                build_s, chunks = build_index(files, embeddings, settings, persist_dir, workers)
+                disk_bytes = index_bytes(persist_dir)
+                vs = load_index(persist_dir, embeddings, mmap=True)
+                sparse = BM25Index.load(persist_dir) if "hybrid" in retrievals else None
+                for retrieval in retrievals:
+                    row = {
+                        "emb_model": model,
+                        "chunk_size": size,
+                        "chunk_overlap": overlap,
+                        "retrieval": retrieval,
+                        "chunks": chunks,
+                        "build_s": round(build_s, 3),
+                        "index_bytes": disk_bytes,
+                        **evaluate(vs, labels, top_ks, retrieval, sparse),
+                    }
+                    rows.append(row)
+                    best = row["metrics"][str(max(top_ks))]
+                    log(
+                        f"{model} size={size} overlap={overlap} {retrieval}: {chunks} chunks, "
+                        f"build {build_s:.2f}s, {disk_bytes / 1e6:.2f} MB, "
+                        f"recall@{max(top_ks)} {best['recall@k']:.3f}, MRR {best['mrr@k']:.3f}, "
+                        f"p50 {row['latency_ms']['p50']:.2f} ms"
+                    )
+                del vs
+                shutil.rmtree(persist_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return {
+        "benchmark": "retrieval",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": len(files),
+        "questions": len(labels),
+        "top_k": list(top_ks),
+        "runs": rows,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Sweep chunking/embedding settings and report recall, MRR and latency.")
+    parser.add_argument("--corpus", required=True, help="directory of PDF/TXT files")
+    parser.add_argument("--labels", required=True, help="JSON lines: question + source/page or relevant pages")
+    parser.add_argument("--emb-model", nargs="+", default=[HASHING_MODEL])
+    parser.add_argument("--chunk-size", nargs="+", type=int, default=[800])
+    parser.add_argument("--chunk-overlap", nargs="+", type=int, default=[120])
+    parser.add_argument("--top-k", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--retrieval", nargs="+", choices=RETRIEVAL_MODES, default=["vector"])
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(
+        load_corpus(args.corpus), load_labels(args.labels), args.emb_model, args.chunk_size,
+        args.chunk_overlap, sorted(set(args.top_k)), args.retrieval, args.workers,
+        log=lambda msg: print(msg, file=sys.stderr),
+    )
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
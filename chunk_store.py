@@ -0,0 +1,204 @@
+"""
+Columnar, memory-mapped chunk store.
+
+Chunks are stored in FAISS row order as flat columns instead of one Python
+object per chunk:
+
+    chunks/text.bin      utf-8 texts back to back
+    chunks/offsets.npy   int64 [n + 1] byte offsets into text.bin
+    chunks/ids.npy       fixed-width bytes [n] chunk ids
+    chunks/sorted_ids.npy  ids.npy sorted, binary-searched for id -> row lookups
+    chunks/id_order.npy  int64 [n] row of each entry of sorted_ids.npy
+    chunks/sources.json  distinct source file names
+    chunks/source.npy    int32 [n] index into sources.json (-1 = none)
+    chunks/page.npy      int32 [n] page number (-1 = none)
+    chunks/extra.bin     json of any other metadata keys, offset-indexed like text
+    chunks/extra_offsets.npy
+
+Everything is opened with mmap, so loading costs nothing up front and a query
+only decodes the top-K chunks it returns.
+
+Run ``python chunk_store.py migrate ./rag_index`` to convert an index saved by
+``FAISS.save_local`` (index.pkl); it is published as a new generation (see ``snapshots.py``).
+"""
+
+import json
+import mmap
+import os
+import shutil
+import sys
+from collections.abc import Mapping
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.docstore.base import Docstore
+
+CHUNKS_DIR = "chunks"
+_CORE_KEYS = ("source", "page")
+
+
+def _open_blob(path: str):
+    """mmap a file read-only; empty files cannot be mapped, so they read as b""."""
+    if os.path.getsize(path) == 0:
+        return b""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ChunkStore:
+    def __init__(self, path: str):
+        self.path = path
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        self._text = _open_blob(os.path.join(path, "text.bin"))
+        self._offsets = load("offsets.npy")
+        self._ids = load("ids.npy")
+        self._sorted_ids = load("sorted_ids.npy")
+        self._id_order = load("id_order.npy")
+        self._source = load("source.npy")
+        self._page = load("page.npy")
+        self._extra = _open_blob(os.path.join(path, "extra.bin"))
+        self._extra_offsets = load("extra_offsets.npy")
+        with open(os.path.join(path, "sources.json"), "r", encoding="utf-8") as f:
+            self._sources: List[str] = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def id_at(self, row: int) -> str:
+        return self._ids[row].decode("ascii")
+
+    def row_of(self, chunk_id: str) -> Optional[int]:
+        try:
+            key = chunk_id.encode("ascii")
+        except UnicodeEncodeError:
+            return None
+        if len(self._ids) == 0 or len(key) > self._ids.dtype.itemsize:
+            return None
+        # O(log n) probes into the mmap'd column; only those pages are touched.
+        pos = int(np.searchsorted(self._sorted_ids, key))
+        if pos < len(self._sorted_ids) and self._sorted_ids[pos] == key:
+            return int(self._id_order[pos])
+        return None
+
+    def text(self, row: int) -> str:
+        return bytes(self._text[self._offsets[row]:self._offsets[row + 1]]).decode("utf-8")
+
+    def metadata(self, row: int) -> dict:
+        meta = {}
+        if self._source[row] >= 0:
+            meta["source"] = self._sources[self._source[row]]
+        if self._page[row] >= 0:
+            meta["page"] = int(self._page[row])
+        start, stop = self._extra_offsets[row], self._extra_offsets[row + 1]
+        if stop > start:
+            meta.update(json.loads(bytes(self._extra[start:stop]).decode("utf-8")))
+        return meta
+
+    def document(self, row: int) -> Document:
+        return Document(id=self.id_at(row), page_content=self.text(row), metadata=self.metadata(row))
+
+    def iter_documents(self) -> Iterator[Tuple[str, Document]]:
+        for row in range(len(self)):
+            doc = self.document(row)
+            yield doc.id, doc
+
+    @staticmethod
+    def write(path: str, rows: Iterable[Tuple[str, Document]]):
+        """Write ``(chunk id, Document)`` pairs, in FAISS row order, as a new store at ``path``."""
+        os.makedirs(path, exist_ok=True)
+        offsets, extra_offsets = [0], [0]
+        ids: List[bytes] = []
+        source_idx: List[int] = []
+        pages: List[int] = []
+        sources: dict = {}
+        text_path, extra_path = os.path.join(path, "text.bin"), os.path.join(path, "extra.bin")
+        with open(text_path, "wb") as text_f, open(extra_path, "wb") as extra_f:
+            for chunk_id, doc in rows:
+                data = doc.page_content.encode("utf-8")
+                text_f.write(data)
+                offsets.append(offsets[-1] + len(data))
+                ids.append(chunk_id.encode("ascii"))
+                meta = doc.metadata or {}
+                source = meta.get("source")
+                source_idx.append(sources.setdefault(source, len(sources)) if source is not None else -1)
+                page = meta.get("page")
+                pages.append(int(page) if isinstance(page, (int, np.integer)) else -1)
+                extra = {k: v for k, v in meta.items() if k not in _CORE_KEYS or (k == "page" and pages[-1] < 0)}
+                blob = json.dumps(extra).encode("utf-8") if extra else b""
+                extra_f.write(blob)
+                extra_offsets.append(extra_offsets[-1] + len(blob))
+            for f in (text_f, extra_f):
+                f.flush()
+                os.fsync(f.fileno())
+
+        width = max((len(i) for i in ids), default=1)
+        id_arr = np.array(ids, dtype=f"S{width}")
+        order = np.argsort(id_arr, kind="stable").astype(np.int64)
+        arrays = {
+            "offsets.npy": np.array(offsets, dtype=np.int64),
+            "ids.npy": id_arr,
+            "sorted_ids.npy": id_arr[order],
+            "id_order.npy": order,
+            "source.npy": np.array(source_idx, dtype=np.int32),
+            "page.npy": np.array(pages, dtype=np.int32),
+            "extra_offsets.npy": np.array(extra_offsets, dtype=np.int64),
+        }
+        for name, arr in arrays.items():
+            np.save(os.path.join(path, name), arr)
+        with open(os.path.join(path, "sources.json"), "w", encoding="utf-8") as f:
+            json.dump(list(sources), f)
+
+
+class ChunkStoreDocstore(Docstore):
+    """Read-only LangChain docstore over a ChunkStore; each lookup decodes one chunk."""
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = self.store.row_of(search)
+        if row is None:
+            return f"ID {search} not found."
+        return self.store.document(row)
+
+
+class ChunkRowMap(Mapping):
+    """FAISS row -> chunk id, read straight from the ids column."""
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def __getitem__(self, row: int) -> str:
+        row = int(row)
+        if not 0 <= row < len(self.store):
+            raise KeyError(row)
+        return self.store.id_at(row)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self.store)))
+
+
+def replace_dir(tmp: str, path: str):
+    """Swap a fully written directory into place, removing the old one afterwards."""
+    old = path + ".old"
+    if os.path.exists(old):
+        shutil.rmtree(old)
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    if os.path.exists(old):
+        shutil.rmtree(old)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "migrate":
+        print("usage: python chunk_store.py migrate <index_dir>")
+        sys.exit(2)
+    from persistence import migrate_index
+
+    migrated = migrate_index(sys.argv[2])
+    print(f"Migrated {sys.argv[2]} to the columnar chunk store" if migrated else "Nothing to migrate")
@@ -0,0 +1,140 @@
+"""
+Linear-time recursive character chunker.
+
+``Chunker`` produces exactly the chunks of LangChain's
+``RecursiveCharacterTextSplitter`` with its defaults (separators
+``["\\n\\n", "\\n", " ", ""]``, separator kept at the start of the next piece,
+whitespace stripped, ``len`` as the length function), but works on
+``(start, end)`` offsets into the page instead of strings:
+
+- pieces are found with ``str.find`` and kept as offsets; no regex split and no
+  intermediate substrings, so text is copied once, when a chunk is emitted,
+- merging slides a window over the pieces with a deque (the splitter re-slices
+  its list on every pop, which is quadratic on pages of many short pieces),
+- ``start_index`` is the chunk's real offset in the page, not the result of
+  searching for the chunk text again (which can match an earlier copy of a
+  repeated passage).
+
+Only pieces of ``chunk_size`` or more are re-scanned with the next separator,
+so each character is visited at most once per separator level. ``tests/test_chunker.py``
+checks the equivalence; ``bench_chunker.py`` compares both on real or synthetic pages.
+"""
+
+from collections import deque
+from typing import Deque, List, Sequence, Tuple
+
+from langchain.docstore.document import Document
+
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+Span = Tuple[int, int]
+
+
+class Chunker:
+    def __init__(
+        self,
+        chunk_size: int = 4000,
+        chunk_overlap: int = 200,
+        separators: Sequence[str] = DEFAULT_SEPARATORS,
+        add_start_index: bool = False,
+    ):
+        # Same checks (and messages) as the LangChain splitter.
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be > 0, got {chunk_size}")
+        if chunk_overlap < 0:
+            raise ValueError(f"chunk_overlap must be >= 0, got {chunk_overlap}")
+        if chunk_overlap > chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size}), should be smaller."
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = tuple(separators)
+        self.add_start_index = add_start_index
+
+    def split_spans(self, text: str) -> List[Span]:
+        """``(start, end)`` offsets of every chunk; ``text[start:end]`` is the chunk."""
+        out: List[Span] = []
+        self._split(text, 0, len(text), 0, out)
+        return out
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.split_spans(text)]
+
+    def split_documents(self, docs: List[Document]) -> List[Document]:
+        chunks = []
+        for doc in docs:
+            text = doc.page_content
+            for start, end in self.split_spans(text):
+                metadata = dict(doc.metadata)
+                if self.add_start_index:
+                    metadata["start_index"] = start
+                chunks.append(Document(page_content=text[start:end], metadata=metadata))
+        return chunks
+
+    def _pieces(self, text: str, start: int, end: int, sep: str) -> List[Span]:
+        """``text[start:end]`` cut before every occurrence of ``sep``, which stays on the following piece."""
+        if not sep:
+            return [(i, i + 1) for i in range(start, end)]
+        pieces = []
+        prev = start
+        at = text.find(sep, start, end)
+        while at != -1:
+            if at > prev:
+                pieces.append((prev, at))
+            prev = at
+            at = text.find(sep, at + len(sep), end)
+        pieces.append((prev, end))
+        return pieces
+
+    def _split(self, text: str, start: int, end: int, level: int, out: List[Span]):
+        separators = self.separators
+        sep, next_level = separators[-1], len(separators)
+        for i in range(level, len(separators)):
+            if not separators[i]:
+                sep, next_level = "", len(separators)
+                break
+            if text.find(separators[i], start, end) != -1:
+                sep, next_level = separators[i], i + 1
+                break
+
+        good: List[Span] = []
+        for s, e in self._pieces(text, start, end, sep):
+            if e - s < self.chunk_size:
+                good.append((s, e))
+                continue
+            if good:
+                self._merge(text, good, out)
+                good = []
+            if next_level >= len(separators):
+                out.append((s, e))  # unsplittable; the splitter emits it unstripped
+            else:
+                self._split(text, s, e, next_level, out)
+        if good:
+            self._merge(text, good, out)
+
+    def _merge(self, text: str, pieces: List[Span], out: List[Span]):
+        """Greedy window over contiguous pieces, carrying up to ``chunk_overlap`` characters into the next chunk."""
+        size, overlap = self.chunk_size, self.chunk_overlap
+        window: Deque[Span] = deque()
+        total = 0
+        for s, e in pieces:
+            n = e - s
+            if total + n > size and window:
+                self._emit(text, window[0][0], window[-1][1], out)
+                while total > overlap or (total + n > size and total > 0):
+                    ps, pe = window.popleft()
+                    total -= pe - ps
+            window.append((s, e))
+            total += n
+        if window:
+            self._emit(text, window[0][0], window[-1][1], out)
+
+    @staticmethod
+    def _emit(text: str, start: int, end: int, out: List[Span]):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            out.append((start, end))
@@ -0,0 +1,175 @@
+"""
+Token-budgeted prompt context from retrieved chunks.
+
+Top-K chunks are not independent passages: neighbouring chunks of one page
+share up to ``chunk_overlap`` characters, and a page often contributes several
+of them. Joining them verbatim sends the overlap twice and grows the prompt
+with every Top-K step. ``pack_context``:
+
+1. groups chunks by (source, page) and places them on the page using the
+   splitter's ``start_index`` (or, for indexes built before it was recorded,
+   by matching the overlapping text),
+2. merges overlapping and adjacent spans into one passage, dropping repeated
+   and contained text,
+3. adds passages best-ranked first while they fit the token budget, cutting
+   the first one that does not at a sentence or word boundary if enough
+   budget is left for it.
+
+Token counts are estimates (``CHARS_PER_TOKEN``): Gemini's tokenizer is only
+reachable over the network, and the budget only needs to be roughly right.
+"""
+
+import math
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+DEFAULT_CONTEXT_TOKENS = 1500
+CHARS_PER_TOKEN = 4
+MIN_TEXT_OVERLAP = 20  # chars a chunk must share with its neighbour to be merged without offsets
+ADJACENT_GAP = 2  # separator chars the splitter may drop between consecutive chunks
+MIN_TAIL_TOKENS = 48  # smaller remainders are not worth a truncated passage
+PASSAGE_SEP = "\n\n"
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+class PackedContext(NamedTuple):
+    text: str
+    docs: List[Document]  # chunks that contributed to ``text``, in rank order
+    tokens: int
+    raw_tokens: int  # what joining every chunk verbatim would have cost
+    passages: int
+    truncated: bool
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.raw_tokens - self.tokens)
+
+
+class _Span:
+    def __init__(self, start: Optional[int], text: str, rank: int, doc: Document):
+        self.start = start
+        self.text = text
+        self.rank = rank
+        self.docs = [doc]
+
+    @property
+    def end(self) -> Optional[int]:
+        return None if self.start is None else self.start + len(self.text)
+
+    def absorb(self, other: "_Span", text: str):
+        self.text = text
+        self.rank = min(self.rank, other.rank)
+        self.docs.extend(other.docs)
+
+
+def _suffix_prefix_overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of ``left`` that is a prefix of ``right``."""
+    for n in range(min(len(left), len(right)), MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:n]):
+            return n
+    return 0
+
+
+def _merge_located(spans: List[_Span]) -> List[_Span]:
+    merged: List[_Span] = []
+    for span in sorted(spans, key=lambda s: s.start):
+        last = merged[-1] if merged else None
+        if last is None or span.start > last.end + ADJACENT_GAP:
+            merged.append(span)
+        elif span.end <= last.end:
+            last.absorb(span, last.text)  # contained
+        elif span.start >= last.end:
+            last.absorb(span, last.text + "\n" + span.text)  # adjacent
+        else:
+            last.absorb(span, last.text + span.text[last.end - span.start:])
+    return merged
+
+
+def _merge_unlocated(spans: List[_Span]) -> List[_Span]:
+    merged: List[_Span] = []
+    for span in spans:
+        for other in merged:
+            if span.text in other.text:
+                other.absorb(span, other.text)
+                break
+            if other.text in span.text:
+                other.absorb(span, span.text)
+                break
+            n = _suffix_prefix_overlap(other.text, span.text)
+            if n:
+                other.absorb(span, other.text + span.text[n:])
+                break
+            n = _suffix_prefix_overlap(span.text, other.text)
+            if n:
+                other.absorb(span, span.text + other.text[n:])
+                break
+        else:
+            merged.append(span)
+    return merged
+
+
+def _passages(docs: List[Document]) -> List[_Span]:
+    groups: Dict[Tuple, List[_Span]] = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        start = doc.metadata.get("start_index")
+        start = start if isinstance(start, int) and start >= 0 else None
+        groups.setdefault(key, []).append(_Span(start, doc.page_content, rank, doc))
+    passages: List[_Span] = []
+    for spans in groups.values():
+        located = [s for s in spans if s.start is not None]
+        unlocated = [s for s in spans if s.start is None]
+        passages.extend(_merge_located(located) + _merge_unlocated(unlocated))
+    return sorted(passages, key=lambda s: s.rank)
+
+
+def _header(span: _Span) -> str:
+    meta = span.docs[0].metadata
+    return f"[{meta.get('source', '?')} p.{meta.get('page', '?')}]\n"
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    """``text`` cut to ``max_chars`` at the last sentence end, else word break, in the second half."""
+    cut = text[:max_chars]
+    for marks in ((". ", ".\n", "? ", "! "), (" ", "\n")):
+        at = max(cut.rfind(m) for m in marks)
+        if at >= max_chars // 2:
+            return cut[:at + 1].rstrip()
+    return cut.rstrip()
+
+
+def pack_context(
+    docs: List[Document],
+    max_tokens: int = DEFAULT_CONTEXT_TOKENS,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+) -> PackedContext:
+    """Deduplicated, merged and budgeted context for ``docs`` (given best first)."""
+    raw_tokens = count_tokens(PASSAGE_SEP.join(d.page_content for d in docs))
+    parts: List[str] = []
+    used: List[Document] = []
+    tokens = 0
+    truncated = False
+    for span in _passages(docs):
+        header = _header(span)
+        cost = count_tokens((PASSAGE_SEP if parts else "") + header + span.text)
+        if tokens + cost <= max_tokens:
+            parts.append(header + span.text)
+            used.extend(span.docs)
+            tokens += cost
+            continue
+        remaining = max_tokens - tokens - count_tokens(PASSAGE_SEP + header)
+        if remaining >= MIN_TAIL_TOKENS:
+            text = _truncate(span.text, remaining * CHARS_PER_TOKEN)
+            parts.append(header + text)
+            used.extend(span.docs)
+            tokens += count_tokens((PASSAGE_SEP if len(parts) > 1 else "") + header + text)
+            truncated = True
+            break
+        # Too big for what is left; a lower-ranked, shorter passage may still fit.
+    rank = {id(d): i for i, d in enumerate(docs)}
+    used.sort(key=lambda d: rank[id(d)])
+    return PackedContext(PASSAGE_SEP.join(parts), used, tokens, raw_tokens, len(parts), truncated)
@@ -0,0 +1,226 @@
+"""
+Persistent embedding cache for the RAG build step.
+
+Chunks are keyed by (embedding model name, hash of the whitespace-normalized
+chunk text), so rebuilding a knowledge base only sends cache misses through the
+embedding model. Entries live in a small SQLite file and are evicted
+least-recently-used first once the cache grows past its byte budget.
+
+Vectors can be stored as float32, float16 (half the bytes, ~3 significant
+digits) or int8 (a quarter, scaled per vector); they are always returned as
+float32.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_DIR = "./emb_cache"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+STORAGE_DTYPES = ("float32", "float16", "int8")
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so re-extracted pages with different spacing hit the cache."""
+    return " ".join(text.split())
+
+
+def content_key(model_name: str, text: str) -> str:
+    h = hashlib.sha256()
+    h.update(model_name.encode("utf-8"))
+    h.update(b"\0")
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.hexdigest()
+
+
+def encode_vector(vec, dtype: str = "float32") -> bytes:
+    arr = np.asarray(vec, dtype=np.float32)
+    if dtype == "float16":
+        return arr.astype(np.float16).tobytes()
+    if dtype == "int8":
+        scale = float(np.abs(arr).max()) / 127.0 or 1.0
+        q = np.clip(np.rint(arr / scale), -127, 127).astype(np.int8)
+        return np.float32(scale).tobytes() + q.tobytes()
+    return arr.tobytes()
+
+
+def decode_vector(blob: bytes, dtype: str = "float32") -> np.ndarray:
+    if dtype == "float16":
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if dtype == "int8":
+        scale = np.frombuffer(blob[:4], dtype=np.float32)[0]
+        return np.frombuffer(blob[4:], dtype=np.int8).astype(np.float32) * scale
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+class EmbeddingCache:
+    """SQLite-backed key -> vector store with a size-bounded LRU policy."""
+
+    def __init__(
+        self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES, dtype: str = "float32"
+    ):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported cache dtype {dtype!r}; expected one of {STORAGE_DTYPES}")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "embeddings.sqlite")
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vec BLOB NOT NULL, nbytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(embeddings)")}
+        if "dtype" not in columns:
+            # Caches written before per-entry dtypes hold float32 blobs.
+            self._conn.execute("ALTER TABLE embeddings ADD COLUMN dtype TEXT NOT NULL DEFAULT 'float32'")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()
+        self._total_bytes = int(row[0])
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def configure(self, max_bytes: Optional[int] = None, dtype: Optional[str] = None):
+        """Change the byte budget or the dtype of new entries; existing entries keep theirs."""
+        if dtype is not None and dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported cache dtype {dtype!r}; expected one of {STORAGE_DTYPES}")
+        with self._lock:
+            if dtype is not None:
+                self.dtype = dtype
+            if max_bytes is not None and max_bytes != self.max_bytes:
+                self.max_bytes = max_bytes
+                self._evict_locked()
+                self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        if not keys:
+            return found
+        now = time.time()
+        with self._lock:
+            # SQLite caps the number of bound parameters per statement.
+            for start in range(0, len(keys), 500):
+                batch = list(keys[start:start + 500])
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vec, dtype FROM embeddings WHERE key IN ({marks})", batch
+                ).fetchall()
+                for key, blob, dtype in rows:
+                    found[key] = decode_vector(blob, dtype).tolist()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, r[0]) for r in rows]
+                    )
+            self._conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, vec in items.items():
+            blob = encode_vector(vec, self.dtype)
+            rows.append((key, blob, len(blob), now, self.dtype))
+        with self._lock:
+            replaced = 0
+            for start in range(0, len(rows), 500):
+                batch = [r[0] for r in rows[start:start + 500]]
+                marks = ",".join("?" * len(batch))
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(nbytes), 0) FROM embeddings WHERE key IN ({marks})", batch
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vec, nbytes, last_used, dtype) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._total_bytes += sum(r[2] for r in rows) - int(replaced)
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        """Drop least-recently-used entries until the cache fits its byte budget."""
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, nbytes FROM embeddings ORDER BY last_used ASC LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            dropped = []
+            for key, nbytes in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                dropped.append((key,))
+                self._total_bytes -= nbytes
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", dropped)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an Embeddings model so document embeddings are served from an EmbeddingCache."""
+
+    def __init__(self, base: Embeddings, model_name: str, cache: EmbeddingCache):
+        self.base = base
+        self.model_name = model_name
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [content_key(self.model_name, t) for t in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        # Embed each distinct missing text once, even if it repeats within the batch.
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.base.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(fresh)
+            found.update(fresh)
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [list(found[k]) for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        batch = getattr(self.base, "embed_queries", None)
+        return batch(texts) if batch else [self.base.embed_query(t) for t in texts]
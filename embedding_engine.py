@@ -0,0 +1,165 @@
+"""
+Tunable sentence-transformers embedding engine.
+
+``EmbeddingEngine`` is a drop-in LangChain ``Embeddings`` that exposes the knobs
+``HuggingFaceEmbeddings`` hides: encoder batch size and normalization.
+``SentenceTransformer.encode`` already length-sorts the texts of each call
+before batching, so padding is minimized across a whole pipeline insert batch;
+raise the insert batch size to give it more to sort. The engine keeps a running
+throughput counter so each build can report chunks/sec. torch's intra-op thread
+pool is process-wide, so its size is set once at startup by ``configure_threads``
+(from ``RAG_EMB_THREADS``), never per build.
+
+``HashingEmbeddings`` is a deterministic, model-free stand-in with the same
+interface, for benchmarks and offline runs: token counts are hashed into a
+fixed number of signed buckets, so texts sharing words still land close together.
+"""
+
+import os
+import re
+import threading
+import time
+import zlib
+from typing import List, Optional
+
+import numpy as np
+import torch
+from langchain_core.embeddings import Embeddings
+from sentence_transformers import SentenceTransformer
+
+DEFAULT_ENCODE_BATCH = 32
+DEFAULT_HASHING_DIM = 384
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_threads_lock = threading.Lock()
+_threads_configured = False
+
+
+def configure_threads(num_threads: Optional[int] = None) -> int:
+    """
+    Size torch's intra-op pool from ``num_threads`` or ``RAG_EMB_THREADS`` (else torch's default).
+    Only the first call in a process applies; resizing while other threads encode is unsafe.
+    Returns the pool size in use.
+    """
+    global _threads_configured
+    with _threads_lock:
+        if not _threads_configured:
+            _threads_configured = True
+            num_threads = num_threads or int(os.getenv("RAG_EMB_THREADS", "0"))
+            if num_threads:
+                torch.set_num_threads(num_threads)
+        return torch.get_num_threads()
+
+
+class EmbeddingEngine(Embeddings):
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int = DEFAULT_ENCODE_BATCH,
+        normalize: bool = False,
+        device: str = "cpu",
+        model: Optional[SentenceTransformer] = None,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.normalize = normalize
+        # Pass ``model`` to share already-loaded weights between engines.
+        self.model = model or SentenceTransformer(model_name, device=device)
+        self.texts_embedded = 0
+        self.seconds = 0.0
+
+    @property
+    def cache_key(self) -> str:
+        """Identifies the vectors this engine produces (used as the embedding-cache namespace)."""
+        return f"{self.model_name}#norm" if self.normalize else self.model_name
+
+    @property
+    def num_threads(self) -> int:
+        return torch.get_num_threads()
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.texts_embedded / self.seconds if self.seconds else 0.0
+
+    def reset_stats(self):
+        self.texts_embedded = 0
+        self.seconds = 0.0
+
+    def encode(self, texts: List[str], track_stats: bool = True) -> np.ndarray:
+        """Embed ``texts`` as a float32 matrix in input order."""
+        if not texts:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        started = time.perf_counter()
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=self.normalize,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype(np.float32, copy=False)
+        if track_stats:
+            self.seconds += time.perf_counter() - started
+            self.texts_embedded += len(texts)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text], track_stats=False)[0].tolist()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several questions in one encoder call (not counted in ingestion throughput)."""
+        return self.encode(texts, track_stats=False).tolist()
+
+
+class HashingEmbeddings(Embeddings):
+    """Feature-hashed bag of words (unigrams and bigrams), L2-normalized. No model, no network."""
+
+    def __init__(self, dim: int = DEFAULT_HASHING_DIM):
+        self.dim = dim
+        self.model_name = f"hashing-{dim}"
+        self.batch_size = 0
+        self.num_threads = 1
+        self.texts_embedded = 0
+        self.seconds = 0.0
+
+    @property
+    def cache_key(self) -> str:
+        return self.model_name
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.texts_embedded / self.seconds if self.seconds else 0.0
+
+    def reset_stats(self):
+        self.texts_embedded = 0
+        self.seconds = 0.0
+
+    def _vector(self, text: str, out: np.ndarray):
+        words = _WORD_RE.findall(text.lower())
+        for feature in words + [a + " " + b for a, b in zip(words, words[1:])]:
+            h = zlib.crc32(feature.encode("utf-8"))
+            out[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(out)
+        if norm:
+            out /= norm
+
+    def encode(self, texts: List[str], track_stats: bool = True) -> np.ndarray:
+        started = time.perf_counter()
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in zip(vectors, texts):
+            self._vector(text, row)
+        if track_stats:
+            self.seconds += time.perf_counter() - started
+            self.texts_embedded += len(texts)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text], track_stats=False)[0].tolist()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts, track_stats=False).tolist()
@@ -0,0 +1,219 @@
+"""
+Many named knowledge bases (one per course or semester) served by one process.
+
+Each index is an ordinary persisted directory (see ``persistence.py``) at
+``root/<name>``; an existing directory such as ``./rag_index`` can be
+registered under a name of its own. Nothing is opened up front: an index is
+loaded, memory-mapped through the shared registry, the first time a request is
+routed to it. Loaded indexes are kept in least-recently-used order with their
+on-disk size as the memory estimate, and once the total passes ``max_bytes``
+the coldest ones are dropped until it fits again. A dropped index is simply
+reopened by its next query; sessions that were using it finish on their copy.
+
+``status`` answers "is there an index, and what is in it" from memory: the
+manifest is read once per published generation, not on every request or rerun.
+``names`` likewise lists ``root`` only after something could have changed it:
+a publish in this process, a course directory added or removed, or ``status``
+seeing a new generation (e.g. published by another process).
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from index_store import IndexManifest
+from knowledge_base import load_sparse_index, load_vectorstore
+from persistence import has_index, index_bytes
+from resources import REGISTRY, ResourceRegistry
+import snapshots
+from sparse_index import BM25Index
+import telemetry
+
+DEFAULT_INDEX_ROOT = "./rag_indexes"
+DEFAULT_INDEX_NAME = "default"
+DEFAULT_MAX_INDEX_MB = 2048
+
+_NAME_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
+
+
+class LoadedIndex(NamedTuple):
+    name: str
+    path: str
+    vs: FAISS
+    sparse: BM25Index
+    nbytes: int
+
+
+class IndexStatus(NamedTuple):
+    name: str
+    path: str  # live generation directory
+    exists: bool
+    manifest: IndexManifest  # shared: load a private copy to edit
+
+
+class IndexManager:
+    def __init__(
+        self,
+        root: str = DEFAULT_INDEX_ROOT,
+        max_bytes: int = DEFAULT_MAX_INDEX_MB * 1024 * 1024,
+        registry: ResourceRegistry = REGISTRY,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.registry = registry
+        self._paths: Dict[str, str] = {}
+        self._loaded: "OrderedDict[str, LoadedIndex]" = OrderedDict()  # least recently used first
+        self._used: Dict[str, float] = {}
+        self._status: Dict[str, IndexStatus] = {}
+        self._names: Optional[Tuple[tuple, List[str]]] = None  # (stamp, names) of the last scan
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def register(self, name: str, path: str):
+        """Serve the index directory ``path`` as ``name`` instead of ``root/name``."""
+        self._check_name(name)
+        self._paths[name] = path
+        self.refresh_names()
+
+    @staticmethod
+    def _check_name(name: str):
+        if not _NAME_RE.fullmatch(name or ""):
+            raise ValueError(
+                f"Invalid index name {name!r}: use up to 64 letters, digits, '.', '_' or '-', starting alphanumeric"
+            )
+
+    def path(self, name: str) -> str:
+        self._check_name(name)
+        return self._paths.get(name) or os.path.join(self.root, name)
+
+    def names(self) -> List[str]:
+        """Registered names plus every built index under ``root``, rescanned only when it may have changed."""
+        try:
+            root_mtime = os.stat(self.root).st_mtime_ns
+        except FileNotFoundError:
+            root_mtime = None
+        stamp = (snapshots.published(), root_mtime)
+        with self._lock:
+            if self._names is not None and self._names[0] == stamp:
+                return list(self._names[1])
+        found = set(self._paths)
+        if root_mtime is not None:
+            found.update(
+                name for name in os.listdir(self.root)
+                if _NAME_RE.fullmatch(name) and has_index(os.path.join(self.root, name))
+            )
+        names = sorted(found)
+        with self._lock:
+            self._names = (stamp, names)
+        return list(names)
+
+    def refresh_names(self):
+        """Forget the cached ``names``, e.g. after deleting an index directory by hand."""
+        with self._lock:
+            self._names = None
+
+    def status(self, name: str) -> IndexStatus:
+        """Whether ``name`` has an index and its manifest, re-read only after a new generation is published."""
+        path = self.path(name)
+        live = snapshots.resolve(path)
+        with self._lock:
+            cached = self._status.get(name)
+        if cached is not None and cached.path == live:
+            return cached
+        status = IndexStatus(name, live, has_index(live), IndexManifest.load(live))
+        with self._lock:
+            self._status[name] = status
+            # A new generation, possibly another process's first build of this index.
+            self._names = None
+        return status
+
+    def exists(self, name: str) -> bool:
+        return self.status(name).exists
+
+    def get(self, name: str, embeddings: Embeddings) -> LoadedIndex:
+        """The read-only index ``name``, loaded on first use; may evict colder indexes to stay under budget."""
+        path = self.path(name)
+        if not self.exists(name):
+            raise FileNotFoundError(f"No index named {name!r} yet: build it first")
+        with telemetry.span("route_index", index=name) as attrs:
+            vs = load_vectorstore(path, embeddings)
+            sparse = load_sparse_index(path, vs)
+            with self._lock:
+                entry = self._loaded.get(name)
+                attrs["cache_hit"] = entry is not None and entry.vs is vs and entry.sparse is sparse
+                if attrs["cache_hit"]:
+                    self.hits += 1
+                else:
+                    # First use, or the registry reopened it after a rebuild.
+                    entry = LoadedIndex(name, path, vs, sparse, index_bytes(path))
+                    self._loaded[name] = entry
+                    self.loads += 1
+                self._loaded.move_to_end(name)
+                self._used[name] = time.time()
+                attrs["evicted"] = self._shrink(keep=name)
+        return entry
+
+    def peek(self, name: str) -> Optional[LoadedIndex]:
+        """``name`` if it is currently loaded, without loading it or touching its LRU position."""
+        with self._lock:
+            return self._loaded.get(name)
+
+    def _shrink(self, keep: str) -> int:
+        total = sum(e.nbytes for e in self._loaded.values())
+        dropped = 0
+        for name in list(self._loaded):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            total -= self._drop(name).nbytes
+            dropped += 1
+        self.evictions += dropped
+        return dropped
+
+    def _drop(self, name: str) -> LoadedIndex:
+        entry = self._loaded.pop(name)
+        self._used.pop(name, None)
+        key = os.path.abspath(entry.path)
+        self.registry.evict("faiss_index", key)
+        self.registry.evict("sparse_index", key)
+        return entry
+
+    def evict(self, name: str) -> bool:
+        """Unload ``name`` (e.g. to free memory by hand); False if it was not loaded."""
+        with self._lock:
+            if name not in self._loaded:
+                return False
+            self._drop(name)
+            return True
+
+    @property
+    def loaded_bytes(self) -> int:
+        with self._lock:
+            return sum(e.nbytes for e in self._loaded.values())
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            loaded = [
+                {"name": e.name, "mb": round(e.nbytes / 1e6, 2), "idle_s": round(now - self._used[e.name])}
+                for e in reversed(self._loaded.values())
+            ]
+            loaded_bytes = sum(e.nbytes for e in self._loaded.values())
+        return {
+            "indexes": len(self.names()),
+            "loaded": loaded,
+            "loaded_mb": round(loaded_bytes / 1e6, 2),
+            "max_mb": round(self.max_bytes / 1e6, 2),
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
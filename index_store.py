@@ -0,0 +1,124 @@
+"""
+Document-level manifest for incremental FAISS index updates.
+
+The manifest lives next to the persisted index (``manifest.json``) and records,
+per uploaded file, its content hash and the docstore ids of its chunks. The
+build step diffs new uploads against it so unchanged files are skipped, new
+files are appended, and changed or removed files have their vectors deleted
+(``drop_documents``) before the replacement chunks are streamed in.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from langchain_community.vectorstores import FAISS
+
+import snapshots
+from sparse_index import BM25Index
+from vector_index import delete_vectors
+
+MANIFEST_NAME = "manifest.json"
+
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def chunk_id_prefix(name: str, content_hash: str) -> str:
+    return hashlib.sha256(f"{name}\0{content_hash}".encode("utf-8")).hexdigest()[:16]
+
+
+def make_chunk_id(prefix: str, i: int) -> str:
+    """Deterministic docstore ids so the same file always maps to the same chunk ids."""
+    return f"{prefix}-{i:05d}"
+
+
+class ManifestDiff(NamedTuple):
+    added: List[str]
+    changed: List[str]
+    unchanged: List[str]
+
+
+class IndexManifest:
+    """file name -> {hash, chunk_ids, updated} for every document in an index."""
+
+    def __init__(self, files: Optional[Dict[str, dict]] = None, settings: Optional[dict] = None):
+        self.files: Dict[str, dict] = files or {}
+        self.settings: dict = settings or {}
+
+    @classmethod
+    def load(cls, persist_dir: Optional[str]) -> "IndexManifest":
+        path = os.path.join(snapshots.resolve(persist_dir), MANIFEST_NAME) if persist_dir else None
+        if not path or not os.path.isfile(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("files", {}), data.get("settings", {}))
+
+    def save(self, persist_dir: str):
+        path = os.path.join(persist_dir, MANIFEST_NAME)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"settings": self.settings, "files": self.files}, f, indent=1)
+        os.replace(tmp, path)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.files
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    @property
+    def chunk_count(self) -> int:
+        return sum(len(entry["chunk_ids"]) for entry in self.files.values())
+
+    def fingerprint(self) -> str:
+        """Changes whenever a file is added, changed or removed, or the index settings change."""
+        state = {"settings": self.settings, "files": {name: e["hash"] for name, e in self.files.items()}}
+        return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def compatible(self, settings: dict) -> bool:
+        """An index built with other embedding/chunk settings cannot be extended in place."""
+        return not self.settings or self.settings == settings
+
+    def diff(self, uploads: Dict[str, str]) -> ManifestDiff:
+        """Classify uploaded ``{file name: content hash}`` against what is already indexed."""
+        added, changed, unchanged = [], [], []
+        for name, content_hash in uploads.items():
+            entry = self.files.get(name)
+            if entry is None:
+                added.append(name)
+            elif entry["hash"] != content_hash:
+                changed.append(name)
+            else:
+                unchanged.append(name)
+        return ManifestDiff(added, changed, unchanged)
+
+    def record(self, name: str, content_hash: str, chunk_ids: List[str]):
+        self.files[name] = {"hash": content_hash, "chunk_ids": chunk_ids, "updated": time.time()}
+
+    def forget(self, name: str) -> List[str]:
+        entry = self.files.pop(name, None)
+        return entry["chunk_ids"] if entry else []
+
+
+def drop_documents(
+    vs: Optional[FAISS], manifest: IndexManifest, names: Iterable[str], sparse: Optional[BM25Index] = None
+) -> int:
+    """
+    Forget ``names`` in the manifest and delete their vectors from ``vs`` (and their
+    postings from ``sparse``); returns vectors removed.
+    """
+    stale_ids: List[str] = []
+    for name in names:
+        stale_ids.extend(manifest.forget(name))
+    if sparse is not None:
+        sparse.remove(stale_ids)
+    if vs is None or not stale_ids:
+        return 0
+    live = set(vs.index_to_docstore_id.values())
+    stale_ids = [i for i in stale_ids if i in live]
+    return delete_vectors(vs, stale_ids)
@@ -0,0 +1,244 @@
+"""
+Document ingestion: PDF/TXT readers and a process-pool extraction engine.
+
+``read_pdf`` / ``read_text`` turn one upload into LangChain Documents with
+``source``/``page`` metadata. ``IngestionEngine`` fans PDF page extraction out
+across worker processes in page-range tasks, then streams each file's Documents
+back in upload order and page order, with per-file timings.
+"""
+
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from langchain.docstore.document import Document
+from pypdf import PdfReader
+
+DEFAULT_PAGES_PER_TASK = 16
+
+
+def read_pdf(file: io.BytesIO, filename: str) -> List[Document]:
+    """Extract text per page from PDF and return as LangChain Documents with metadata."""
+    reader = PdfReader(file)
+    docs = []
+    for i, page in enumerate(reader.pages):
+        text = page.extract_text() or ""
+        if text.strip():
+            docs.append(Document(page_content=text, metadata={"source": filename, "page": i + 1}))
+    return docs
+
+
+def read_text(file: io.BytesIO, filename: str, encoding: str = "utf-8") -> List[Document]:
+    content = file.read().decode(encoding, errors="ignore")
+    if content.strip():
+        return [Document(page_content=content, metadata={"source": filename, "page": 1})]
+    return []
+
+
+def _pdf_page_count(data: bytes) -> int:
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+
+# In a worker process: the spooled PDF its last task read, so the next range of it is not parsed again.
+_open_readers: Dict[str, PdfReader] = {}
+
+
+def _open_pdf(path: str) -> PdfReader:
+    reader = _open_readers.get(path)
+    if reader is None:
+        _open_readers.clear()
+        reader = _open_readers[path] = PdfReader(path)
+    return reader
+
+
+def _extract_page_range(
+    source: Union[bytes, str], start: int, stop: int
+) -> Tuple[List[Tuple[int, str]], float]:
+    """
+    Worker task: (1-based page number, text) for pages [start, stop) that have text, and the
+    seconds spent. ``source`` is the PDF's bytes or, for pool workers, the path it was spooled to.
+    """
+    started = time.perf_counter()
+    reader = _open_pdf(source) if isinstance(source, str) else PdfReader(io.BytesIO(source))
+    out = []
+    for i in range(start, stop):
+        text = reader.pages[i].extract_text() or ""
+        if text.strip():
+            out.append((i + 1, text))
+    return out, time.perf_counter() - started
+
+
+class PageBatch(NamedTuple):
+    """
+    Documents for one extracted page range; ``last`` marks the final batch of a file.
+    ``seconds`` is the extraction time spent on the file so far, summed over its ranges.
+    """
+    filename: str
+    docs: List[Document]
+    pages: int
+    last: bool
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+class IngestResult(NamedTuple):
+    filename: str
+    docs: List[Document]
+    pages: int
+    seconds: float
+    error: Optional[str] = None
+
+
+class _Task(NamedTuple):
+    file_idx: int
+    filename: str
+    data: bytes
+    start: int
+    stop: int
+    pages: int
+    last: bool
+    error: Optional[str] = None
+    path: Optional[str] = None  # spooled copy for pool workers
+
+
+class IngestionEngine:
+    """
+    Extract many uploads in parallel.
+
+    Each PDF is split into ``pages_per_task`` page ranges that are scheduled on a
+    shared process pool, so one huge PDF and many small ones both use every core.
+    At most ``max_inflight`` ranges are outstanding at once, which keeps memory
+    flat however large the batch of uploads is. A PDF is spooled to a temp file
+    once and its tasks send only the path, rather than pickling the whole file to
+    a worker per range. With ``max_workers <= 1`` everything runs in-process.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        pages_per_task: int = DEFAULT_PAGES_PER_TASK,
+        max_inflight: Optional[int] = None,
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_task = max(1, pages_per_task)
+        self.max_inflight = max_inflight or self.max_workers * 2
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._closed = False
+
+    def __enter__(self) -> "IngestionEngine":
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._closed:
+            # e.g. a prefetch thread still reading after the build gave up: never start a pool nobody shuts down.
+            raise RuntimeError("IngestionEngine has been shut down")
+        if self._pool is None:
+            # spawn: forking a threaded Streamlit server can deadlock the children.
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def shutdown(self):
+        self._closed = True
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def _plan(self, files: Iterable[Tuple[str, bytes]], spool_dir: Optional[str]) -> Iterator[_Task]:
+        for idx, (filename, data) in enumerate(files):
+            if not filename.lower().endswith(".pdf"):
+                yield _Task(idx, filename, data, 0, 1, 1, True)
+                continue
+            try:
+                pages = _pdf_page_count(data)
+            except Exception as e:
+                yield _Task(idx, filename, data, 0, 0, 0, True, str(e))
+                continue
+            if pages == 0:
+                yield _Task(idx, filename, data, 0, 0, 0, True)
+                continue
+            path = None
+            if spool_dir is not None:
+                path = os.path.join(spool_dir, f"{idx}.pdf")
+                with open(path, "wb") as f:
+                    f.write(data)
+            for start in range(0, pages, self.pages_per_task):
+                stop = min(start + self.pages_per_task, pages)
+                yield _Task(idx, filename, data, start, stop, pages, stop == pages, path=path)
+
+    @staticmethod
+    def _run(task: _Task) -> List[Document]:
+        if not task.filename.lower().endswith(".pdf"):
+            return read_text(io.BytesIO(task.data), task.filename)
+        return [
+            Document(page_content=text, metadata={"source": task.filename, "page": page})
+            for page, text in _extract_page_range(task.data, task.start, task.stop)[0]
+        ]
+
+    def iter_page_batches(self, files: Iterable[Tuple[str, bytes]]) -> Iterator[PageBatch]:
+        """Yield page ranges in upload order and page order while later ranges extract in the background."""
+        parallel = self.max_workers > 1
+        spool_dir = tempfile.mkdtemp(prefix="rag-ingest-") if parallel else None
+        plan = self._plan(files, spool_dir)
+        inflight: Deque[Tuple[_Task, Optional[Future]]] = deque()
+        spent: Dict[int, float] = {}
+
+        def fill():
+            while len(inflight) < self.max_inflight:
+                task = next(plan, None)
+                if task is None:
+                    return
+                fut = None
+                if task.path is not None and task.error is None:
+                    fut = self._executor().submit(_extract_page_range, task.path, task.start, task.stop)
+                inflight.append((task, fut))
+
+        try:
+            fill()
+            while inflight:
+                task, fut = inflight.popleft()
+                error = task.error
+                docs: List[Document] = []
+                if error is None:
+                    try:
+                        if fut is None:
+                            started = time.perf_counter()
+                            docs = self._run(task)
+                            seconds = time.perf_counter() - started
+                        else:
+                            pages, seconds = fut.result()  # timed in the worker: excludes queueing
+                            docs = [
+                                Document(page_content=text, metadata={"source": task.filename, "page": page})
+                                for page, text in pages
+                            ]
+                        spent[task.file_idx] = spent.get(task.file_idx, 0.0) + seconds
+                    except Exception as e:
+                        error = str(e)
+                if task.last and task.path is not None:
+                    os.remove(task.path)  # every range of it has been extracted
+                yield PageBatch(task.filename, docs, task.pages, task.last, spent.get(task.file_idx, 0.0), error)
+                fill()
+        finally:
+            if spool_dir is not None:
+                shutil.rmtree(spool_dir, ignore_errors=True)
+
+    def iter_documents(self, files: Iterable[Tuple[str, bytes]]) -> Iterator[IngestResult]:
+        """Yield one IngestResult per ``(filename, bytes)`` in input order, Documents in page order."""
+        docs: List[Document] = []
+        error: Optional[str] = None
+        for batch in self.iter_page_batches(files):
+            docs.extend(batch.docs)
+            error = error or batch.error
+            if batch.last:
+                yield IngestResult(batch.filename, [] if error else docs, batch.pages, batch.seconds, error)
+                docs, error = [], None
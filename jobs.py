@@ -0,0 +1,381 @@
+"""
+Background ingestion jobs for persisted indexes.
+
+Building a large upload inside a Streamlit rerun (or an HTTP request) blocks
+it and is lost when the browser reconnects. ``JobQueue.submit`` instead spools
+the uploaded files to ``jobs_dir/<job id>/``, records the job in a SQLite
+table and returns at once; a small worker pool runs the build:
+
+- progress (stage, files done, pages, chunks, chunks/sec, per-file timings and
+  errors) is written to the job row after every insert batch, so any session
+  or API worker can poll it,
+- ``cancel`` sets a flag the build checks after every batch; a cancelled or
+  failed job leaves the live index untouched,
+- the build reads the live index but writes a new snapshot generation (see
+  ``snapshots.py``), which readers switch to only once it is complete,
+- a job belongs to the process that submitted it (``owner``, host and PID).
+  Jobs left ``queued`` or ``running`` by a process that has since died are
+  adopted from their spooled files the next time a queue is opened on the
+  same directory; a live owner's jobs are never taken, so the app and the API
+  can share one jobs directory. Chunks embedded before the crash come back
+  from the embedding cache, so a resumed job mostly re-reads and re-chunks,
+- the spec stores the full ``make_embeddings`` arguments, so whichever process
+  runs a job embeds it with the model it was submitted with.
+
+One build per index runs at a time (``snapshots.writer``, shared with the API's
+synchronous ``/ingest`` and the app, also across processes). A job whose index
+is being written goes back to the queue for a moment instead of holding a
+worker, so builds of different indexes overlap.
+"""
+
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from index_store import IndexManifest
+from knowledge_base import chunk_documents, make_embeddings, update_knowledge_base
+from persistence import has_index
+from pipeline import DEFAULT_BATCH_SIZE, PipelineStats
+from resources import REGISTRY
+import snapshots
+import telemetry
+
+DEFAULT_JOBS_DIR = "./rag_jobs"
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+FINISHED_STATES = ("done", "failed", "cancelled")
+_FILES_DIR = "files"
+_BUSY_RETRY_S = 1.0  # a job whose index is locked is tried again after this
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    """False when ``owner`` is a process on this host that no longer exists."""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True  # another machine's job; leave it to that machine
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+class JobStore:
+    """The persisted job table: one row per job, JSON columns for its spec, progress and result."""
+
+    def __init__(self, jobs_dir: str = DEFAULT_JOBS_DIR):
+        os.makedirs(jobs_dir, exist_ok=True)
+        self.path = os.path.join(jobs_dir, "jobs.sqlite")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, persist_dir TEXT NOT NULL, state TEXT NOT NULL, spec TEXT NOT NULL,"
+            " files TEXT NOT NULL, progress TEXT NOT NULL DEFAULT '{}', result TEXT, error TEXT,"
+            " cancel INTEGER NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, owner TEXT,"
+            " created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dir ON jobs(persist_dir, created)")
+        self._conn.commit()
+
+    def create(self, job_id: str, persist_dir: str, spec: dict, files: List[str]):
+        """Record a queued job owned by this process."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, persist_dir, state, spec, files, owner, created, updated)"
+                " VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, persist_dir, json.dumps(spec), json.dumps(files), _owner(), now, now),
+            )
+            self._conn.commit()
+
+    def claim(self, job_id: str) -> bool:
+        """Move this process's queued job to running; False if it was cancelled or adopted by another process."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1, updated = ?"
+                " WHERE id = ? AND state = 'queued' AND cancel = 0 AND owner = ?",
+                (time.time(), job_id, _owner()),
+            )
+            self._conn.commit()
+            return cur.rowcount == 1
+
+    def update(self, job_id: str, **fields):
+        for key in ("progress", "result"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+        fields["updated"] = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?", (*fields.values(), job_id)
+            )
+            self._conn.commit()
+
+    def request_cancel(self, job_id: str) -> bool:
+        """Flag a job for cancellation; a queued job is cancelled at once. False if it already finished."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET cancel = 1, updated = ? WHERE id = ? AND state IN ('queued', 'running')",
+                (time.time(), job_id),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET state = 'cancelled' WHERE id = ? AND state = 'queued'", (job_id,)
+            )
+            self._conn.commit()
+            return cur.rowcount == 1
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def requeue_orphans(self) -> List[str]:
+        """Adopt every unfinished job whose owning process is gone, queued for this one; returns their ids."""
+        adopted = []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, owner FROM jobs WHERE state IN ('queued', 'running') ORDER BY created"
+            ).fetchall()
+            for job_id, owner in rows:
+                if _owner_alive(owner):
+                    continue
+                # Conditional on the dead owner, so of two processes opening the queue at once only one adopts it.
+                cur = self._conn.execute(
+                    "UPDATE jobs SET state = 'queued', owner = ?, updated = ?"
+                    " WHERE id = ? AND owner IS ? AND state IN ('queued', 'running')",
+                    (_owner(), time.time(), job_id, owner),
+                )
+                if cur.rowcount == 1:
+                    adopted.append(job_id)
+            self._conn.commit()
+        return adopted
+
+    def release(self, job_id: str):
+        """Put a job this process claimed back in the queue without counting the attempt."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'queued', attempts = attempts - 1, updated = ?"
+                " WHERE id = ? AND state = 'running' AND owner = ?",
+                (time.time(), job_id, _owner()),
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _row(row) -> dict:
+        keys = ("id", "persist_dir", "state", "spec", "files", "progress", "result", "error", "cancel",
+                "attempts", "owner", "created", "updated")
+        job = dict(zip(keys, row))
+        for key in ("spec", "files", "progress", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        job["cancel"] = bool(job["cancel"])
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def list(self, persist_dir: Optional[str] = None, limit: int = 20) -> List[dict]:
+        """Newest first, optionally only the jobs of one index."""
+        query, args = "SELECT * FROM jobs", []
+        if persist_dir is not None:
+            query, args = query + " WHERE persist_dir = ?", [persist_dir]
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY created DESC LIMIT ?", (*args, limit)).fetchall()
+        return [self._row(r) for r in rows]
+
+
+def default_embeddings(spec: dict) -> Embeddings:
+    """The embeddings a job was submitted with (``make_embeddings`` keyword arguments)."""
+    return make_embeddings(**spec["embeddings"])
+
+
+class JobQueue:
+    def __init__(
+        self,
+        jobs_dir: str = DEFAULT_JOBS_DIR,
+        workers: int = 1,
+        embeddings_factory: Callable[[dict], Embeddings] = default_embeddings,
+    ):
+        self.jobs_dir = jobs_dir
+        self.store = JobStore(jobs_dir)
+        self.embeddings_factory = embeddings_factory
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingest-job")
+        self._closed = False
+        for job_id in self.store.requeue_orphans():
+            self._pool.submit(self._run, job_id)
+
+    def submit(
+        self,
+        persist_dir: str,
+        files: Dict[str, bytes],
+        remove: List[str],
+        settings: dict,
+        embeddings: Optional[dict] = None,
+        index_config: Optional[dict] = None,
+        workers: int = 1,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> str:
+        """
+        Queue a build of ``files`` (and removal of ``remove``) into ``persist_dir``.
+        ``embeddings`` holds the ``make_embeddings`` keyword arguments to build it with;
+        every process sharing the jobs directory must be able to run the job from them.
+        """
+        if not embeddings or "emb_model_name" not in embeddings:
+            raise ValueError("embeddings must give make_embeddings arguments, at least emb_model_name")
+        job_id = uuid.uuid4().hex[:12]
+        spool = os.path.join(self.jobs_dir, job_id, _FILES_DIR)
+        os.makedirs(spool)
+        names = []
+        for i, (name, data) in enumerate(files.items()):
+            # Indexed names keep upload order and stay unique whatever characters the file name has.
+            with open(os.path.join(spool, f"{i:05d}"), "wb") as f:
+                f.write(data)
+            names.append(name)
+        spec = {
+            "remove": list(remove), "settings": settings, "embeddings": dict(embeddings),
+            "index_config": index_config or {}, "workers": workers, "batch_size": batch_size,
+        }
+        self.store.create(job_id, os.path.abspath(persist_dir), spec, names)
+        self._pool.submit(self._run, job_id)
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        return self.store.request_cancel(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.store.get(job_id)
+
+    def list(self, persist_dir: Optional[str] = None, limit: int = 20) -> List[dict]:
+        return self.store.list(os.path.abspath(persist_dir) if persist_dir else None, limit)
+
+    def _spooled(self, job: dict) -> Dict[str, bytes]:
+        spool = os.path.join(self.jobs_dir, job["id"], _FILES_DIR)
+        files = {}
+        for i, name in enumerate(job["files"]):
+            with open(os.path.join(spool, f"{i:05d}"), "rb") as f:
+                files[name] = f.read()
+        return files
+
+    def _run(self, job_id: str):
+        job = self.store.get(job_id)
+        if job is None:
+            return
+        persist_dir = job["persist_dir"]
+        if not self.store.claim(job_id):
+            if self.store.get(job_id)["state"] in FINISHED_STATES:  # cancelled while queued
+                shutil.rmtree(os.path.join(self.jobs_dir, job_id), ignore_errors=True)
+            return
+        try:
+            with snapshots.writer(persist_dir, blocking=False):
+                self._run_claimed(job)
+        except snapshots.WriterBusy:
+            # Another build of this index is running: free the worker for other indexes' jobs.
+            self.store.release(job_id)
+            timer = threading.Timer(_BUSY_RETRY_S, self._resubmit, (job_id,))
+            timer.daemon = True
+            timer.start()
+
+    def _resubmit(self, job_id: str):
+        if self._closed:
+            return  # still queued under this process; adopted once it exits
+        try:
+            self._pool.submit(self._run, job_id)
+        except RuntimeError:  # shut down meanwhile
+            pass
+
+    def _run_claimed(self, job: dict):
+        job_id, persist_dir = job["id"], job["persist_dir"]
+        # A crashed attempt's staging directory is collected with the next generation.
+        staging = snapshots.begin(persist_dir)
+        try:
+            result = self._build(job, staging)
+        except JobCancelled:
+            self.store.update(job_id, state="cancelled")
+        except Exception as e:
+            self.store.update(job_id, state="failed", error=f"{type(e).__name__}: {e}")
+        else:
+            self.store.update(job_id, state="done", result=result)
+        finally:
+            snapshots.discard(staging)
+            shutil.rmtree(os.path.join(self.jobs_dir, job_id), ignore_errors=True)
+
+    def _build(self, job: dict, staging: str) -> dict:
+        job_id, persist_dir, spec = job["id"], job["persist_dir"], job["spec"]
+        files = self._spooled(job)
+        settings = spec["settings"]
+        progress = {"stage": "indexing", "files_total": len(files), "files_done": 0, "pages": 0, "chunks": 0}
+        self.store.update(job_id, progress=progress)
+
+        def on_batch(stats: PipelineStats):
+            progress.update(
+                files_done=stats.files_done, pages=stats.pages, chunks=stats.chunks,
+                chunks_per_sec=round(stats.chunks_per_sec, 1), files=stats.file_timings,
+                errors=[{"file": name, "error": err} for name, err in stats.errors],
+            )
+            self.store.update(job_id, progress=progress)
+            if self.store.cancel_requested(job_id):
+                raise JobCancelled(job_id)
+
+        with telemetry.trace("ingest_job", job=job_id, files=len(files), removed=len(spec["remove"])) as tr:
+            result = update_knowledge_base(
+                files, self.embeddings_factory(spec), persist_dir, IndexManifest.load(persist_dir), settings,
+                lambda docs: chunk_documents(docs, settings["chunk_size"], settings["chunk_overlap"]),
+                spec["workers"], remove=spec["remove"], batch_size=spec["batch_size"], on_batch=on_batch,
+                index_config=spec["index_config"], output_dir=staging,
+            )
+            if self.store.cancel_requested(job_id):
+                raise JobCancelled(job_id)
+            if has_index(staging):
+                progress["stage"] = "publishing"
+                self.store.update(job_id, progress=progress)
+                with telemetry.span("publish_snapshot"):
+                    snapshots.publish(persist_dir, staging)
+                # Readers re-map the new files on their next load.
+                REGISTRY.evict("faiss_index", persist_dir)
+                REGISTRY.evict("sparse_index", persist_dir)
+            tr.set(pages=result.stats.pages, chunks=result.stats.chunks, errors=len(result.stats.errors))
+
+        stages: Dict[str, float] = {}
+        for span in tr.timeline():
+            stages[span["stage"]] = round(stages.get(span["stage"], 0.0) + span["duration_ms"] / 1000, 3)
+        progress["stage"] = "done"
+        self.store.update(job_id, progress=progress)
+        return {
+            "indexed": [t["file"] for t in result.stats.file_timings if t["file"] not in dict(result.stats.errors)],
+            "skipped": result.skipped,
+            "removed": spec["remove"],
+            "errors": [{"file": name, "error": err} for name, err in result.stats.errors],
+            "chunks": result.stats.chunks,
+            "total_vectors": result.vs.index.ntotal if result.vs is not None else 0,
+            "rebuilt": result.rebuilt,
+            "bytes_written": result.stats.bytes_written,
+            "seconds": round(tr.seconds, 3),
+            "stages": stages,
+            "trace_id": tr.id,
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._closed = True
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,256 @@
+"""
+Knowledge-base build and load steps shared by the Streamlit app and the HTTP API.
+
+Both entry points chunk, embed and index uploads through the same streaming
+pipeline, keep the same manifest, and read persisted indexes through the
+process-wide registry, so an index built from one is served by the other.
+"""
+
+import os
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from chunker import Chunker
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from embedding_engine import DEFAULT_ENCODE_BATCH, EmbeddingEngine, HashingEmbeddings
+from index_store import IndexManifest, drop_documents, file_hash
+from ingest import IngestionEngine, PageBatch
+from persistence import has_index, index_bytes, load_index, save_index
+from pipeline import DEFAULT_BATCH_SIZE, PipelineStats, stream_into_index
+from resources import REGISTRY
+import snapshots
+from sparse_index import BM25Index
+import telemetry
+from vector_index import convert_vectorstore, index_kind, make_index, train_size
+
+HASHING_PREFIX = "hashing-"
+
+def chunk_documents(docs: List[Document], chunk_size: int, chunk_overlap: int) -> List[Document]:
+    # Same chunks as RecursiveCharacterTextSplitter, in one pass over offsets.
+    # start_index lets the context builder merge overlapping neighbours exactly.
+    return Chunker(chunk_size, chunk_overlap, add_start_index=True).split_documents(docs)
+
+
+def make_embeddings(
+    emb_model_name: str,
+    cache_dir: Optional[str] = None,
+    cache_max_mb: int = 512,
+    cache_dtype: str = "float32",
+    encode_batch: int = DEFAULT_ENCODE_BATCH,
+    normalize: bool = False,
+):
+    """
+    Tuned sentence-transformers engine, optionally wrapped in the persistent content-hash cache.
+    Model weights and cache connections come from the process-wide registry, so the
+    engine itself is a cheap per-build wrapper. ``hashing-<dim>`` names the offline
+    ``HashingEmbeddings`` stand-in instead (nothing to load or cache).
+    """
+    if emb_model_name.startswith(HASHING_PREFIX):
+        dim = int(emb_model_name[len(HASHING_PREFIX):])
+        return REGISTRY.get_or_create("embedding_model", emb_model_name, lambda: HashingEmbeddings(dim))
+    model = REGISTRY.get_or_create(
+        "embedding_model", emb_model_name, lambda: EmbeddingEngine(emb_model_name).model
+    )
+    embeddings = EmbeddingEngine(
+        emb_model_name, batch_size=encode_batch, normalize=normalize, model=model
+    )
+    if cache_dir:
+        max_bytes = cache_max_mb * 1024 * 1024
+        # One connection per cache file; a new budget or dtype applies to the existing one.
+        cache = REGISTRY.get_or_create(
+            "embedding_cache", os.path.abspath(cache_dir),
+            lambda: EmbeddingCache(cache_dir, max_bytes=max_bytes, dtype=cache_dtype),
+        )
+        cache.configure(max_bytes=max_bytes, dtype=cache_dtype)
+        return CachedEmbeddings(embeddings, embeddings.cache_key, cache)
+    return embeddings
+
+
+def index_settings(emb_model_name: str, chunk_size: int, chunk_overlap: int, normalize: bool = False) -> dict:
+    """Settings an index was built with; changing any of them invalidates incremental updates."""
+    settings = {"emb_model": emb_model_name, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    if normalize:
+        settings["normalize"] = True
+    return settings
+
+
+def load_vectorstore(persist_dir: str, embeddings: Embeddings) -> FAISS:
+    """
+    Shared read-only (memory-mapped) view of a persisted index, for answering queries.
+    Reopened when another writer (maybe another process) has published a newer generation.
+    ``embeddings`` is only used when the view is (re)opened; the shared store is never mutated.
+    """
+    key = os.path.abspath(persist_dir)
+    vs = REGISTRY.get_or_create("faiss_index", key, lambda: load_index(persist_dir, embeddings, mmap=True))
+    live = os.path.abspath(snapshots.resolve(persist_dir))
+    if snapshots.source(vs) != live:
+        # Queries still running on the old view finish on it; its generation is collected after them.
+        vs = load_index(persist_dir, embeddings, mmap=True)
+        REGISTRY.put("faiss_index", key, vs)
+    return vs
+
+
+def _load_sparse(persist_dir: str, vs: FAISS) -> BM25Index:
+    generation = snapshots.source(vs) or persist_dir
+    sparse = BM25Index.load(generation) or BM25Index.from_vectorstore(vs)
+    snapshots.track(sparse, generation)
+    return sparse
+
+
+def load_sparse_index(persist_dir: str, vs: FAISS) -> BM25Index:
+    """Shared BM25 index for ``vs``'s generation of a persisted store, rebuilt from its chunks if it predates BM25."""
+    key = os.path.abspath(persist_dir)
+    sparse = REGISTRY.get_or_create("sparse_index", key, lambda: _load_sparse(persist_dir, vs))
+    if snapshots.source(sparse) != snapshots.source(vs):
+        sparse = _load_sparse(persist_dir, vs)
+        REGISTRY.put("sparse_index", key, sparse)
+    return sparse
+
+
+def build_or_load_vectorstore(
+    page_batches: Iterable[PageBatch],
+    hashes: Dict[str, str],
+    embeddings: Embeddings,
+    persist_dir: Optional[str],
+    manifest: IndexManifest,
+    chunk_fn: Callable[[List[Document]], List[Document]],
+    existing: Optional[FAISS] = None,
+    remove: List[str] = (),
+    fresh: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_batch: Optional[Callable[[PipelineStats], None]] = None,
+    index_config: Optional[dict] = None,
+    sparse: Optional[BM25Index] = None,
+    output_dir: Optional[str] = None,
+) -> Tuple[Optional[FAISS], BM25Index, PipelineStats]:
+    """
+    Load the current index (session copy or ./rag_index) and apply only the delta:
+    ``page_batches`` streams the pages of new/changed files (``hashes`` maps their names
+    to content hashes), ``remove`` lists indexed files to drop. ``fresh`` ignores any
+    existing index. ``index_config`` ({kind, nlist, pq_m, hnsw_m}) selects the FAISS
+    index type; an existing index of another type is converted in place. ``sparse`` is
+    the session's BM25 index for ``existing``; it is updated with the same delta.
+    If anything changed, the result is published as a new generation of ``persist_dir``;
+    ``output_dir`` writes it there instead, for the caller to publish (or discard).
+    """
+    index_config = index_config or {}
+    vs = None if fresh else existing
+    sparse = None if fresh or vs is None else sparse
+    if vs is None and not fresh and has_index(persist_dir):
+        # Writable copy: the shared reader is memory-mapped and must never be mutated.
+        with telemetry.span("load_index") as attrs:
+            vs = load_index(persist_dir, embeddings, mmap=False)
+            sparse = BM25Index.load(persist_dir)
+            attrs["vectors"] = vs.index.ntotal
+    if vs is not None:
+        vs.embedding_function = embeddings
+        if sparse is None:
+            sparse = BM25Index.from_vectorstore(vs)
+    sparse = sparse if sparse is not None else BM25Index()
+
+    before = manifest.fingerprint()
+    with telemetry.span("drop_documents", files=len(remove) + len(hashes)):
+        dropped = drop_documents(vs, manifest, list(remove) + list(hashes), sparse)
+    kind = index_config.get("kind", "flat")
+    params = {k: v for k, v in index_config.items() if k != "kind"}
+    vs, stats = stream_into_index(
+        vs, embeddings, manifest, page_batches, hashes, chunk_fn, batch_size=batch_size, on_batch=on_batch,
+        index_factory=lambda sample: make_index(kind, sample, **params),
+        train_size=train_size(kind, params.get("nlist", 0)), sparse=sparse,
+    )
+    converted = vs is not None and vs.index.ntotal and index_kind(vs.index) != kind
+    if converted:
+        with telemetry.span("convert_index", kind=kind, vectors=vs.index.ntotal):
+            vs = convert_vectorstore(vs, kind, **params)
+    # Only a modified index is written, so an unchanged re-upload publishes nothing.
+    dirty = bool(dropped or stats.chunks or converted or manifest.fingerprint() != before)
+    if vs is not None and dirty:
+        if output_dir:
+            with telemetry.span("persist", vectors=vs.index.ntotal) as attrs:
+                stats.bytes_written = attrs["bytes"] = write_index_files(output_dir, vs, sparse, manifest)
+        elif persist_dir:
+            stats.bytes_written = _publish(vs, persist_dir, sparse, manifest)
+    return vs, sparse, stats
+
+
+def write_index_files(
+    directory: str, vs: FAISS, sparse: Optional[BM25Index], manifest: Optional[IndexManifest]
+) -> int:
+    """Write one generation's files into ``directory``; returns the bytes written."""
+    save_index(vs, directory)
+    if sparse is not None:
+        sparse.save(directory)
+    if manifest is not None:
+        manifest.save(directory)
+    return index_bytes(directory)
+
+
+def _publish(vs: FAISS, persist_dir: str, sparse: Optional[BM25Index], manifest: Optional[IndexManifest]) -> int:
+    """
+    Write ``vs`` (with its BM25 index and manifest) as a new generation of ``persist_dir``
+    and switch readers to it; a crash part-way leaves the live generation untouched.
+    Returns the bytes written.
+    """
+    os.makedirs(persist_dir, exist_ok=True)
+    with telemetry.span("persist", vectors=vs.index.ntotal) as attrs:
+        staged = snapshots.begin(persist_dir)
+        try:
+            written = attrs["bytes"] = write_index_files(staged, vs, sparse, manifest)
+            snapshots.publish(persist_dir, staged)
+        except BaseException:
+            snapshots.discard(staged)
+            raise
+    # Readers in this process re-map the new generation on their next load.
+    REGISTRY.evict("faiss_index", os.path.abspath(persist_dir))
+    REGISTRY.evict("sparse_index", os.path.abspath(persist_dir))
+    return written
+
+
+class BuildResult(NamedTuple):
+    vs: Optional[FAISS]
+    sparse: BM25Index
+    manifest: IndexManifest
+    stats: PipelineStats
+    skipped: List[str]  # uploads whose content is already indexed
+    rebuilt: bool  # settings changed, so the index was rebuilt from these uploads only
+
+
+def update_knowledge_base(
+    files: Dict[str, bytes],
+    embeddings: Embeddings,
+    persist_dir: Optional[str],
+    manifest: IndexManifest,
+    settings: dict,
+    chunk_fn: Callable[[List[Document]], List[Document]],
+    workers: int,
+    existing: Optional[FAISS] = None,
+    existing_sparse: Optional[BM25Index] = None,
+    remove: List[str] = (),
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_batch: Optional[Callable[[PipelineStats], None]] = None,
+    index_config: Optional[dict] = None,
+    output_dir: Optional[str] = None,
+) -> BuildResult:
+    """
+    Diff uploaded ``{file name: bytes}`` against ``manifest`` and stream only new or
+    changed files (plus the ``remove`` list) into the index. If ``settings`` differ
+    from the ones the index was built with, it is rebuilt from these uploads only.
+    """
+    rebuilt = not manifest.compatible(settings)
+    if rebuilt:
+        manifest = IndexManifest()
+    manifest.settings = settings
+
+    hashes = {name: file_hash(data) for name, data in files.items()}
+    diff = manifest.diff(hashes)
+    new_hashes = {name: hashes[name] for name in diff.added + diff.changed}
+    with IngestionEngine(max_workers=workers) as ingest_engine:
+        vs, sparse, stats = build_or_load_vectorstore(
+            ingest_engine.iter_page_batches((name, files[name]) for name in new_hashes),
+            new_hashes, embeddings, persist_dir, manifest, chunk_fn, existing, remove, rebuilt,
+            batch_size, on_batch, index_config, existing_sparse, output_dir,
+        )
+    return BuildResult(vs, sparse, manifest, stats, diff.unchanged, rebuilt)
@@ -0,0 +1,164 @@
+"""
+On-disk index layout that can be memory-mapped by many worker processes.
+
+``FAISS.save_local`` writes ``index.faiss`` plus one ``index.pkl`` holding every
+chunk as Python objects, which each worker must unpickle into its own heap. The
+layout here keeps ``index.faiss`` but replaces the pickle with the columnar
+``chunks/`` store (see ``chunk_store.py``): texts in one offset-indexed blob and
+source/page metadata in compact arrays, stored in FAISS row order. Readers open
+both with mmap, so startup is near-instant, the OS page cache is shared between
+processes, and a query only decodes the top-K chunks it returns.
+
+Memory-mapped indexes are read-only: adding to one aborts inside FAISS, so
+builds always load a writable copy with ``mmap=False``.
+
+Indexes saved by ``FAISS.save_local`` (``index.pkl``) are migrated the first
+time they are opened: under the ``snapshots.writer`` lock, their files are copied
+into a new generation with ``chunks/`` in place of the pickle, and that generation
+is published, so the directory readers have open is never modified.
+
+Readers take an index directory and open its live generation (see
+``snapshots.py``); ``save_index`` writes into the one directory it is given,
+normally a staging directory that is published as a new generation afterwards.
+"""
+
+import os
+import pickle
+import shutil
+import uuid
+from typing import Dict, Iterator, Optional, Tuple
+
+import faiss
+from langchain.docstore.document import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from chunk_store import CHUNKS_DIR, ChunkRowMap, ChunkStore, ChunkStoreDocstore, replace_dir
+import snapshots
+
+INDEX_FILE = "index.faiss"
+LEGACY_PICKLE = "index.pkl"
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+_NOT_COPIED = (LEGACY_PICKLE, snapshots.CURRENT_FILE)  # when a legacy directory is migrated
+
+
+def has_index(persist_dir: Optional[str]) -> bool:
+    if not persist_dir:
+        return False
+    persist_dir = snapshots.resolve(persist_dir)
+    return os.path.isfile(os.path.join(persist_dir, INDEX_FILE)) and any(
+        os.path.exists(os.path.join(persist_dir, name)) for name in (CHUNKS_DIR, LEGACY_PICKLE)
+    )
+
+
+def index_bytes(persist_dir: str) -> int:
+    """Bytes on disk of ``persist_dir``'s live generation (index, chunks, BM25, manifest)."""
+    total = 0
+    for root, _, names in os.walk(snapshots.resolve(persist_dir)):
+        total += sum(os.path.getsize(os.path.join(root, n)) for n in names)
+    return total
+
+
+def _iter_rows(docstore: Docstore, row_map) -> Iterator[Tuple[str, Document]]:
+    """Yield ``(chunk id, Document)`` in FAISS row order; rows must be 0..n-1."""
+    for expected, (row, id_) in enumerate(sorted(row_map.items())):
+        if row != expected:
+            raise ValueError(f"FAISS row map is not contiguous (row {row} at position {expected})")
+        doc = docstore.search(id_)
+        if not isinstance(doc, Document):
+            raise ValueError(f"Chunk {id_} is in the FAISS row map but not in the docstore")
+        yield id_, doc
+
+
+def _fsync_replace(tmp: str, path: str):
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _write_chunks(persist_dir: str, docstore: Docstore, row_map):
+    chunks_path = os.path.join(persist_dir, CHUNKS_DIR)
+    tmp = f"{chunks_path}.tmp-{uuid.uuid4().hex[:8]}"  # never shared with a concurrent save
+    try:
+        ChunkStore.write(tmp, _iter_rows(docstore, row_map))
+        replace_dir(tmp, chunks_path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def save_index(vs: FAISS, persist_dir: str):
+    """
+    Write ``index.faiss`` and ``chunks/`` for ``vs``. Each is written to a temp name
+    and renamed into place, so readers see either the old or the new version.
+    """
+    os.makedirs(persist_dir, exist_ok=True)
+    index_path = os.path.join(persist_dir, INDEX_FILE)
+    faiss.write_index(vs.index, index_path + ".tmp")
+    _fsync_replace(index_path + ".tmp", index_path)
+    _write_chunks(persist_dir, vs.docstore, vs.index_to_docstore_id)
+
+
+def _read_legacy(persist_dir: str) -> Tuple[Docstore, Dict[int, str]]:
+    # Written by FAISS.save_local: a pickled (docstore, index_to_docstore_id) tuple.
+    with open(os.path.join(persist_dir, LEGACY_PICKLE), "rb") as f:
+        return pickle.load(f)
+
+
+def _needs_migration(directory: str) -> bool:
+    return has_index(directory) and not os.path.isdir(os.path.join(directory, CHUNKS_DIR))
+
+
+def migrate_index(persist_dir: str) -> bool:
+    """
+    Publish an ``index.pkl`` index as a new generation with ``chunks/``; False if there was
+    nothing to do. Holds the writer lock, so concurrent openers migrate it only once.
+    """
+    if not _needs_migration(snapshots.resolve(persist_dir)):
+        return False
+    with snapshots.writer(persist_dir):
+        live = snapshots.resolve(persist_dir)
+        if not _needs_migration(live):
+            return False  # another worker got there first
+        docstore, rows = _read_legacy(live)
+        staged = snapshots.begin(persist_dir)
+        try:
+            # index.faiss, sparse_index.json and manifest.json carry over unchanged.
+            for name in os.listdir(live):
+                path = os.path.join(live, name)
+                if os.path.isfile(path) and name not in _NOT_COPIED and not name.startswith("."):
+                    shutil.copy2(path, os.path.join(staged, name))
+            _write_chunks(staged, docstore, rows)
+            snapshots.publish(persist_dir, staged)
+        except BaseException:
+            snapshots.discard(staged)
+            raise
+    return True
+
+
+def load_index(persist_dir: str, embeddings: Embeddings, mmap: bool = True) -> FAISS:
+    """
+    Open a persisted index. ``mmap=True`` gives a read-only store backed by the page
+    cache; ``mmap=False`` loads a writable in-memory copy for incremental builds.
+    A mapped store keeps its generation from being collected until it is garbage collected.
+    """
+    migrate_index(persist_dir)
+    persist_dir = snapshots.resolve(persist_dir)
+    index_path = os.path.join(persist_dir, INDEX_FILE)
+    store = ChunkStore(os.path.join(persist_dir, CHUNKS_DIR))
+
+    if mmap:
+        try:
+            index = faiss.read_index(index_path, MMAP_FLAGS)
+        except RuntimeError:
+            index = faiss.read_index(index_path)
+        vs = FAISS(embeddings, index, ChunkStoreDocstore(store), ChunkRowMap(store))
+        snapshots.track(vs, persist_dir)
+        return vs
+
+    index = faiss.read_index(index_path)
+    docs = dict(store.iter_documents())
+    rows = {row: store.id_at(row) for row in range(len(store))}
+    return FAISS(embeddings, index, InMemoryDocstore(docs), rows)
@@ -0,0 +1,243 @@
+"""
+Streaming ingestion pipeline: extract -> chunk -> embed -> index, in bounded batches.
+
+Extraction and chunking run in a producer thread that feeds a bounded queue;
+the caller's thread embeds ``batch_size`` chunks at a time and appends them to
+the FAISS index. Only a few batches of text and one batch of vectors are ever
+held in memory, and ``on_batch`` fires after every insert so the UI can show
+progress while the build is still running.
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from index_store import IndexManifest, chunk_id_prefix, make_chunk_id
+from ingest import PageBatch
+from sparse_index import BM25Index
+import telemetry
+from vector_index import delete_vectors, empty_vectorstore
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_QUEUE_BATCHES = 4
+
+_DONE = object()
+
+
+class PipelineStats:
+    """Running totals for one pipeline run; passed to ``on_batch`` after each insert."""
+
+    def __init__(self, files_total: int = 0):
+        self.files_total = files_total
+        self.files_done = 0
+        self.pages = 0
+        self.chunks = 0
+        self.batches = 0
+        self.errors: List[Tuple[str, str]] = []
+        self.file_timings: List[dict] = []
+        self.bytes_written = 0  # by the persist step after the run, if any
+        self.started = time.perf_counter()
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+
+def prefetch(items: Iterable, maxsize: int) -> Iterator:
+    """Run ``items`` in a background thread, buffering at most ``maxsize`` results."""
+    q: "queue.Queue" = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Timed, so an abandoned consumer never leaves this thread blocked on a full queue.
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        source = iter(items)
+        try:
+            for item in source:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:  # re-raised in the consumer
+            put(e)
+        finally:
+            # Release what the source holds (e.g. an ingestion pool) once the consumer is gone.
+            close = getattr(source, "close", None)
+            if close is not None:
+                close()
+
+    worker = threading.Thread(target=produce, name="ingest-prefetch", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_chunk_events(
+    page_batches: Iterable[PageBatch],
+    hashes: Dict[str, str],
+    chunk_fn: Callable[[List[Document]], List[Document]],
+) -> Iterator[tuple]:
+    """
+    Flatten page batches into ("chunk", file, id, doc), ("done", file, pages, seconds,
+    chunk seconds) and ("error", file, message) events. Chunk ids are numbered per file
+    in page order.
+    """
+    counters: Dict[str, int] = {}
+    chunk_seconds: Dict[str, float] = {}
+    for batch in page_batches:
+        if batch.error:
+            yield ("error", batch.filename, batch.error)
+        else:
+            prefix = chunk_id_prefix(batch.filename, hashes[batch.filename])
+            started = time.perf_counter()
+            chunks = chunk_fn(batch.docs)
+            chunk_seconds[batch.filename] = chunk_seconds.get(batch.filename, 0.0) + time.perf_counter() - started
+            for chunk in chunks:
+                n = counters.get(batch.filename, 0)
+                counters[batch.filename] = n + 1
+                yield ("chunk", batch.filename, make_chunk_id(prefix, n), chunk)
+        if batch.last:
+            yield ("done", batch.filename, batch.pages, batch.seconds, chunk_seconds.pop(batch.filename, 0.0))
+
+
+def _insert_batch(
+    vs: Optional[FAISS],
+    embeddings: Embeddings,
+    docs: List[Document],
+    vectors: List[List[float]],
+    ids: List[str],
+    index_factory: Optional[Callable[[np.ndarray], "faiss.Index"]] = None,
+) -> FAISS:
+    if vs is None:
+        sample = np.asarray(vectors, dtype=np.float32)
+        index = index_factory(sample) if index_factory else faiss.IndexFlatL2(sample.shape[1])
+        vs = empty_vectorstore(embeddings, index)
+    texts = [d.page_content for d in docs]
+    vs.add_embeddings(zip(texts, vectors), metadatas=[d.metadata for d in docs], ids=ids)
+    return vs
+
+
+def stream_into_index(
+    vs: Optional[FAISS],
+    embeddings: Embeddings,
+    manifest: IndexManifest,
+    page_batches: Iterable[PageBatch],
+    hashes: Dict[str, str],
+    chunk_fn: Callable[[List[Document]], List[Document]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    queue_batches: int = DEFAULT_QUEUE_BATCHES,
+    on_batch: Optional[Callable[[PipelineStats], None]] = None,
+    index_factory: Optional[Callable[[np.ndarray], "faiss.Index"]] = None,
+    train_size: int = 0,
+    sparse: Optional[BM25Index] = None,
+) -> Tuple[Optional[FAISS], PipelineStats]:
+    """
+    Embed and insert every chunk of ``page_batches`` into ``vs``, recording each
+    completed file in ``manifest``. Files that fail mid-way have any vectors already
+    inserted removed again and are not recorded.
+
+    When ``vs`` is None a store is created on first insert, with the index built by
+    ``index_factory`` from the first ``train_size`` embedded vectors (approximate
+    indexes need a training sample); by default an exact flat index.
+
+    ``sparse``, if given, receives the same chunks under the same ids as they are
+    inserted, and loses them again when their file fails.
+    """
+    stats = PipelineStats(files_total=len(hashes))
+    ids_by_file: Dict[str, List[str]] = {}
+    failed: Dict[str, str] = {}
+    finished: List[str] = []
+    pending_docs: List[Document] = []
+    pending_ids: List[str] = []
+    # Embedded but not yet inserted: held back until the training sample is big enough.
+    held_docs: List[Document] = []
+    held_vectors: List[List[float]] = []
+    held_ids: List[str] = []
+
+    def flush(final: bool = False):
+        nonlocal vs, pending_docs, pending_ids, held_docs, held_vectors, held_ids
+        if pending_docs:
+            held_docs += pending_docs
+            with telemetry.span("embed", chunks=len(pending_docs)):
+                held_vectors += embeddings.embed_documents([d.page_content for d in pending_docs])
+            held_ids += pending_ids
+            stats.chunks += len(pending_docs)
+            stats.batches += 1
+            pending_docs, pending_ids = [], []
+        if held_docs and (vs is not None or final or len(held_docs) >= train_size):
+            with telemetry.span("index_add", vectors=len(held_docs)):
+                vs = _insert_batch(vs, embeddings, held_docs, held_vectors, held_ids, index_factory)
+            if sparse is not None:
+                with telemetry.span("bm25_add", chunks=len(held_docs)):
+                    sparse.add(held_ids, [d.page_content for d in held_docs])
+            held_docs, held_vectors, held_ids = [], [], []
+        if held_docs:
+            return
+        # Every "done" seen so far has had all of its chunks inserted.
+        for name in finished:
+            if name not in failed:
+                manifest.record(name, hashes[name], ids_by_file.get(name, []))
+        finished.clear()
+        if on_batch:
+            on_batch(stats)
+
+    events = prefetch(iter_chunk_events(page_batches, hashes, chunk_fn), maxsize=batch_size * queue_batches)
+    try:
+        for event in events:
+            kind, name = event[0], event[1]
+            if kind == "chunk":
+                if name in failed:
+                    continue
+                ids_by_file.setdefault(name, []).append(event[2])
+                pending_docs.append(event[3])
+                pending_ids.append(event[2])
+                if len(pending_docs) >= batch_size:
+                    flush()
+            elif kind == "error":
+                failed.setdefault(name, event[2])
+            else:
+                stats.files_done += 1
+                stats.pages += event[2]
+                stats.file_timings.append({"file": name, "pages": event[2], "seconds": round(event[3], 2)})
+                telemetry.record("extract", event[3], file=name, pages=event[2])
+                telemetry.record("chunk", event[4], file=name, chunks=len(ids_by_file.get(name, [])))
+                finished.append(name)
+        flush(final=True)
+    finally:
+        # Stops the producer now, not when the generator is collected (e.g. a cancelled job's on_batch raised).
+        events.close()
+
+    for name, message in failed.items():
+        stats.errors.append((name, message))
+        inserted = set(ids_by_file.get(name, []))
+        if sparse is not None:
+            sparse.remove(inserted)
+        if vs is not None and inserted:
+            delete_vectors(vs, [i for i in vs.index_to_docstore_id.values() if i in inserted])
+    return vs, stats
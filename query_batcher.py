@@ -0,0 +1,209 @@
+"""
+Micro-batching of concurrent vector searches.
+
+Questions that arrive within ``max_wait_ms`` of each other (up to ``max_batch``
+of them) against the same vector store are embedded in one encoder call and
+answered with one FAISS ``search`` over the query matrix; each caller's future
+then receives its own top-k documents. Everything but the embed + search call
+runs on the caller's event loop, so no locking is needed.
+
+The batcher keeps the last ``LATENCY_WINDOW`` samples of queue wait, embed,
+search and end-to-end time plus batch sizes; ``latency_report`` gives their
+p50 / p99 for tuning the window: a longer ``max_wait_ms`` fills bigger batches
+but every query pays up to that much extra wait.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+import telemetry
+from vector_index import percentile, search_params
+
+DEFAULT_MAX_WAIT_MS = 5.0
+DEFAULT_MAX_BATCH = 32
+LATENCY_WINDOW = 2048
+LATENCY_METRICS = ("wait_ms", "embed_ms", "search_ms", "total_ms", "batch_size")
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """One batched encoder call when the embeddings support it, else one call per question."""
+    batch = getattr(embeddings, "embed_queries", None)
+    return batch(texts) if batch else [embeddings.embed_query(t) for t in texts]
+
+
+def _timed_search(
+    vs: FAISS, queries: List[str], k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+) -> Tuple[List[List[Document]], float, float]:
+    """``search_many`` plus the seconds spent embedding and searching."""
+    started = time.perf_counter()
+    matrix = np.asarray(embed_queries(vs.embedding_function, queries), dtype=np.float32)
+    if vs._normalize_L2:
+        faiss.normalize_L2(matrix)
+    embedded = time.perf_counter()
+    params = search_params(vs.index, nprobe, ef_search)
+    _, rows = vs.index.search(matrix, k, params=params) if params else vs.index.search(matrix, k)
+    searched = time.perf_counter()
+    results = []
+    for found in rows:
+        docs = []
+        for row in found:
+            if row == -1:
+                continue
+            id_ = vs.index_to_docstore_id[int(row)]
+            doc = vs.docstore.search(id_)
+            if isinstance(doc, Document):
+                if doc.id != id_:
+                    # Callers (e.g. hybrid fusion) key hits by the row's docstore id; never mutate the stored doc.
+                    doc = Document(id=id_, page_content=doc.page_content, metadata=doc.metadata)
+                docs.append(doc)
+        results.append(docs)
+    return results, embedded - started, searched - embedded
+
+
+def search_many(
+    vs: FAISS, queries: List[str], k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+) -> List[List[Document]]:
+    """
+    Top-``k`` documents for every query, with one embedding call and one FAISS search.
+    Each document's ``id`` is its docstore id (``index_to_docstore_id`` of its FAISS row).
+    ``nprobe`` / ``ef_search`` override the index's stored values for this search only.
+    """
+    return _timed_search(vs, queries, k, nprobe, ef_search)[0]
+
+
+class _Pending(NamedTuple):
+    query: str
+    k: int
+    future: asyncio.Future
+    enqueued: float
+    trace: Optional[telemetry.Trace]
+
+
+class QueryBatcher:
+    def __init__(self, max_wait_ms: float = DEFAULT_MAX_WAIT_MS, max_batch: int = DEFAULT_MAX_BATCH):
+        self.max_wait_ms = max_wait_ms
+        self.max_batch = max_batch
+        self._queues: Dict[tuple, List[_Pending]] = {}  # (loop, store, nprobe, ef_search) -> waiting queries
+        self._stores: Dict[tuple, FAISS] = {}
+        self.queries = 0
+        self.batches = 0
+        self._samples: Dict[str, Deque[float]] = {m: deque(maxlen=LATENCY_WINDOW) for m in LATENCY_METRICS}
+
+    @property
+    def mean_batch(self) -> float:
+        return self.queries / self.batches if self.batches else 0.0
+
+    async def search(
+        self, vs: FAISS, query: str, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+    ) -> List[Document]:
+        loop = asyncio.get_running_loop()
+        # Only queries with the same search parameters can share one FAISS call.
+        key = (id(loop), id(vs), nprobe, ef_search)
+        future = loop.create_future()
+        queue = self._queues.setdefault(key, [])
+        self._stores[key] = vs
+        queue.append(_Pending(query, k, future, time.perf_counter(), telemetry.current()))
+        if len(queue) >= self.max_batch:
+            self._dispatch(key, queue)
+        elif len(queue) == 1:
+            loop.call_later(self.max_wait_ms / 1000, self._dispatch, key, queue)
+        return await future
+
+    def _dispatch(self, key: tuple, queue: List[_Pending]):
+        # A full batch may already have gone out before this window's timer fires.
+        if self._queues.get(key) is not queue:
+            return
+        del self._queues[key]
+        asyncio.ensure_future(self._run(self._stores.pop(key), queue, *key[2:]))
+
+    async def _run(
+        self, vs: FAISS, batch: Sequence[_Pending], nprobe: Optional[int] = None, ef_search: Optional[int] = None
+    ):
+        self.batches += 1
+        self.queries += len(batch)
+        dispatched = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            results, embed_s, search_s = await loop.run_in_executor(
+                None, _timed_search, vs, [p.query for p in batch], max(p.k for p in batch), nprobe, ef_search
+            )
+        except Exception as e:
+            for p in batch:
+                if not p.future.done():
+                    p.future.set_exception(e)
+            return
+        finished = time.perf_counter()
+        size, k = len(batch), max(p.k for p in batch)
+        self._samples["batch_size"].append(size)
+        self._samples["embed_ms"].append(embed_s * 1000)
+        self._samples["search_ms"].append(search_s * 1000)
+        # Embed and search are shared by the batch: counted once in the metrics, shown in every trace.
+        telemetry.record_metrics("embed_query", embed_s, {"batch_size": size})
+        telemetry.record_metrics("faiss_search", search_s, {"batch_size": size})
+        for p, docs in zip(batch, results):
+            self._samples["wait_ms"].append((dispatched - p.enqueued) * 1000)
+            self._samples["total_ms"].append((finished - p.enqueued) * 1000)
+            telemetry.record_metrics("batch_wait", dispatched - p.enqueued, {})
+            if p.trace is not None:
+                p.trace.add("batch_wait", dispatched - p.enqueued, p.enqueued, metrics=False, batch_size=size)
+                p.trace.add("embed_query", embed_s, dispatched, metrics=False, batch_size=size)
+                p.trace.add("faiss_search", search_s, dispatched + embed_s, metrics=False, batch_size=size, k=k)
+            if not p.future.done():
+                p.future.set_result(docs[:p.k])
+
+    def latency_report(self) -> Dict[str, dict]:
+        """p50 / p99 of each metric over the recent samples (per query for waits and totals, per batch otherwise)."""
+        report = {}
+        for metric, samples in self._samples.items():
+            values = list(samples)
+            report[metric] = {
+                "p50": round(percentile(values, 50), 3) if values else None,
+                "p99": round(percentile(values, 99), 3) if values else None,
+                "n": len(values),
+            }
+        return report
+
+    def reset_stats(self):
+        self.queries = self.batches = 0
+        for samples in self._samples.values():
+            samples.clear()
+
+    def stats(self) -> dict:
+        return {
+            "queries": self.queries,
+            "batches": self.batches,
+            "mean_batch": round(self.mean_batch, 2),
+            "max_wait_ms": self.max_wait_ms,
+            "max_batch": self.max_batch,
+            "latency": self.latency_report(),
+        }
+
+
+class BatchedRetriever(BaseRetriever):
+    """Vector retriever whose async path goes through a shared ``QueryBatcher``."""
+
+    vectorstore: FAISS
+    batcher: QueryBatcher
+    k: int = 4
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return search_many(self.vectorstore, [query], self.k, self.nprobe, self.ef_search)[0]
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await self.batcher.search(self.vectorstore, query, self.k, self.nprobe, self.ef_search)
@@ -0,0 +1,391 @@
+"""
+Asyncio retrieval + generation engine.
+
+The RAG steps (retrieve, build the prompt, generate) run as coroutines on one
+background event loop instead of inside the caller's thread. Many questions can
+be in flight at once without a thread each: generation awaits the LLM client's
+async streaming API, and only the CPU-bound retrieval and query embedding go to
+a small, fixed thread pool. A semaphore caps concurrent LLM calls and every
+stage has a timeout. Retrieved chunks reach the prompt through
+``context_builder.pack_context``, within ``context_tokens`` (the engine's default
+or the caller's per-request budget). Each stage is a
+``telemetry`` span of the trace that was active when the request started.
+
+Streamlit uses the blocking bridges (``retrieve``, ``stream``, ``answer``) from
+its script thread; async callers such as an HTTP API await ``aretrieve``,
+``astream`` and ``aanswer`` directly on their own loop.
+"""
+
+import asyncio
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Dict, Hashable, Iterator, List, NamedTuple, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.retrievers import BaseRetriever
+
+from answer_cache import AnswerCache, template_version
+from context_builder import DEFAULT_CONTEXT_TOKENS, estimate_tokens, pack_context
+import telemetry
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_RETRIEVAL_WORKERS = 4
+DEFAULT_RETRIEVE_TIMEOUT_S = 15.0
+DEFAULT_GENERATE_TIMEOUT_S = 120.0
+
+# -----------------------------
+# System Prompts
+# -----------------------------
+
+ANSWER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """
+You are an AI college assistant. Answer the user's question using ONLY the provided context.
+- If the answer is not in the context, say you don't have that info.
+- Quote important definitions briefly.
+- Return a concise, structured answer.
+- After the answer, add a 'Sources' line listing file names and pages from the context.
+"""),
+    ("user", "Question: {question}\n\nContext:\n{context}\n\nReturn your answer."),
+])
+
+MCQ_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """
+Create exam-style MCQs from the provided context. Each MCQ must have:
+- A clear question
+- 4 options (A–D)
+- Correct answer key
+- 1-line explanation
+
+Return 5 MCQs in a clean numbered list.
+"""),
+    ("user", "Generate MCQs on: {topic}\n\nContext:\n{context}"),
+])
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Summarize the context into 5 crisp bullet points for quick revision."),
+    ("user", "Summarize topic: {topic}\n\nContext:\n{context}"),
+])
+
+# task -> (prompt, name of the prompt variable the query fills)
+TASKS: Dict[str, Tuple[ChatPromptTemplate, str]] = {
+    "chat": (ANSWER_PROMPT, "question"),
+    "mcq": (MCQ_PROMPT, "topic"),
+    "summary": (SUMMARY_PROMPT, "topic"),
+}
+
+_END = object()
+
+
+def format_sources(docs: List[Document]) -> str:
+    seen = []
+    for d in docs:
+        tag = f"{d.metadata.get('source','?')} p.{d.metadata.get('page','?')}"
+        if tag not in seen:
+            seen.append(tag)
+    return "; ".join(seen)
+
+
+class GenerationRun:
+    """Timing of one streamed answer: time to first token and total generation time."""
+
+    def __init__(self, trace: Optional[telemetry.Trace] = None):
+        self.trace = trace or telemetry.current()  # stages of this answer are recorded here
+        self.started = time.perf_counter()
+        self.first_token_s: Optional[float] = None
+        self.total_s: Optional[float] = None
+        self.cached = False
+        self.timed_out = False
+        self.context_tokens: Optional[int] = None
+        self.tokens_saved = 0
+
+    def token(self):
+        if self.first_token_s is None:
+            self.first_token_s = time.perf_counter() - self.started
+
+    def finish(self):
+        self.total_s = time.perf_counter() - self.started
+
+    def caption(self) -> str:
+        if self.cached:
+            return f"⚡ cached answer ({(self.total_s or 0) * 1000:.0f} ms)"
+        if self.first_token_s is None:
+            return "no tokens generated"
+        caption = f"first token {self.first_token_s * 1000:.0f} ms · total {self.total_s or 0:.1f}s"
+        if self.context_tokens is not None:
+            caption += f" · context ~{self.context_tokens} tokens ({self.tokens_saved} saved)"
+        return caption
+
+
+class CacheContext(NamedTuple):
+    """What the engine needs to consult an answer cache for one index, with the caller's reuse settings."""
+
+    cache: AnswerCache
+    fingerprint: str
+    embeddings: Embeddings
+    threshold: Optional[float] = None  # None: the cache's own
+    ttl_s: Optional[float] = None
+
+
+class RagAnswer(NamedTuple):
+    text: str
+    sources: str
+    chunk_ids: List[str]
+    cached: bool
+    first_token_s: Optional[float]
+    total_s: Optional[float]
+
+
+class RagEngine:
+    def __init__(
+        self,
+        llm: BaseChatModel,
+        llm_key: Hashable = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        retrieval_workers: int = DEFAULT_RETRIEVAL_WORKERS,
+        retrieve_timeout_s: float = DEFAULT_RETRIEVE_TIMEOUT_S,
+        generate_timeout_s: float = DEFAULT_GENERATE_TIMEOUT_S,
+        context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+    ):
+        self.llm = llm
+        self.llm_key = llm_key  # distinguishes cached answers of differently configured LLMs
+        self._tuned: Dict[float, BaseChatModel] = {}  # temperature -> copy of ``llm`` sharing its client
+        self.retrieve_timeout_s = retrieve_timeout_s
+        self.generate_timeout_s = generate_timeout_s
+        self.context_tokens = context_tokens
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.prompt_tokens = 0
+        self.tokens_saved = 0
+        self._executor = ThreadPoolExecutor(retrieval_workers, thread_name_prefix="rag-retrieve")
+        self._slots = weakref.WeakKeyDictionary()  # event loop -> its semaphore
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._tuned_lock = threading.Lock()
+
+    # ---- background loop (for synchronous callers) ----
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(self._executor)
+                threading.Thread(target=loop.run_forever, name="rag-engine", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def call(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """Run ``coro`` on the engine loop and block the calling thread for its result."""
+        return asyncio.run_coroutine_threadsafe(telemetry.bind(coro), self.loop).result(timeout)
+
+    def iterate(self, agen: AsyncIterator) -> Iterator:
+        """Drive an async iterator on the engine loop from a synchronous caller."""
+
+        async def step():
+            try:
+                return await agen.__anext__()
+            except StopAsyncIteration:
+                return _END
+
+        try:
+            while True:
+                item = self.call(step())
+                if item is _END:
+                    return
+                yield item
+        finally:
+            # The consumer may stop early (e.g. Streamlit rerun); release the LLM stream
+            # without waiting, since this can also run from the garbage collector.
+            asyncio.run_coroutine_threadsafe(agen.aclose(), self.loop)
+
+    # ---- async API ----
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self._slots:
+            self._slots[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._slots[loop]
+
+    async def aretrieve(self, retriever: BaseRetriever, query: str) -> List[Document]:
+        with telemetry.span("retrieve", retriever=type(retriever).__name__, k=getattr(retriever, "k", None)) as attrs:
+            try:
+                docs = await asyncio.wait_for(retriever.ainvoke(query), self.retrieve_timeout_s)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise TimeoutError(f"Retrieval timed out after {self.retrieve_timeout_s:.0f}s") from None
+            attrs["docs"] = len(docs)
+            return docs
+
+    def _llm(self, temperature: Optional[float]) -> BaseChatModel:
+        """``llm`` with this call's temperature; copies are cached, so no request builds a client."""
+        if temperature is None or "temperature" not in type(self.llm).model_fields:
+            return self.llm
+        with self._tuned_lock:
+            if temperature not in self._tuned:
+                self._tuned[temperature] = self.llm.model_copy(update={"temperature": temperature})
+            return self._tuned[temperature]
+
+    async def _cache_lookup(
+        self,
+        cache_ctx: CacheContext,
+        task: str,
+        query: str,
+        docs: List[Document],
+        context_tokens: int,
+        temperature: Optional[float],
+    ):
+        loop = asyncio.get_running_loop()
+        question_vec = await loop.run_in_executor(None, cache_ctx.embeddings.embed_query, query)
+        namespace = (task, template_version(TASKS[task][0]), self.llm_key, temperature, context_tokens)
+        chunk_ids = [d.id or d.page_content for d in docs]
+        hit = cache_ctx.cache.lookup(
+            cache_ctx.fingerprint, namespace, question_vec, chunk_ids, cache_ctx.threshold, cache_ctx.ttl_s
+        )
+        return hit, (cache_ctx.fingerprint, namespace, question_vec, chunk_ids)
+
+    async def astream(
+        self,
+        task: str,
+        query: str,
+        docs: List[Document],
+        run: Optional[GenerationRun] = None,
+        cache_ctx: Optional[CacheContext] = None,
+        context_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the answer for ``task`` ("chat", "mcq" or "summary") over ``docs``, timing
+        it in ``run``. ``context_tokens`` and ``temperature`` override the engine's budget
+        and the LLM's temperature for this call.
+        A cached answer is yielded in one piece; errors and timeouts are appended to the
+        partial text and never cached.
+        """
+        prompt, field = TASKS[task]
+        run = run or GenerationRun()
+        budget = context_tokens or self.context_tokens
+        cache_key = None
+        if cache_ctx is not None:
+            with telemetry.span("answer_cache", run.trace) as attrs:
+                hit, cache_key = await self._cache_lookup(cache_ctx, task, query, docs, budget, temperature)
+                attrs["cache_hit"] = hit is not None
+            if hit is not None:
+                run.cached = True
+                run.token()
+                run.finish()
+                yield hit.answer
+                return
+
+        with telemetry.span("pack_context", run.trace, docs=len(docs), budget=budget) as attrs:
+            packed = pack_context(docs, budget)
+            attrs.update(tokens=packed.tokens, tokens_saved=packed.tokens_saved, passages=packed.passages)
+        run.context_tokens = packed.tokens
+        run.tokens_saved = packed.tokens_saved
+        self.prompt_tokens += packed.tokens
+        self.tokens_saved += packed.tokens_saved
+        messages = prompt.format_messages(context=packed.text, **{field: query})
+        parts: List[str] = []
+        with telemetry.span("llm", run.trace, task=task, prompt_tokens=packed.tokens) as llm_attrs:
+            self.in_flight += 1
+            try:
+                async with self._semaphore():
+                    llm_attrs["queued_ms"] = round((time.perf_counter() - run.started) * 1000, 1)
+                    deadline = time.monotonic() + self.generate_timeout_s
+                    stream = self._llm(temperature).astream(messages).__aiter__()
+                    try:
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(stream.__anext__(), deadline - time.monotonic())
+                            except StopAsyncIteration:
+                                break
+                            if not chunk.content:
+                                continue
+                            run.token()
+                            parts.append(chunk.content)
+                            yield chunk.content
+                    finally:
+                        await stream.aclose()
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                run.timed_out = True
+                run.finish()
+                llm_attrs.update(status="error", error="timeout")
+                yield f"\n\n⏱️ Generation timed out after {self.generate_timeout_s:.0f}s."
+                return
+            except Exception as e:
+                run.finish()
+                llm_attrs.update(status="error", error=f"{type(e).__name__}: {e}")
+                yield f"\n\nLLM error: {e}"
+                return
+            finally:
+                self.in_flight -= 1
+                if run.first_token_s is not None:
+                    llm_attrs["first_token_ms"] = round(run.first_token_s * 1000, 1)
+                llm_attrs["tokens"] = estimate_tokens("".join(parts))
+        run.finish()
+        self.completed += 1
+        if cache_key is not None and parts:
+            cache_ctx.cache.store(*cache_key, "".join(parts))
+
+    async def aanswer(
+        self,
+        task: str,
+        retriever: BaseRetriever,
+        query: str,
+        cache_ctx: Optional[CacheContext] = None,
+        context_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+    ) -> RagAnswer:
+        """Retrieve, generate and collect the whole answer (for non-streaming callers)."""
+        docs = await self.aretrieve(retriever, query)
+        run = GenerationRun()
+        parts = [part async for part in self.astream(task, query, docs, run, cache_ctx, context_tokens, temperature)]
+        return RagAnswer(
+            "".join(parts), format_sources(docs) if docs else "(no sources)",
+            [d.id for d in docs], run.cached, run.first_token_s, run.total_s,
+        )
+
+    # ---- blocking bridges ----
+
+    def retrieve(self, retriever: BaseRetriever, query: str) -> List[Document]:
+        return self.call(self.aretrieve(retriever, query))
+
+    def stream(
+        self,
+        task: str,
+        query: str,
+        docs: List[Document],
+        run: Optional[GenerationRun] = None,
+        cache_ctx: Optional[CacheContext] = None,
+        context_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+    ) -> Iterator[str]:
+        return self.iterate(self.astream(task, query, docs, run, cache_ctx, context_tokens, temperature))
+
+    def answer(
+        self,
+        task: str,
+        retriever: BaseRetriever,
+        query: str,
+        cache_ctx: Optional[CacheContext] = None,
+        context_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+    ) -> RagAnswer:
+        return self.call(self.aanswer(task, retriever, query, cache_ctx, context_tokens, temperature))
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "max_concurrency": self.max_concurrency,
+            "context_tokens": self.context_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "tokens_saved": self.tokens_saved,
+        }
@@ -0,0 +1,91 @@
+"""
+Process-wide registry for heavy, shareable resources.
+
+Streamlit re-executes ``app.py`` on every widget interaction, but imported
+modules stay loaded, so objects held here survive reruns and are shared by
+every browser session in the server process: embedding model weights, the LLM
+client, embedding-cache connections and loaded FAISS indexes. Entries are keyed
+by (kind, settings) and stay until explicitly evicted. Pinned entries are
+process singletons that own threads, sockets or pools (the metrics server, the
+engine's event loop, the job queue); ``evict`` never drops them.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+Key = Tuple[str, Hashable]
+
+
+class ResourceRegistry:
+    def __init__(self):
+        self._items: Dict[Key, Any] = {}
+        self._created: Dict[Key, float] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Key, threading.Lock] = {}
+        self._pinned: Set[Key] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, kind: str, key: Hashable, factory: Callable[[], Any], pinned: bool = False) -> Any:
+        """
+        Return the cached resource, building it once even if several sessions ask concurrently.
+        ``pinned`` entries live as long as the process: ``evict`` skips them.
+        """
+        full = (kind, key)
+        with self._lock:
+            if full in self._items:
+                self.hits += 1
+                return self._items[full]
+            key_lock = self._key_locks.setdefault(full, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if full in self._items:
+                    self.hits += 1
+                    return self._items[full]
+            value = factory()
+            with self._lock:
+                self._items[full] = value
+                self._created[full] = time.time()
+                if pinned:
+                    self._pinned.add(full)
+                self.misses += 1
+            return value
+
+    def get(self, kind: str, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            return self._items.get((kind, key))
+
+    def put(self, kind: str, key: Hashable, value: Any):
+        """Replace an entry, e.g. after an index was rebuilt and persisted."""
+        with self._lock:
+            self._items[(kind, key)] = value
+            self._created[(kind, key)] = time.time()
+
+    def evict(self, kind: Optional[str] = None, key: Optional[Hashable] = None) -> int:
+        """Drop one entry, every entry of ``kind``, or everything but pinned entries; returns how many were dropped."""
+        with self._lock:
+            doomed = [
+                k for k in self._items
+                if k not in self._pinned and (kind is None or k[0] == kind) and (key is None or k[1] == key)
+            ]
+            # Only references are dropped: sessions still holding the object keep a
+            # working copy until they finish with it, then it is garbage collected.
+            for k in doomed:
+                self._items.pop(k)
+                self._created.pop(k, None)
+                self._key_locks.pop(k, None)
+        return len(doomed)
+
+    def entries(self) -> List[dict]:
+        with self._lock:
+            return [
+                {
+                    "kind": kind, "key": str(key), "age_s": round(time.time() - self._created[(kind, key)]),
+                    "pinned": (kind, key) in self._pinned,
+                }
+                for kind, key in self._items
+            ]
+
+
+REGISTRY = ResourceRegistry()
@@ -0,0 +1,163 @@
+"""
+Content-addressed, reference-counted in-memory indexes shared between sessions.
+
+Without persistence every browser session used to build its own FAISS index,
+so a class uploading the same syllabus embedded it once per student. Here an
+in-memory index is keyed by what it contains: the ``{file name: content hash}``
+set, the embedding/chunk settings and the index type. Before a build the app
+predicts the key of the index it is about to produce; if another session has
+already built it, the session attaches to that one instead of extracting and
+embedding anything.
+
+Shared indexes are never modified. A session that extends or trims its index
+``checkout``s a writable copy (or takes the original over when it is the only
+user) and ``publish``es the result under its new key. Each attached session
+holds a ``Lease``; the index is dropped from the pool when the last lease is
+released, explicitly or when the session that held it is garbage collected.
+"""
+
+import copy
+import hashlib
+import json
+import threading
+import weakref
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from langchain_community.vectorstores import FAISS
+
+from index_store import IndexManifest
+from sparse_index import BM25Index
+from vector_index import build_params, copy_vectorstore
+
+
+def content_key(files: Dict[str, str], settings: dict, index_config: Optional[dict] = None) -> str:
+    """
+    Address of an index holding ``files`` ({name: content hash}) built with ``settings`` / ``index_config``.
+    Only the parameters that apply to the index kind count, so e.g. an unused IVF list count on a
+    flat index does not split identical indexes into separate copies.
+    """
+    state = {"files": files, "settings": settings, "index": build_params(index_config)}
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()[:24]
+
+
+def manifest_files(manifest: IndexManifest) -> Dict[str, str]:
+    return {name: entry["hash"] for name, entry in manifest.files.items()}
+
+
+class SharedIndex(NamedTuple):
+    key: str
+    vs: FAISS
+    sparse: BM25Index
+    manifest: IndexManifest
+
+
+class Lease:
+    """One session's claim on a shared index; keep it as long as the session uses the index."""
+
+    def __init__(self, pool: "SharedIndexPool", index: SharedIndex):
+        self.index = index
+        self._release = weakref.finalize(self, pool._release, index.key)
+
+    @property
+    def key(self) -> str:
+        return self.index.key
+
+    @property
+    def active(self) -> bool:
+        return self._release.alive
+
+    def release(self):
+        self._release()
+
+
+class SharedIndexPool:
+    def __init__(self):
+        self._entries: Dict[str, SharedIndex] = {}
+        self._refs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.attaches = 0
+        self.builds = 0
+
+    def predict_key(
+        self,
+        base: Optional[IndexManifest],
+        uploads: Dict[str, str],
+        remove: Iterable[str],
+        settings: dict,
+        index_config: Optional[dict] = None,
+    ) -> str:
+        """
+        Key of the index an update would produce: ``base``'s files (none if its settings
+        differ, which forces a rebuild) minus ``remove``, plus ``uploads``.
+        """
+        files = manifest_files(base) if base is not None and base.compatible(settings) else {}
+        for name in remove:
+            files.pop(name, None)
+        files.update(uploads)
+        return content_key(files, settings, index_config)
+
+    def _lease(self, entry: SharedIndex) -> Lease:
+        self._refs[entry.key] = self._refs.get(entry.key, 0) + 1
+        return Lease(self, entry)
+
+    def attach(self, key: str) -> Optional[Lease]:
+        """A lease on the index stored under ``key``, or None if no session has built it."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self.attaches += 1
+            return self._lease(entry)
+
+    def publish(
+        self, vs: FAISS, sparse: BM25Index, manifest: IndexManifest, index_config: Optional[dict] = None
+    ) -> Lease:
+        """Share a freshly built index; if an identical one appeared meanwhile, attach to that one instead."""
+        key = content_key(manifest_files(manifest), manifest.settings, index_config)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = SharedIndex(key, vs, sparse, manifest)
+                self.builds += 1
+            else:
+                self.attaches += 1
+            return self._lease(entry)
+
+    def checkout(self, lease: Optional[Lease]) -> Tuple[Optional[FAISS], Optional[BM25Index], IndexManifest]:
+        """
+        Writable index, BM25 and manifest to update in place, releasing ``lease``. The sole
+        user takes the shared objects over (no copy); otherwise it gets private copies.
+        """
+        if lease is None or not lease.active:
+            return None, None, IndexManifest()
+        entry = lease.index
+        with self._lock:
+            sole = self._refs.get(entry.key) == 1 and self._entries.get(entry.key) is entry
+            if sole:
+                self._entries.pop(entry.key)
+        lease.release()
+        if sole:
+            return entry.vs, entry.sparse, entry.manifest
+        manifest = IndexManifest(copy.deepcopy(entry.manifest.files), dict(entry.manifest.settings))
+        return copy_vectorstore(entry.vs), copy.deepcopy(entry.sparse), manifest
+
+    def _release(self, key: str):
+        with self._lock:
+            refs = self._refs.get(key, 0) - 1
+            if refs > 0:
+                self._refs[key] = refs
+                return
+            self._refs.pop(key, None)
+            # Sessions still mid-query keep their reference; the index is freed after them.
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            vectors = sum(e.vs.index.ntotal for e in self._entries.values())
+            return {
+                "indexes": len(self._entries),
+                "sessions": sum(self._refs.values()),
+                "vectors": vectors,
+                "builds": self.builds,
+                "attaches": self.attaches,
+            }
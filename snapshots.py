@@ -0,0 +1,301 @@
+"""
+Versioned index snapshots with an atomic switch-over.
+
+Saving straight over a live index directory meant a crash mid-save left it
+half written, and a reader in another worker could open a new ``index.faiss``
+next to the old ``chunks/``. An index directory is now a series of immutable
+generations plus a pointer:
+
+    rag_index/
+        CURRENT          "gen-000007"
+        gen-000006/      index.faiss, chunks/, sparse_index.json, manifest.json
+        gen-000007/
+
+A writer fills a hidden staging directory (``begin``), and ``publish`` fsyncs
+it, renames it to the next ``gen-NNNNNN`` and atomically replaces ``CURRENT``.
+Readers resolve ``CURRENT`` on every load (``resolve``: one ``stat``, the file
+is only re-read when it was replaced), so a worker notices a new generation on
+its next query without a restart; directories written before snapshots (files
+directly in ``rag_index/``) resolve to themselves.
+
+Old generations are deleted by ``collect`` once nothing in this process still
+reads them: memory-mapped indexes are ``track``ed, and the generation they map
+is kept until the last of them is garbage collected, i.e. after the queries
+using it have finished. The newest ``keep`` old generations always stay, so
+readers in other processes that resolved ``CURRENT`` just before a switch can
+still open theirs.
+
+Writers of one index are serialized by ``writer``, an exclusive lock on
+``persist_dir/.lock`` shared by every thread and process (API workers, the
+Streamlit server, background jobs). Hold it from reading the base index through
+``publish``; otherwise two builds of the same generation each drop the other's
+files, or race for the same ``gen-NNNNNN`` name. ``writer(..., blocking=False)``
+raises ``WriterBusy`` instead of waiting, for callers with other work to do.
+"""
+
+import os
+import re
+import shutil
+import threading
+import uuid
+import weakref
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+DEFAULT_KEEP = 1
+
+_GEN_RE = re.compile(r"gen-(\d{6,})")
+_STAGING_RE = re.compile(r"\.staging-(\d+)-[0-9a-f]+")
+# Files of the flat layout written before snapshots; removed once a generation replaces them.
+_FLAT_NAMES = (
+    "index.faiss", "index.pkl", "chunks", "chunks.tmp", "chunks.old",
+    "sparse_index.json", "manifest.json",
+)
+
+_lock = threading.RLock()  # finalizers can run while it is held
+_pins: Dict[str, int] = {}  # generation directory -> live tracked readers
+_sources: "weakref.WeakKeyDictionary[Any, str]" = weakref.WeakKeyDictionary()
+_pointers: Dict[str, Tuple[Tuple[int, int], Optional[str]]] = {}  # index dir -> (CURRENT inode/mtime, name)
+_held = threading.local()  # index dirs whose writer lock this thread holds
+_local_locks: Dict[str, threading.Lock] = {}  # without fcntl
+_published = 0  # generations published by this process
+
+
+class WriterBusy(Exception):
+    """Another thread or process holds the index's writer lock."""
+
+
+def _number(path: str) -> int:
+    match = _GEN_RE.fullmatch(os.path.basename(path))
+    return int(match.group(1)) if match else 0
+
+
+def current_generation(persist_dir: Optional[str]) -> Optional[str]:
+    """Name of the generation ``CURRENT`` points to, or None (nothing published yet, or the flat layout)."""
+    if not persist_dir:
+        return None
+    pointer = os.path.join(persist_dir, CURRENT_FILE)
+    try:
+        st = os.stat(pointer)
+    except FileNotFoundError:
+        return None
+    # ``publish`` replaces the file, so a new generation always means a new inode.
+    stamp = (st.st_ino, st.st_mtime_ns)
+    key = os.path.abspath(persist_dir)
+    with _lock:
+        cached = _pointers.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    try:
+        with open(pointer, "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    if not _GEN_RE.fullmatch(name) or not os.path.isdir(os.path.join(persist_dir, name)):
+        name = None
+    with _lock:
+        _pointers[key] = (stamp, name)
+    return name
+
+
+def resolve(persist_dir: str) -> str:
+    """The directory holding ``persist_dir``'s current files: its live generation, or itself."""
+    name = current_generation(persist_dir)
+    return os.path.join(persist_dir, name) if name else persist_dir
+
+
+def generations(persist_dir: str) -> List[str]:
+    """Published generation directories, oldest first."""
+    if not os.path.isdir(persist_dir):
+        return []
+    found = [os.path.join(persist_dir, n) for n in os.listdir(persist_dir) if _GEN_RE.fullmatch(n)]
+    return sorted(found, key=_number)
+
+
+@contextmanager
+def writer(persist_dir: str, blocking: bool = True) -> Iterator[None]:
+    """
+    Exclusive write access to ``persist_dir`` across threads and processes. Re-entrant
+    within a thread, so code already holding it (e.g. a build loading its base) can nest.
+    With ``blocking=False``, raises ``WriterBusy`` rather than waiting for another writer.
+    """
+    key = os.path.abspath(persist_dir)
+    held = _held.__dict__.setdefault("dirs", set())
+    if key in held:
+        yield
+        return
+    os.makedirs(key, exist_ok=True)
+    if fcntl is None:
+        with _lock:
+            lock = _local_locks.setdefault(key, threading.Lock())
+        if not lock.acquire(blocking):
+            raise WriterBusy(key)
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            lock.release()
+        return
+    # flock is per open file, so threads of one process exclude each other too.
+    with open(os.path.join(key, LOCK_FILE), "a+b") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise WriterBusy(key) from None
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def begin(persist_dir: str) -> str:
+    """A new, empty staging directory inside ``persist_dir`` for the next generation."""
+    staged = os.path.join(persist_dir, f".staging-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(staged)
+    return staged
+
+
+def discard(staged: str):
+    """Drop a staging directory that will not be published (no-op once it has been)."""
+    shutil.rmtree(staged, ignore_errors=True)
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    except OSError:
+        return  # directories cannot be opened (or synced) on every platform
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_tree(path: str):
+    for root, _, names in os.walk(path):
+        for name in names:
+            with open(os.path.join(root, name), "rb") as f:
+                os.fsync(f.fileno())
+        _fsync_dir(root)
+
+
+def publish(persist_dir: str, staged: str, keep: int = DEFAULT_KEEP) -> str:
+    """
+    Make ``staged`` the live generation: fsync it, rename it to the next ``gen-NNNNNN``,
+    then atomically replace ``CURRENT``. Returns the new generation directory.
+    Takes the ``writer`` lock if the caller does not already hold it.
+    """
+    with writer(persist_dir):
+        return _publish(persist_dir, staged, keep)
+
+
+def published() -> int:
+    """How many generations this process has published; a change means some index may have appeared."""
+    return _published
+
+
+def _publish(persist_dir: str, staged: str, keep: int) -> str:
+    global _published
+    _fsync_tree(staged)
+    latest = generations(persist_dir)
+    final = os.path.join(persist_dir, f"gen-{(_number(latest[-1]) if latest else 0) + 1:06d}")
+    os.rename(staged, final)
+    _fsync_dir(persist_dir)
+
+    pointer = os.path.join(persist_dir, CURRENT_FILE)
+    tmp = f"{pointer}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(final))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, pointer)
+    _fsync_dir(persist_dir)
+    with _lock:
+        _published += 1
+    collect(persist_dir, keep)
+    return final
+
+
+def track(obj: Any, directory: str):
+    """Record that ``obj`` reads ``directory``; the generation is not collected while ``obj`` is alive."""
+    directory = os.path.abspath(directory)
+    with _lock:
+        _pins[directory] = _pins.get(directory, 0) + 1
+        _sources[obj] = directory
+    weakref.finalize(obj, _release, directory)
+
+
+def source(obj: Any) -> Optional[str]:
+    """The directory a ``track``ed object was loaded from."""
+    with _lock:
+        return _sources.get(obj)
+
+
+def _release(directory: str):
+    with _lock:
+        refs = _pins.get(directory, 0) - 1
+        if refs > 0:
+            _pins[directory] = refs
+            return
+        _pins.pop(directory, None)
+    persist_dir = os.path.dirname(directory) if _GEN_RE.fullmatch(os.path.basename(directory)) else directory
+    try:
+        collect(persist_dir)
+    except OSError:
+        pass  # retried on the next publish
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def collect(persist_dir: str, keep: int = DEFAULT_KEEP) -> int:
+    """
+    Delete generations older than the live one, except the newest ``keep`` of them and any
+    still read in this process, plus staging directories of dead writers. Returns how many went.
+    """
+    current_name = current_generation(persist_dir)
+    if current_name is None:
+        return 0
+    persist_dir = os.path.abspath(persist_dir)
+    current = os.path.join(persist_dir, current_name)
+    older = [g for g in generations(persist_dir) if _number(g) < _number(current)]
+    if any(os.path.exists(os.path.join(persist_dir, n)) for n in _FLAT_NAMES):
+        older.insert(0, persist_dir)  # the flat layout is the oldest "generation"
+    doomed = older[: max(len(older) - keep, 0)]
+    with _lock:
+        doomed = [d for d in doomed if d not in _pins]
+
+    removed = 0
+    for directory in doomed:
+        if directory == persist_dir:
+            for name in _FLAT_NAMES:
+                path = os.path.join(persist_dir, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+        removed += 1
+    for name in os.listdir(persist_dir):
+        match = _STAGING_RE.fullmatch(name)
+        if match and not _pid_alive(int(match.group(1))):
+            shutil.rmtree(os.path.join(persist_dir, name), ignore_errors=True)  # left by a crashed writer
+    return removed
@@ -0,0 +1,257 @@
+"""
+BM25 inverted index over chunk texts, and hybrid BM25 + vector retrieval.
+
+MiniLM embeddings blur exact tokens such as course codes, cipher names and
+formula symbols ("Hill Cipher", "CSMA/CD"). The inverted index is filled in the
+same batches as the FAISS index and keyed by the same chunk ids, so adds and
+deletes stay in step with the vectors and the manifest. ``HybridRetriever``
+fuses both rankings with reciprocal rank fusion.
+
+Postings are plain dicts while the index changes and are frozen into numpy
+arrays per term on first use, so a query is a handful of vectorised updates
+over the matching slots rather than a Python loop over every chunk.
+"""
+
+import asyncio
+import json
+import math
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+from query_batcher import QueryBatcher, search_many
+import snapshots
+import telemetry
+
+SPARSE_INDEX_FILE = "sparse_index.json"
+RETRIEVAL_MODES = ("vector", "hybrid")
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+DEFAULT_RRF_K = 60
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[/+.\-][a-z0-9]+)*")
+_JOINER_RE = re.compile(r"[/+.\-]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased alphanumeric tokens. Joined tokens such as ``csma/cd`` or ``802.11`` are
+    kept whole and also split into their parts, so either spelling matches.
+    """
+    tokens = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        tokens.append(tok)
+        if not tok.isalnum():
+            tokens.extend(part for part in _JOINER_RE.split(tok) if part)
+    return tokens
+
+
+def _term_counts(text: str) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for tok in tokenize(text):
+        counts[tok] = counts.get(tok, 0) + 1
+    return counts
+
+
+class BM25Index:
+    """Okapi BM25 over chunk ids, with incremental ``add`` / ``remove``."""
+
+    def __init__(self, k1: float = DEFAULT_K1, b: float = DEFAULT_B):
+        self.k1 = k1
+        self.b = b
+        self._slot: Dict[str, int] = {}  # chunk id -> slot
+        self._ids: List[Optional[str]] = []  # slot -> chunk id (None once removed)
+        self._terms: List[Optional[Dict[str, int]]] = []  # slot -> term counts
+        self._lengths: List[int] = []
+        self._postings: Dict[str, Dict[int, int]] = {}  # term -> {slot: tf}
+        self._total_len = 0
+        self._frozen: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._len_arr: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._slot)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self._slot
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self._postings)
+
+    def _add_counts(self, chunk_id: str, counts: Dict[str, int]):
+        if chunk_id in self._slot:
+            self.remove([chunk_id])
+        slot = len(self._ids)
+        self._slot[chunk_id] = slot
+        self._ids.append(chunk_id)
+        self._terms.append(counts)
+        length = sum(counts.values())
+        self._lengths.append(length)
+        self._total_len += length
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[slot] = tf
+            self._frozen.pop(term, None)
+        self._len_arr = None
+
+    def add(self, ids: Sequence[str], texts: Sequence[str]):
+        """Index ``texts`` under ``ids``; re-adding an id replaces its previous text."""
+        for chunk_id, text in zip(ids, texts):
+            self._add_counts(chunk_id, _term_counts(text))
+
+    def remove(self, ids: Iterable[str]) -> int:
+        removed = 0
+        for chunk_id in ids:
+            slot = self._slot.pop(chunk_id, None)
+            if slot is None:
+                continue
+            for term in self._terms[slot]:
+                postings = self._postings[term]
+                postings.pop(slot, None)
+                if not postings:
+                    del self._postings[term]
+                self._frozen.pop(term, None)
+            self._total_len -= self._lengths[slot]
+            self._ids[slot] = None
+            self._terms[slot] = None
+            removed += 1
+        if removed:
+            self._len_arr = None
+        return removed
+
+    def _term_arrays(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        arrays = self._frozen.get(term)
+        if arrays is None:
+            postings = self._postings.get(term)
+            if not postings:
+                return None
+            arrays = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float32, count=len(postings)),
+            )
+            self._frozen[term] = arrays
+        return arrays
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Top-``k`` ``(chunk id, score)`` pairs for ``query``, best first."""
+        n = len(self._slot)
+        if not n or k <= 0:
+            return []
+        if self._len_arr is None:
+            self._len_arr = np.asarray(self._lengths, dtype=np.float32)
+        avg_len = self._total_len / n or 1.0
+        scores = np.zeros(len(self._ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            arrays = self._term_arrays(term)
+            if arrays is None:
+                continue
+            slots, tf = arrays
+            idf = math.log(1 + (n - len(slots) + 0.5) / (len(slots) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._len_arr[slots] / avg_len)
+            scores[slots] += idf * tf * (self.k1 + 1) / (tf + norm)
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self._ids[s], float(scores[s])) for s in matched]
+
+    @classmethod
+    def from_vectorstore(cls, vs: FAISS, **kwargs) -> "BM25Index":
+        """Rebuild from the chunks already in ``vs``, e.g. for an index persisted before BM25 existed."""
+        index = cls(**kwargs)
+        for _, chunk_id in sorted(vs.index_to_docstore_id.items()):
+            doc = vs.docstore.search(chunk_id)
+            if isinstance(doc, Document):
+                index.add([chunk_id], [doc.page_content])
+        return index
+
+    def save(self, persist_dir: str):
+        path = os.path.join(persist_dir, SPARSE_INDEX_FILE)
+        tmp = path + ".tmp"
+        docs = [[chunk_id, self._terms[slot]] for chunk_id, slot in self._slot.items()]
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "docs": docs}, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, persist_dir: Optional[str]) -> Optional["BM25Index"]:
+        """The saved index (compacted: removed slots are not reloaded), or None if there is none."""
+        path = os.path.join(snapshots.resolve(persist_dir), SPARSE_INDEX_FILE) if persist_dir else None
+        if not path or not os.path.isfile(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(data.get("k1", DEFAULT_K1), data.get("b", DEFAULT_B))
+        for chunk_id, counts in data["docs"]:
+            index._add_counts(chunk_id, counts)
+        return index
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Reciprocal rank fusion of FAISS similarity search and BM25 over the same chunks.
+    With a ``batcher``, the async path shares batched dense searches with other queries.
+    """
+
+    vectorstore: FAISS
+    sparse: BM25Index
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = DEFAULT_RRF_K
+    batcher: Optional[QueryBatcher] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+    def _fuse(self, query: str, dense: List[Document], fetch_k: int) -> List[Document]:
+        docs: Dict[str, Document] = {}
+        scores: Dict[str, float] = {}
+        for rank, doc in enumerate(dense):
+            key = doc.id  # the docstore id from search_many, the same key BM25 hits use
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        with telemetry.span("bm25_search", k=fetch_k) as attrs:
+            sparse_hits = self.sparse.search(query, fetch_k)
+            attrs["docs"] = len(sparse_hits)
+        for rank, (chunk_id, _) in enumerate(sparse_hits):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        results = []
+        for key in ranked:
+            doc = docs.get(key)
+            if doc is None:
+                doc = self.vectorstore.docstore.search(key)
+                if not isinstance(doc, Document):
+                    continue  # deleted from the vectors but not yet from BM25
+            results.append(doc)
+            if len(results) == self.k:
+                break
+        return results
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        fetch_k = max(self.fetch_k, self.k)
+        with telemetry.span("vector_search", k=fetch_k):
+            dense = search_many(self.vectorstore, [query], fetch_k, self.nprobe, self.ef_search)[0]
+        return self._fuse(query, dense, fetch_k)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        fetch_k = max(self.fetch_k, self.k)
+        if self.batcher is not None:
+            dense = await self.batcher.search(self.vectorstore, query, fetch_k, self.nprobe, self.ef_search)
+        else:
+            with telemetry.span("vector_search", k=fetch_k):
+                found = await asyncio.get_running_loop().run_in_executor(
+                    None, search_many, self.vectorstore, [query], fetch_k, self.nprobe, self.ef_search
+                )
+            dense = found[0]
+        return self._fuse(query, dense, fetch_k)
@@ -0,0 +1,315 @@
+"""
+Per-request tracing and Prometheus-style metrics.
+
+A *trace* is one user request (a chat question, an MCQ or summary request, an
+ingest). Code on the hot path opens *spans* for its stages — PDF extraction,
+chunking, embedding, FAISS search, BM25, cache lookup, context packing, the LLM
+call — with sizes (pages, chunks, tokens, k) and cache-hit flags as attributes:
+
+    with telemetry.trace("chat", k=4):
+        with telemetry.span("retrieve", k=4) as attrs:
+            docs = ...
+            attrs["docs"] = len(docs)
+
+Finished traces are
+
+- logged as one JSON line on the ``rag.trace`` logger (``setup_logging``),
+- folded into ``METRICS``: request and stage latency histograms plus item and
+  cache counters, rendered in the Prometheus text format by ``render_metrics``
+  (served on ``/metrics`` by the API, or by ``start_metrics_server``), and
+- kept in a short in-process history for debug panels (``recent``).
+
+The active trace lives in a context variable. Work handed to another thread or
+event loop takes it along explicitly: ``bind`` wraps a coroutine for
+``run_coroutine_threadsafe``, and long-lived objects (a streamed answer, a
+batched query) hold the ``Trace`` they were created under. Spans opened outside
+any trace still feed the metrics.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Awaitable, Deque, Dict, Iterator, List, Optional, Tuple
+
+LOGGER_NAME = "rag.trace"
+RECENT_TRACES = 50
+# Seconds; covers a sub-millisecond FAISS search up to a slow multi-file ingest.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Numeric span attributes summed into rag_stage_items_total.
+ITEM_ATTRS = ("pages", "chunks", "docs", "tokens", "tokens_saved", "batch_size", "vectors", "bytes")
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(LOGGER_NAME)
+_current: ContextVar[Optional["Trace"]] = ContextVar("rag_trace", default=None)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Tuple[Tuple[str, Any], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Metrics:
+    """Counters and fixed-bucket histograms, rendered in the Prometheus text exposition format."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        self._histograms: Dict[str, Dict[Tuple, List[float]]] = {}  # counts per bucket + [sum, count]
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def _describe(self, name: str, kind: str, help_text: str):
+        self._help.setdefault(name, (kind, help_text))
+
+    def inc(self, name: str, value: float = 1.0, help_text: str = "", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._describe(name, "counter", help_text)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, help_text: str = "", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._describe(name, "histogram", help_text)
+            series = self._histograms.setdefault(name, {})
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-2] += seconds
+            counts[-1] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                kind, help_text = self._help[name]
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{_labels(key)} {value:g}" for key, value in sorted(series.items())]
+            for name, series in sorted(self._histograms.items()):
+                kind, help_text = self._help[name]
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for key, counts in sorted(series.items()):
+                    for bound, count in zip(self.buckets, counts):
+                        lines.append(f"{name}_bucket{_labels(key + (('le', f'{bound:g}'),))} {count:g}")
+                    lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {counts[-1]:g}")
+                    lines.append(f"{name}_sum{_labels(key)} {counts[-2]:.6f}")
+                    lines.append(f"{name}_count{_labels(key)} {counts[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+_recent: Deque["Trace"] = deque(maxlen=RECENT_TRACES)
+
+
+def record_metrics(name: str, seconds: float, attrs: Dict[str, Any]):
+    METRICS.observe("rag_stage_seconds", seconds, "Duration of one request stage", stage=name)
+    for item in ITEM_ATTRS:
+        value = attrs.get(item)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            METRICS.inc("rag_stage_items_total", value, "Items processed per stage", stage=name, item=item)
+    if isinstance(attrs.get("cache_hit"), bool):
+        result = "hit" if attrs["cache_hit"] else "miss"
+        METRICS.inc("rag_cache_lookups_total", 1, "Cache lookups by stage and result", stage=name, result=result)
+    if attrs.get("status") == "error":
+        METRICS.inc("rag_stage_errors_total", 1, "Stages that raised", stage=name)
+
+
+class Trace:
+    def __init__(self, name: str, **attrs):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs: Dict[str, Any] = dict(attrs)
+        self.wall_start = time.time()
+        self.started = time.perf_counter()
+        self.seconds: Optional[float] = None
+        self.spans: List[dict] = []
+        self._lock = threading.Lock()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, name: str, seconds: float, start: Optional[float] = None, metrics: bool = True, **attrs):
+        """
+        Record a finished stage; ``start`` is a ``perf_counter`` value (default: ``seconds`` ago).
+        ``metrics=False`` keeps a stage shared by several traces (a batched search) from being counted once per trace.
+        """
+        start = time.perf_counter() - seconds if start is None else start
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((start - self.started) * 1000, 3),
+                "duration_ms": round(seconds * 1000, 3),
+                "attrs": attrs,
+            })
+        if metrics:
+            record_metrics(name, seconds, attrs)
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[Dict[str, Any]]:
+        started = time.perf_counter()
+        try:
+            yield attrs
+        except (GeneratorExit, asyncio.CancelledError):
+            attrs.setdefault("status", "cancelled")
+            raise
+        except BaseException as e:
+            attrs.setdefault("status", "error")
+            attrs.setdefault("error", f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            self.add(name, time.perf_counter() - started, started, **attrs)
+
+    def finish(self, status: str = "ok"):
+        if self.seconds is not None:
+            return
+        self.seconds = time.perf_counter() - self.started
+        self.attrs.setdefault("status", status)
+        METRICS.inc("rag_requests_total", 1, "Requests by kind and status", kind=self.name, status=self.attrs["status"])
+        METRICS.observe("rag_request_seconds", self.seconds, "End-to-end request duration", kind=self.name)
+        _recent.append(self)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(self.to_dict(), default=str, separators=(",", ":")))
+
+    def timeline(self) -> List[dict]:
+        """Spans in start order, flattened for a table."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return [
+            {"stage": s["name"], "start_ms": s["start_ms"], "duration_ms": s["duration_ms"], **s["attrs"]}
+            for s in spans
+        ]
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "ts": round(self.wall_start, 3),
+            "duration_ms": round(self.seconds * 1000, 3) if self.seconds is not None else None,
+            "attrs": self.attrs,
+            "spans": spans,
+        }
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def use(tr: Optional[Trace]) -> Iterator[Optional[Trace]]:
+    """Make ``tr`` the active trace for this block without finishing it afterwards."""
+    token = _current.set(tr)
+    try:
+        yield tr
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def trace(name: str, **attrs) -> Iterator[Trace]:
+    """Start a trace, make it active for the block, and finish (log + metrics) it on exit."""
+    tr = Trace(name, **attrs)
+    status = "ok"
+    try:
+        with use(tr):
+            yield tr
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        tr.finish(status)
+
+
+@contextmanager
+def span(name: str, parent: Optional[Trace] = None, **attrs) -> Iterator[Dict[str, Any]]:
+    """Time a stage of the active (or ``parent``) trace; without one, only the metrics are recorded."""
+    tr = parent or current()
+    if tr is not None:
+        with tr.span(name, **attrs) as span_attrs:
+            yield span_attrs
+        return
+    started = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        record_metrics(name, time.perf_counter() - started, attrs)
+
+
+def record(name: str, seconds: float, parent: Optional[Trace] = None, start: Optional[float] = None, **attrs):
+    """Record a stage timed elsewhere (e.g. in a worker process)."""
+    tr = parent or current()
+    if tr is not None:
+        tr.add(name, seconds, start, **attrs)
+    else:
+        record_metrics(name, seconds, attrs)
+
+
+async def _run_in(tr: Optional[Trace], coro: Awaitable) -> Any:
+    with use(tr):
+        return await coro
+
+
+def bind(coro: Awaitable) -> Awaitable:
+    """Carry the caller's active trace into ``coro`` when it runs on another thread's event loop."""
+    tr = current()
+    return _run_in(tr, coro) if tr is not None else coro
+
+
+def recent(n: int = 10) -> List[Trace]:
+    """The last ``n`` finished traces, newest first."""
+    return list(_recent)[::-1][:n]
+
+
+def render_metrics() -> str:
+    return METRICS.render()
+
+
+def setup_logging(level: int = logging.INFO):
+    """Write one JSON line per finished trace to stderr (idempotent)."""
+    if not any(getattr(h, "_rag_trace", False) for h in logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler._rag_trace = True
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve ``/metrics`` from a daemon thread, for processes without their own HTTP routes (Streamlit)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,69 @@
+import random
+import textwrap
+
+import pytest
+from langchain.docstore.document import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from chunker import Chunker
+
+WORDS = "cipher key block stream modular matrix inverse prime field hash digest nonce".split()
+
+
+def _pages(seed: int, n: int = 12):
+    """Wrapped paragraphs, blank-line runs, stray spaces and unbreakable runs: every separator level."""
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(n):
+        paragraphs = []
+        for _ in range(rng.randint(1, 5)):
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 150)))
+            if rng.random() < 0.2:
+                text += " " + "x" * rng.randint(50, 900)
+            paragraphs.append("\n".join(textwrap.wrap(text, rng.choice((40, 70, 120)))))
+        pages.append(rng.choice(("\n\n", "\n\n\n", " \n\n", "\n \n")).join(paragraphs))
+    return pages
+
+
+FIXED_PAGES = [
+    "",
+    "   \n\n  ",
+    "short page",
+    "Unit 1\n\nHill cipher uses a key matrix.\nIts inverse mod 26 decrypts.\n\n\nUnit 2\n\nRSA.",
+    "a" * 1000,
+    "word " * 400,
+    "line one\nline two\nline three\n" * 40,
+    "para one.\n\npara two is a little longer than the first.\n\n" * 30,
+    "mixed  double  spaces\tand\ttabs\n\n\n\nthen   more " * 25,
+]
+
+
+def _split(splitter, pages):
+    docs = [Document(page_content=p, metadata={"page": i}) for i, p in enumerate(pages)]
+    return splitter.split_documents(docs)
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(50, 0), (50, 10), (120, 40), (300, 0), (300, 120), (800, 120)])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_same_chunks_as_recursive_splitter(chunk_size, chunk_overlap, seed):
+    pages = FIXED_PAGES + _pages(seed)
+    ref = _split(RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap), pages)
+    ours = _split(Chunker(chunk_size, chunk_overlap), pages)
+    assert [(d.page_content, d.metadata) for d in ours] == [(d.page_content, d.metadata) for d in ref]
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(50, 10), (300, 120)])
+def test_start_index_is_the_real_offset(chunk_size, chunk_overlap):
+    # A repeated passage: the splitter re-finds chunk text, so only Chunker is guaranteed exact here.
+    pages = FIXED_PAGES + _pages(2)
+    for doc in _split(Chunker(chunk_size, chunk_overlap, add_start_index=True), pages):
+        page = pages[doc.metadata["page"]]
+        start = doc.metadata["start_index"]
+        assert page[start:start + len(doc.page_content)] == doc.page_content
+
+
+def test_start_index_matches_splitter_without_repeats():
+    pages = ["Unit 1\n\nHill cipher uses a key matrix.\nIts inverse mod 26 decrypts.\n\n\nUnit 2\n\nRSA keys."]
+    ref = _split(RecursiveCharacterTextSplitter(chunk_size=30, chunk_overlap=10, add_start_index=True), pages)
+    ours = _split(Chunker(30, 10, add_start_index=True), pages)
+    assert [d.metadata["start_index"] for d in ours] == [d.metadata["start_index"] for d in ref]
@@ -0,0 +1,131 @@
+import gc
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import snapshots
+
+
+class Reader:
+    """Stands in for a memory-mapped index: anything weak-referenceable can pin a generation."""
+
+
+def _stage(persist_dir, content):
+    staged = snapshots.begin(str(persist_dir))
+    with open(os.path.join(staged, "index.faiss"), "w") as f:
+        f.write(content)
+    return staged
+
+
+def _read(persist_dir):
+    with open(os.path.join(snapshots.resolve(str(persist_dir)), "index.faiss")) as f:
+        return f.read()
+
+
+def _names(persist_dir):
+    return sorted(n for n in os.listdir(persist_dir) if n != snapshots.LOCK_FILE)
+
+
+def test_publish_flips_the_pointer(tmp_path):
+    assert snapshots.resolve(str(tmp_path)) == str(tmp_path)
+    assert snapshots.current_generation(str(tmp_path)) is None
+
+    first = snapshots.publish(str(tmp_path), _stage(tmp_path, "v1"))
+    assert os.path.basename(first) == "gen-000001"
+    assert snapshots.current_generation(str(tmp_path)) == "gen-000001"
+    assert _read(tmp_path) == "v1"
+
+    staged = _stage(tmp_path, "v2")
+    assert _read(tmp_path) == "v1"  # staged files are invisible until published
+    snapshots.publish(str(tmp_path), staged)
+    assert snapshots.current_generation(str(tmp_path)) == "gen-000002"
+    assert _read(tmp_path) == "v2"
+    assert not os.path.exists(staged)
+
+
+def test_old_generations_beyond_keep_are_collected(tmp_path):
+    for v in range(4):
+        snapshots.publish(str(tmp_path), _stage(tmp_path, f"v{v}"), keep=1)
+    assert _names(tmp_path) == [snapshots.CURRENT_FILE, "gen-000003", "gen-000004"]
+
+
+def test_pinned_generation_is_kept_until_its_reader_is_gone(tmp_path):
+    first = snapshots.publish(str(tmp_path), _stage(tmp_path, "v1"))
+    reader = Reader()
+    snapshots.track(reader, first)
+    assert snapshots.source(reader) == os.path.abspath(first)
+
+    for v in range(2, 5):
+        snapshots.publish(str(tmp_path), _stage(tmp_path, f"v{v}"), keep=0)
+    assert _names(tmp_path) == [snapshots.CURRENT_FILE, "gen-000001", "gen-000004"]
+    assert _read(tmp_path) == "v4"
+    assert snapshots.collect(str(tmp_path), keep=0) == 0
+
+    del reader
+    gc.collect()
+    assert snapshots.collect(str(tmp_path), keep=0) == 1
+    assert _names(tmp_path) == [snapshots.CURRENT_FILE, "gen-000004"]
+
+
+def test_staging_left_by_a_dead_writer_is_collected(tmp_path):
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    dead = tmp_path / f".staging-{child.pid}-deadbeef"
+    dead.mkdir()
+    live = snapshots.begin(str(tmp_path))  # this process: still writing
+
+    snapshots.publish(str(tmp_path), _stage(tmp_path, "v1"))
+    assert not dead.exists()
+    assert os.path.isdir(live)
+    snapshots.discard(live)
+
+
+def test_flat_layout_is_replaced_by_the_first_generation(tmp_path):
+    for name in ("index.faiss", "index.pkl", "manifest.json", "sparse_index.json"):
+        (tmp_path / name).write_text("flat")
+    (tmp_path / "chunks").mkdir()
+    (tmp_path / "chunks" / "text.bin").write_text("flat")
+    (tmp_path / "notes.txt").write_text("not ours")
+    assert snapshots.resolve(str(tmp_path)) == str(tmp_path)
+    assert _read(tmp_path) == "flat"
+
+    snapshots.publish(str(tmp_path), _stage(tmp_path, "v1"), keep=1)
+    assert _read(tmp_path) == "v1"
+    assert (tmp_path / "index.faiss").exists()  # kept as the one older "generation"
+
+    snapshots.publish(str(tmp_path), _stage(tmp_path, "v2"), keep=1)
+    assert _names(tmp_path) == [snapshots.CURRENT_FILE, "gen-000001", "gen-000002", "notes.txt"]
+
+
+def test_writer_is_reentrant_and_creates_the_directory(tmp_path):
+    target = tmp_path / "new_index"
+    with snapshots.writer(str(target)):
+        with snapshots.writer(str(target)):
+            snapshots.publish(str(target), _stage(target, "v1"))
+    assert (target / snapshots.LOCK_FILE).exists()
+    assert _read(target) == "v1"
+
+
+def test_nonblocking_writer_reports_a_busy_index(tmp_path):
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with snapshots.writer(str(tmp_path)):
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    try:
+        with pytest.raises(snapshots.WriterBusy):
+            with snapshots.writer(str(tmp_path), blocking=False):
+                pass
+    finally:
+        release.set()
+        thread.join()
+    with snapshots.writer(str(tmp_path), blocking=False):
+        pass
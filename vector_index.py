@@ -0,0 +1,238 @@
+"""
+Selectable FAISS index types for the vector store.
+
+``FAISS.from_documents`` always builds an exact ``IndexFlatL2``, so query time
+grows linearly with the number of chunks. This module builds the approximate
+alternatives (IVF-Flat, IVF-PQ, HNSW), trains them on a sample, sets their
+query-time knobs (nprobe / efSearch), converts an existing store between types,
+and measures recall@k and latency of candidate configurations against the
+exact flat baseline.
+"""
+
+import math
+import time
+from typing import Dict, List, Optional, Sequence
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+DEFAULT_PQ_M = 16
+DEFAULT_HNSW_M = 32
+DEFAULT_NPROBE = 8  # stored in IVF indexes when built; FAISS defaults to 1
+DEFAULT_EF_SEARCH = 64  # stored in HNSW indexes when built; FAISS defaults to 16
+# Build parameters that shape each index type (query-time knobs are not part of an index's identity).
+INDEX_PARAMS = {
+    "flat": {},
+    "ivf_flat": {"nlist": 0},
+    "ivf_pq": {"nlist": 0, "pq_m": DEFAULT_PQ_M},
+    "hnsw": {"hnsw_m": DEFAULT_HNSW_M},
+}
+TRAIN_POINTS_PER_LIST = 39  # below this FAISS k-means warns about too few points
+AUTO_NLIST_TRAIN = 256  # lists to budget training for when nlist is chosen automatically
+
+
+def suggest_nlist(n: int) -> int:
+    """Rule of thumb: about 4*sqrt(n) inverted lists, never more than the training sample supports."""
+    return max(1, min(int(4 * math.sqrt(max(n, 1))), max(1, n // TRAIN_POINTS_PER_LIST)))
+
+
+def build_params(index_config: Optional[dict]) -> dict:
+    """``index_config`` reduced to its kind and the build parameters of that kind, defaults filled in."""
+    config = dict(index_config or {})
+    kind = config.get("kind", "flat")
+    params = {name: config.get(name, default) for name, default in INDEX_PARAMS.get(kind, {}).items()}
+    return {"kind": kind, **params}
+
+
+def train_size(kind: str, nlist: int) -> int:
+    """How many vectors to buffer before an index of ``kind`` can be trained."""
+    if kind in ("ivf_flat", "ivf_pq"):
+        return max((nlist or AUTO_NLIST_TRAIN) * TRAIN_POINTS_PER_LIST, 256 if kind == "ivf_pq" else 1)
+    return 0
+
+
+def make_index(
+    kind: str,
+    sample: np.ndarray,
+    nlist: int = 0,
+    pq_m: int = DEFAULT_PQ_M,
+    hnsw_m: int = DEFAULT_HNSW_M,
+) -> faiss.Index:
+    """Build an empty index of ``kind`` for vectors like ``sample``, trained on it if required."""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {kind!r}; expected one of {INDEX_TYPES}")
+    sample = np.ascontiguousarray(sample, dtype=np.float32)
+    dim = sample.shape[1]
+    if kind == "flat":
+        return faiss.IndexFlatL2(dim)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efSearch = DEFAULT_EF_SEARCH
+        return index
+
+    nlist = min(nlist or suggest_nlist(len(sample)), len(sample))
+    quantizer = faiss.IndexFlatL2(dim)
+    if kind == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    else:
+        # PQ needs dim divisible by m; fall back to the largest divisor <= pq_m.
+        m = max(d for d in range(1, min(pq_m, dim) + 1) if dim % d == 0)
+        nbits = 8 if len(sample) >= 256 else max(1, int(math.log2(max(len(sample), 2))))
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits)
+    index.train(sample)
+    index.nprobe = min(DEFAULT_NPROBE, nlist)
+    # Keep id -> list offsets so vectors can be reconstructed for rebuilds and reports.
+    index.make_direct_map()
+    return index
+
+
+def index_kind(index: faiss.Index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def set_search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Apply query-time recall/latency knobs; ignored by index types that do not have them."""
+    if nprobe and isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(nprobe, index.nlist)
+    if ef_search and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def search_params(
+    index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+) -> Optional[faiss.SearchParameters]:
+    """
+    The same knobs as per-query parameters for ``index.search(..., params=...)``, leaving a
+    shared index untouched. None when nothing applies, i.e. search with the stored values.
+    """
+    if nprobe and isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=min(nprobe, index.nlist))
+    if ef_search and isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+
+def all_vectors(index: faiss.Index) -> np.ndarray:
+    """Reconstruct every stored vector (exact for flat/HNSW/IVF-Flat, approximate for IVF-PQ)."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def empty_vectorstore(embeddings: Embeddings, index: faiss.Index) -> FAISS:
+    return FAISS(embeddings, index, InMemoryDocstore(), {})
+
+
+def copy_vectorstore(vs: FAISS) -> FAISS:
+    """Independent writable copy: cloned index, docstore and id map (the Documents themselves are shared)."""
+    docs = {id_: vs.docstore.search(id_) for id_ in vs.index_to_docstore_id.values()}
+    return FAISS(
+        vs.embedding_function, faiss.clone_index(vs.index), InMemoryDocstore(docs), dict(vs.index_to_docstore_id),
+        normalize_L2=vs._normalize_L2, distance_strategy=vs.distance_strategy,
+    )
+
+
+def convert_vectorstore(
+    vs: FAISS, kind: str, nlist: int = 0, pq_m: int = DEFAULT_PQ_M, hnsw_m: int = DEFAULT_HNSW_M
+) -> FAISS:
+    """Move every vector of ``vs`` into a fresh index of ``kind``; documents and ids are kept."""
+    vectors = all_vectors(vs.index)
+    vs.index = make_index(kind, vectors, nlist, pq_m, hnsw_m)
+    if len(vectors):
+        vs.index.add(vectors)
+    return vs
+
+
+def delete_vectors(vs: FAISS, ids: Sequence[str]) -> int:
+    """
+    Delete docstore ids from ``vs`` for any index type.
+
+    Flat indexes compact on ``remove_ids`` exactly the way ``FAISS.delete`` renumbers
+    its id map. IVF keeps the original ids and HNSW cannot remove at all, so those
+    are rebuilt from the surviving vectors, reusing the trained quantizer.
+    """
+    doomed = set(ids)
+    if not doomed:
+        return 0
+    if isinstance(vs.index, faiss.IndexFlat):
+        vs.delete(list(doomed))
+        return len(doomed)
+
+    keep_rows = [i for i, id_ in sorted(vs.index_to_docstore_id.items()) if id_ not in doomed]
+    vectors = all_vectors(vs.index)[keep_rows] if keep_rows else None
+    rebuilt = faiss.clone_index(vs.index)
+    rebuilt.reset()
+    if isinstance(rebuilt, faiss.IndexIVF):
+        rebuilt.make_direct_map()
+    if vectors is not None:
+        rebuilt.add(vectors)
+    new_map = {row: vs.index_to_docstore_id[old] for row, old in enumerate(keep_rows)}
+    vs.docstore.delete(list(doomed))
+    vs.index = rebuilt
+    vs.index_to_docstore_id = new_map
+    return len(doomed)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def recall_latency_report(
+    vectors: np.ndarray,
+    configs: Sequence[Dict],
+    k: int = 4,
+    n_queries: int = 200,
+    seed: int = 0,
+) -> List[dict]:
+    """
+    Build each config (``{"kind", "nlist", "pq_m", "hnsw_m", "nprobe", "ef_search"}``) over
+    ``vectors`` and compare its top-k against exact flat search for a sample of stored
+    vectors used as queries. Returns one row per config with recall@k and per-query
+    latency percentiles in milliseconds.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+    k = min(k, len(vectors))
+
+    baseline = faiss.IndexFlatL2(vectors.shape[1])
+    baseline.add(vectors)
+    _, truth = baseline.search(queries, k)
+
+    rows = []
+    for cfg in [{"kind": "flat"}] + [c for c in configs if c.get("kind") != "flat"]:
+        started = time.perf_counter()
+        index = make_index(
+            cfg["kind"], vectors, cfg.get("nlist", 0), cfg.get("pq_m", DEFAULT_PQ_M), cfg.get("hnsw_m", DEFAULT_HNSW_M)
+        )
+        index.add(vectors)
+        build_s = time.perf_counter() - started
+        set_search_params(index, cfg.get("nprobe"), cfg.get("ef_search"))
+
+        latencies, hits = [], 0
+        for qi in range(len(queries)):
+            t0 = time.perf_counter()
+            _, found = index.search(queries[qi:qi + 1], k)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            hits += len(set(found[0]) & set(truth[qi]))
+        rows.append({
+            **cfg,
+            "recall@k": round(hits / (len(queries) * k), 4) if k else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "build_s": round(build_s, 3),
+        })
+    return rows